@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+古い買い物リストをアイテム・購入履歴ごとアーカイブ用のテーブルへ移すスクリプト（定期実行用）
+
+使い方:
+    python archive_old_lists.py [--days 365] [--user-id ユーザーID]
+
+日数を省略した場合は ARCHIVE_AFTER_DAYS（既定 365）を使う。
+"""
+
+import argparse
+import sys
+import time
+from utils.db_utils import archive_old_lists
+
+def main():
+    parser = argparse.ArgumentParser(description="古い買い物リストのアーカイブ")
+    parser.add_argument("--days", type=int, help="この日数より前の日付のリストを移す")
+    parser.add_argument("--user-id", type=int, help="対象のユーザーID（省略時は全ユーザー）")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = archive_old_lists(args.user_id, args.days)
+    if counts is None:
+        print("エラーが発生しました。ログを確認してください。")
+        sys.exit(1)
+
+    for table, count in counts.items():
+        print(f"  {table}: {count}件")
+    print(f"完了しました（{time.perf_counter() - start:.1f}秒）")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+複数の利用者が同時に使ったときの負荷テスト
+
+一時的なSQLiteデータベースに利用者ごとのデータ（店舗・カテゴリ・商品・過去の買い物・今回のリスト）を作成し、
+N人の利用者を同時に動かす。各利用者は Streamlit のテストハーネス（AppTest）で実際のページを次の順に操作する。
+AppTest は実行中のランタイムをプロセス全体で1つだけ持つため、利用者ごとに別のプロセスで動かす
+（DBの競合・接続数は実際と同じだが、1つのサーバープロセス内でのCPUの取り合いは含まない）。
+
+1. ログイン（pages/01_ホーム.py のログインフォーム）
+2. リストを開く（pages/02_リスト編集.py）
+3. 買い物モードでアイテムをチェックし、購入を記録する（pages/03_店舗リスト.py）
+4. 支出分析を開き、分析の種類を切り替える（pages/04_支出分析.py）
+
+2〜4 を --iterations 回繰り返し、ページごとの再実行（rerun）のレイテンシのパーセンタイルと
+1秒あたりの再実行数を表示する。--users に複数の人数を指定すると人数ごとに計測する。
+
+Usage:
+    python benchmarks/load_test.py [--users 1 5 10] [--iterations 3] [--items 40] [--history-lists 8]
+"""
+import argparse
+import datetime
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = {
+    "home": os.path.join(ROOT, "pages", "01_ホーム.py"),
+    "edit": os.path.join(ROOT, "pages", "02_リスト編集.py"),
+    "shop": os.path.join(ROOT, "pages", "03_店舗リスト.py"),
+    "analytics": os.path.join(ROOT, "pages", "04_支出分析.py"),
+}
+PASSWORD = "password"
+STORE_NAMES = ["スーパーA", "スーパーB", "ドラッグストア"]
+CATEGORY_NAMES = ["野菜", "肉・魚", "乳製品", "日用品"]
+# ページ間で引き継ぐセッションの値（ページ遷移の代わり）
+SESSION_KEYS = ["user_id", "user_name", "user_email", "user_token", "principal", "current_list_id"]
+
+def seed(db_utils, users: int, items: int, history_lists: int) -> list:
+    """利用者ごとのデータを作成し、(メールアドレス, 今回のリストID) のリストを返す"""
+    today = datetime.date.today()
+    shoppers = []
+    for i in range(users):
+        email = f"shopper{i}@example.com"
+        user_id = db_utils.register_user(email, PASSWORD, f"利用者{i}").id
+        store_ids = [db_utils.create_store(user_id, name).id for name in STORE_NAMES]
+        category_ids = [db_utils.create_category(name, user_id).id for name in CATEGORY_NAMES]
+        item_ids = [
+            db_utils.create_item(f"商品{n}", user_id, category_id=category_ids[n % len(category_ids)]).id
+            for n in range(items)
+        ]
+        # 支出分析・予測の対象になる過去の買い物（週1回、商品の4分の1を購入）
+        for h in range(history_lists):
+            list_date = today - datetime.timedelta(days=7 * (h + 1))
+            list_id = db_utils.create_shopping_list(user_id=user_id, name=f"{list_date}の買い物", date=list_date).id
+            for n in range(0, items, 4):
+                price = 100 + 10 * n
+                line_id = db_utils.add_item_to_shopping_list(
+                    list_id, item_ids[n], store_id=store_ids[n % len(store_ids)], planned_price=price).id
+                purchase = db_utils.record_purchase(line_id, actual_price=price)
+                db_utils.update_purchase_date(purchase.id, datetime.datetime.combine(list_date, datetime.time(12)))
+        # 今回の買い物リスト
+        list_id = db_utils.create_shopping_list(user_id=user_id, name="今週の買い物").id
+        for n, item_id in enumerate(item_ids):
+            db_utils.add_item_to_shopping_list(
+                list_id, item_id, store_id=store_ids[n % len(store_ids)], planned_price=100 + 10 * n, quantity=1 + n % 3)
+        db_utils.close_db_session()
+        shoppers.append((email, list_id))
+    return shoppers
+
+class Recorder:
+    """ページごとの再実行のレイテンシとエラーを集計する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = {}
+
+    def run(self, page: str, action):
+        """action（AppTestの再実行）の時間を計測する"""
+        start = time.perf_counter()
+        try:
+            at = action()
+            error = str(at.exception[0].value) if at.exception else None
+        except Exception as e:  # タイムアウトなど
+            at, error = None, f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[page].append(elapsed)
+            if error:
+                self.errors[page] += 1
+                self.error_samples.setdefault(page, error)
+        return at
+
+def _carry_session(source, target):
+    for key in SESSION_KEYS:
+        if key in source.session_state:
+            target.session_state[key] = source.session_state[key]
+
+def journey(email: str, list_id: int, iterations: int, ticks: int, recorder: Recorder, start):
+    """1人の利用者の操作（ログイン → リスト → 買い物モード → 支出分析 を繰り返す）"""
+    from streamlit.testing.v1 import AppTest
+    apps = {page: AppTest.from_file(path, default_timeout=120) for page, path in PAGES.items()}
+    start.wait()
+
+    # ログイン
+    home = recorder.run("home", apps["home"].run)
+    if home is None:
+        return
+    login_inputs = [t for t in home.text_input if t.label in ("メールアドレス", "パスワード") and t.key is None]
+    if len(login_inputs) < 2:
+        return
+    login_inputs[0].input(email)
+    login_inputs[1].input(PASSWORD)
+    login_button = next(b for b in home.button if b.label == "ログイン")
+    home = recorder.run("home", lambda: login_button.click().run())
+    if home is None or not home.session_state["user_id"]:
+        return
+    home.session_state["current_list_id"] = list_id
+
+    for iteration in range(iterations):
+        # リストを開く
+        _carry_session(home, apps["edit"])
+        recorder.run("edit", apps["edit"].run)
+
+        # 買い物モード: アイテムをチェックし、1件の購入を記録
+        shop = apps["shop"]
+        _carry_session(home, shop)
+        if recorder.run("shop", shop.run) is None:
+            continue
+        # 要素は再実行ごとに作り直されるため、操作のたびに最新の画面から取り出す
+        for n in range(min(ticks, len(shop.checkbox))):
+            recorder.run("shop", lambda: shop.checkbox[n].set_value(not shop.checkbox[n].value).run())
+        buy_buttons = [b for b in shop.button if b.label == "購入記録"]
+        if buy_buttons:
+            recorder.run("shop", lambda: buy_buttons[iteration % len(buy_buttons)].click().run())
+            submit = next((b for b in shop.button if b.label == "記録する"), None)
+            if submit is not None:
+                recorder.run("shop", lambda: submit.click().run())
+
+        # 支出分析: 分析の種類を順に切り替える
+        analytics = apps["analytics"]
+        _carry_session(home, analytics)
+        if recorder.run("analytics", analytics.run) is None:
+            continue
+        view = analytics.radio(key="analytics_view")
+        for option in view.options[1:] + view.options[:1]:
+            recorder.run("analytics", lambda: analytics.radio(key="analytics_view").set_value(option).run())
+
+def _quiet_logs():
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    logging.getLogger("utils").setLevel(logging.WARNING)
+
+def _shopper_process(email: str, list_id: int, iterations: int, ticks: int, start, results):
+    """1人の利用者を動かす子プロセス（結果は results のキューに入れる）"""
+    sys.path.insert(0, ROOT)
+    _quiet_logs()
+    recorder = Recorder()
+    try:
+        journey(email, list_id, iterations, ticks, recorder, start)
+    finally:
+        results.put((dict(recorder.latencies), dict(recorder.errors), recorder.error_samples))
+
+def run_level(shoppers: list, users: int, args) -> tuple:
+    """users 人で同時に操作し、(Recorder, 経過秒数) を返す"""
+    context = multiprocessing.get_context("spawn")
+    start = context.Barrier(users + 1)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_shopper_process, args=(email, list_id, args.iterations, args.ticks, start, results))
+        for email, list_id in shoppers[:users]
+    ]
+    for process in processes:
+        process.start()
+    # 全員のページの読み込みが終わってから同時に開始する（子プロセスが起動できなければ BrokenBarrierError）
+    start.wait(timeout=300)
+    started = time.perf_counter()
+    recorder = Recorder()
+    for _ in processes:
+        latencies, errors, error_samples = results.get()
+        for page, values in latencies.items():
+            recorder.latencies[page].extend(values)
+        for page, count in errors.items():
+            recorder.errors[page] += count
+        for page, error in error_samples.items():
+            recorder.error_samples.setdefault(page, error)
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    return recorder, elapsed
+
+def _percentile(values: list, q: int) -> float:
+    if len(values) < 2:
+        return values[0] * 1000 if values else 0.0
+    return statistics.quantiles(values, n=100)[q - 1] * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 5, 10], help="同時に操作する利用者数（複数指定可）")
+    parser.add_argument("--iterations", type=int, default=3, help="1人あたりの操作（リスト→買い物→分析）の回数")
+    parser.add_argument("--ticks", type=int, default=3, help="1回の買い物でチェックするアイテム数")
+    parser.add_argument("--items", type=int, default=40, help="今回のリストのアイテム数")
+    parser.add_argument("--history-lists", type=int, default=8, help="利用者ごとの過去の買い物リスト数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 接続先はインポート時に決まるため、db_utils を読み込む前に設定する
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'load_test.db')}"
+        sys.path.insert(0, ROOT)
+        from utils import db_utils
+        _quiet_logs()
+
+        started = time.perf_counter()
+        shoppers = seed(db_utils, max(args.users), args.items, args.history_lists)
+        print(f"データ作成: 利用者{len(shoppers)}人（{time.perf_counter() - started:.1f}秒）")
+
+        for users in args.users:
+            recorder, elapsed = run_level(shoppers, users, args)
+            total = sum(len(values) for values in recorder.latencies.values())
+            print(f"\n同時利用者 {users}人: {elapsed:.1f}秒で再実行{total}回（{total / elapsed:.1f}回/秒）")
+            print(f"{'ページ':<12}{'再実行':>8}{'エラー':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'最大(ms)':>10}{'回/秒':>8}")
+            for page in PAGES:
+                values = recorder.latencies.get(page, [])
+                if not values:
+                    continue
+                print(f"{page:<12}{len(values):>8}{recorder.errors[page]:>8}"
+                      f"{_percentile(values, 50):>10.1f}{_percentile(values, 95):>10.1f}{_percentile(values, 99):>10.1f}"
+                      f"{max(values) * 1000:>10.1f}{len(values) / elapsed:>8.1f}")
+            for page, error in recorder.error_samples.items():
+                print(f"  {page} の例外: {error}")
+
+if __name__ == "__main__":
+    main()
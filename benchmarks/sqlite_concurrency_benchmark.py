@@ -0,0 +1,148 @@
+"""
+SQLiteの同時読み書きのベンチマーク
+
+書き込みスレッド（購入の記録と派生データの更新を1トランザクションで行う）と
+読み取りスレッド（カテゴリ別支出・購入履歴の集計）を同時に一定時間動かし、
+SQLITE_TUNING=0（ロールバックジャーナル・既定設定）と SQLITE_TUNING=1（WALなどの性能設定）で
+スループット・レイテンシ・"database is locked" などのエラー件数を比較する。
+設定はエンジン作成時に決まるため、モードごとに新しいPythonプロセスで計測する。
+
+Usage:
+    python benchmarks/sqlite_concurrency_benchmark.py [--seconds 5] [--writers 4] [--readers 8]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子プロセスで実行するコード
+CHILD_CODE = r"""
+import datetime, json, logging, statistics, sys, threading, time
+sys.path.insert(0, {root!r})
+from utils import db_utils
+from utils.models import Purchase, ShoppingListItem
+
+# 集計関数は例外をログに出して空の結果を返すため、ログの件数でエラーを数える
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+    def emit(self, record):
+        self.count += 1
+counter = ErrorCounter()
+logging.getLogger("utils.db_utils").addHandler(counter)
+logging.getLogger("utils.db_utils").propagate = False
+
+user_id = db_utils.register_user("bench@example.com", "password", "bench").id
+line_ids = []
+for n in range(20):
+    list_id = db_utils.create_shopping_list(user_id=user_id, name=f"list{{n}}").id
+    for m in range(20):
+        item_id = db_utils.create_item(f"item{{n}}-{{m}}", user_id).id
+        line_ids.append(db_utils.add_item_to_shopping_list(list_id, item_id, planned_price=100).id)
+db_utils.close_db_session()
+
+factory = db_utils.get_session_factory().session_factory
+
+def add_purchase(session, line_id, price):
+    # record_purchase と同じく購入の追加と派生データの更新を同じトランザクションで行う
+    line = session.get(ShoppingListItem, line_id)
+    purchase = Purchase(shopping_list_item_id=line.id, actual_price=price, quantity=1,
+                        purchased_at=datetime.datetime.utcnow())
+    session.add(purchase)
+    session.flush()
+    db_utils._on_purchases_recorded(session, [db_utils._purchase_record(purchase, line)])
+
+# 集計対象の購入履歴（2000件）はまとめて1トランザクションで作成
+session = factory()
+for line_id in line_ids * 5:
+    add_purchase(session, line_id, 120)
+session.commit()
+session.close()
+
+stop = threading.Event()
+results = {{"write": [], "read": [], "write_errors": 0}}
+lock = threading.Lock()
+
+def writer(k):
+    session = factory()
+    i = k
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            add_purchase(session, line_ids[i % len(line_ids)], 130)
+            session.commit()
+            with lock:
+                results["write"].append(time.perf_counter() - start)
+        except Exception:
+            session.rollback()
+            with lock:
+                results["write_errors"] += 1
+        i += 7
+    session.close()
+
+def reader(k):
+    session = factory()
+    while not stop.is_set():
+        start = time.perf_counter()
+        db_utils.get_category_spending(user_id, session=session)
+        db_utils.get_user_purchases(user_id, session=session)
+        session.rollback()
+        with lock:
+            results["read"].append(time.perf_counter() - start)
+    session.close()
+
+threads = [threading.Thread(target=writer, args=(k,)) for k in range({writers})]
+threads += [threading.Thread(target=reader, args=(k,)) for k in range({readers})]
+for t in threads:
+    t.start()
+time.sleep({seconds})
+stop.set()
+for t in threads:
+    t.join()
+
+def p95(values):
+    return statistics.quantiles(values, n=20)[-1] * 1000 if len(values) >= 2 else 0.0
+
+with db_utils.get_engine().connect() as conn:
+    journal_mode = conn.exec_driver_sql("PRAGMA journal_mode").scalar()
+print(json.dumps({{
+    "journal_mode": journal_mode,
+    "writes_per_s": len(results["write"]) / {seconds},
+    "reads_per_s": len(results["read"]) / {seconds},
+    "write_p95_ms": p95(results["write"]),
+    "read_p95_ms": p95(results["read"]),
+    "write_errors": results["write_errors"],
+    "read_errors": counter.count,
+}}))
+"""
+
+def run_mode(tuning: bool, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        env = os.environ.copy()
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'benchmark.db')}"
+        env["SQLITE_TUNING"] = "1" if tuning else "0"
+        code = CHILD_CODE.format(root=ROOT, seconds=args.seconds, writers=args.writers, readers=args.readers)
+        result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True)
+        return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5, help="計測時間（秒）")
+    parser.add_argument("--writers", type=int, default=4, help="書き込みスレッド数")
+    parser.add_argument("--readers", type=int, default=8, help="読み取りスレッド数")
+    args = parser.parse_args()
+
+    print(f"{'設定':<8}{'journal':>9}{'書込/s':>9}{'読取/s':>9}{'書込p95(ms)':>13}{'読取p95(ms)':>13}{'書込エラー':>10}{'読取エラー':>10}")
+    for name, tuning in (("既定", False), ("性能設定", True)):
+        r = run_mode(tuning, args)
+        print(f"{name:<8}{r['journal_mode']:>9}{r['writes_per_s']:>9.1f}{r['reads_per_s']:>9.1f}"
+              f"{r['write_p95_ms']:>13.1f}{r['read_p95_ms']:>13.1f}{r['write_errors']:>10}{r['read_errors']:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+起動時間のベンチマーク
+
+毎回新しいPythonプロセスで、次の時間を計測する（モジュールのキャッシュがない状態＝コールドスタート）。
+- import: utils.ui_utils のインポート（全ページが最初に読み込むモジュール）
+- app.py: app.py の初回描画（未ログインなのでログイン画面）
+- login: ページ（pages/01_ホーム.py）を未ログインで開いたときのログイン画面の初回描画
+
+あわせて、ログイン画面の描画までに読み込まれた重いライブラリを表示する。
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["pandas", "altair", "plotly", "psycopg2", "numpy", "bcrypt", "jwt"]
+
+# 子プロセスで実行するコード（streamlit本体のインポートは計測対象外）
+CHILD_CODE = r"""
+import json, sys, time
+sys.path.insert(0, {root!r})
+import streamlit
+from streamlit.testing.v1 import AppTest
+target = {target!r}
+start = time.perf_counter()
+if target == "import":
+    import utils.ui_utils
+    exceptions = []
+else:
+    at = AppTest.from_file(target, default_timeout=60)
+    at.run()
+    exceptions = [str(e.value) for e in at.exception]
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "elapsed_ms": elapsed * 1000,
+    "exceptions": exceptions,
+    "loaded": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+TARGETS = {
+    "import": "import",
+    "app.py": os.path.join(ROOT, "app.py"),
+    "login": os.path.join(ROOT, "pages", "01_ホーム.py"),
+}
+
+def run_once(target: str, db_path: str) -> dict:
+    env = os.environ.copy()
+    env["DATABASE_URL"] = f"sqlite:///{db_path}"
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_CODE.format(root=ROOT, target=target, heavy=HEAVY_MODULES)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="計測回数（中央値を表示）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "benchmark.db")
+        # 1回目はテーブル作成を含むため、先にDBを作っておく
+        run_once(TARGETS["app.py"], db_path)
+
+        print(f"{'対象':<10}{'中央値(ms)':>12}{'最小(ms)':>12}{'最大(ms)':>12}  読み込まれた重いライブラリ")
+        for name, target in TARGETS.items():
+            results = [run_once(target, db_path) for _ in range(args.runs)]
+            times = [r["elapsed_ms"] for r in results]
+            loaded = ", ".join(results[-1]["loaded"]) or "-"
+            print(f"{name:<10}{statistics.median(times):>12.1f}{min(times):>12.1f}{max(times):>12.1f}  {loaded}")
+            errors = {e for r in results for e in r["exceptions"]}
+            if errors:
+                print(f"  例外: {errors}")
+
+if __name__ == "__main__":
+    main()
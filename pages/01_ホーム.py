@@ -1,18 +1,16 @@
 import streamlit as st
 from datetime import datetime
 from utils.ui_utils import show_header, show_shopping_list_summary, check_authentication, logout, show_hamburger_menu, show_bottom_nav, patch_dark_background
-from utils.db_utils import get_user_by_id, get_shopping_lists, create_shopping_list
+from utils.db_utils import get_shopping_list_summaries, create_shopping_list
+from utils.db_utils import get_monthly_budget_status, set_monthly_budget
 
 # 認証チェック
 if not check_authentication():
     st.stop()
 
-# ユーザー情報取得
-user = get_user_by_id(st.session_state['user_id'])
-if user is None:
-    st.error("ユーザー情報が取得できませんでした")
-    logout()
-    st.stop()
+# ユーザー情報（ログイン時にセッションに保持したものを使い、DBは参照しない）
+user_id = st.session_state['user_id']
+user_name = st.session_state.get('user_name') or ""
 
 # ページ設定
 st.set_page_config(
@@ -26,7 +24,10 @@ st.set_page_config(
 patch_dark_background()
 
 # ヘッダー表示
-show_header(f"ようこそ、{user.name}さん")
+show_header(f"ようこそ、{user_name}さん")
+
+# 今月の予算状況（月次の累計を1行読むだけ）
+monthly_status = get_monthly_budget_status(user_id)
 
 # サイドバーにメニュー
 with st.sidebar:
@@ -57,6 +58,18 @@ with st.sidebar:
             else:
                 st.error("リスト名を入力してください")
     
+    # 今月の予算
+    st.subheader("今月の予算")
+    with st.form("monthly_budget_form"):
+        current_budget = monthly_status["budget"] if monthly_status and monthly_status["budget"] is not None else 0
+        monthly_budget = st.number_input("予算（0で解除）", min_value=0, step=1000, value=current_budget)
+        if st.form_submit_button("保存"):
+            if set_monthly_budget(user_id, datetime.now().date(), monthly_budget or None):
+                st.success("今月の予算を保存しました")
+                st.rerun()
+            else:
+                st.error("予算の保存に失敗しました")
+    
     # ナビゲーションをハンバーガーメニューに置き換え
     show_hamburger_menu()
     
@@ -74,11 +87,21 @@ with st.sidebar:
     st.caption("・Railway PostgreSQLサポート")
     st.caption(f"最終更新: 2025年4月17日")
 
+# 今月の予算状況
+if monthly_status and (monthly_status["budget"] is not None or monthly_status["spent_total"]):
+    month_col1, month_col2, month_col3 = st.columns(3)
+    month_col1.metric("今月の支出", f"¥{monthly_status['spent_total']:,.0f}")
+    month_col2.metric("今月の予定", f"¥{monthly_status['planned_total']:,.0f}")
+    if monthly_status["budget"] is not None:
+        month_col3.metric("予算の残り", f"¥{monthly_status['remaining']:,.0f}", delta=f"予算 ¥{monthly_status['budget']:,.0f}", delta_color="off")
+        if monthly_status["over_budget"]:
+            st.error("今月の予算を超過しています")
+
 # メインコンテンツ
 st.subheader("最近の買い物リスト")
 
-# 買い物リスト一覧の取得
-shopping_lists = get_shopping_lists(user.id, limit=10)
+# 買い物リスト一覧の取得（集計値込みで1クエリ）
+shopping_lists = get_shopping_list_summaries(user_id, limit=10)
 
 if shopping_lists:
     # リストを日付でグループ化して表示
@@ -86,8 +109,8 @@ if shopping_lists:
         col1, col2 = st.columns([3, 1])
         
         with col1:
-            if st.button(f"{shopping_list.name}", key=f"list_{shopping_list.id}", use_container_width=True):
-                st.session_state['current_list_id'] = shopping_list.id
+            if st.button(f"{shopping_list['name']}", key=f"list_{shopping_list['id']}", use_container_width=True):
+                st.session_state['current_list_id'] = shopping_list['id']
                 st.switch_page("pages/02_リスト編集.py")
                 
         with col2:
@@ -1,5 +1,4 @@
 import streamlit as st
-import pandas as pd
 from datetime import datetime
 from utils.ui_utils import show_header, show_success_message, show_error_message, show_hamburger_menu, show_bottom_nav
 from utils.ui_utils import check_authentication, show_connection_indicator
@@ -7,7 +6,11 @@ from utils.db_utils import get_shopping_list, get_shopping_list_items, add_item_
 from utils.db_utils import update_shopping_list_item, get_stores, get_categories
 from utils.db_utils import create_item, search_items, get_items_by_user, update_shopping_list
 from utils.db_utils import remove_item_from_shopping_list, delete_shopping_list_items, get_shopping_list_total
-from utils.ui_utils import patch_dark_background
+from utils.db_utils import get_list_budget_status, set_list_budget
+from utils.db_utils import suggest_items, get_latest_planned_price
+from utils.ui_utils import patch_dark_background, show_price_history
+from utils.db_utils import get_price_history, get_usual_price, suggest_store_assignment, bulk_update_store_assignments
+from utils.db_utils import apply_list_item_changes
 
 # アイコンマッピング
 default_category_icons = {
@@ -20,6 +23,10 @@ store_icon = "🏬"
 if not check_authentication():
     st.stop()
 
+# 重いライブラリはログイン済みの場合のみ読み込む
+import pandas as pd
+from utils.grid_sync import snapshot, diff_grid
+
 # 買い物リストIDのチェック
 if 'current_list_id' not in st.session_state:
     st.error("買い物リストが選択されていません")
@@ -232,14 +239,8 @@ with add_item_container:
             st.session_state.selected_item_category_id = None
 
         # 店舗選択
+        # 店舗名は正規化名で一意なため重複除去は不要
         stores = get_stores(user_id=st.session_state.get('user_id'))
-        unique_stores = []
-        seen_names = set()
-        for s in stores:
-            if s.name not in seen_names:
-                unique_stores.append(s)
-                seen_names.add(s.name)
-        stores = unique_stores
         store_options = [("", "店舗を選択")] + [(str(s.id), s.name) for s in stores]
         store_id = st.selectbox(
             "購入予定店舗",
@@ -253,7 +254,6 @@ with add_item_container:
         # 既存商品選択時は前回金額をデフォルトに
         planned_price_default = 0
         if input_method == "既存の商品から選択" and st.session_state.get('selected_item_id'):
-            from utils.db_utils import get_latest_planned_price
             user_id = st.session_state.get('user_id')
             item_id = int(st.session_state['selected_item_id'])
             latest_price = get_latest_planned_price(user_id, item_id)
@@ -318,6 +318,27 @@ with add_item_container:
             else:
                 show_error_message("リストへの追加に失敗しました")
 
+# いつも一緒に買う商品のおすすめ（集計済みの共起・頻度から計算）
+with st.expander("✨ おすすめの商品", expanded=False):
+    draft_item_ids = [list_item.item_id for list_item in get_shopping_list_items(shopping_list.id)]
+    recommended = suggest_items(st.session_state.get('user_id'), draft_item_ids, k=8)
+    if recommended:
+        for recommended_item in recommended:
+            rec_col1, rec_col2 = st.columns([4, 1])
+            with rec_col1:
+                caption = f"一緒に入ったリスト: {recommended_item['together_count']}件" if recommended_item['together_count'] else "よく買う商品"
+                st.write(f"**{recommended_item['name']}**　{caption}")
+            with rec_col2:
+                if st.button("追加", key=f"add_recommended_{recommended_item['item_id']}"):
+                    latest_price = get_latest_planned_price(st.session_state.get('user_id'), recommended_item['item_id'])
+                    if add_item_to_shopping_list(shopping_list.id, recommended_item['item_id'], planned_price=latest_price):
+                        show_success_message(f"{recommended_item['name']}をリストに追加しました")
+                        st.rerun()
+                    else:
+                        show_error_message("リストへの追加に失敗しました")
+    else:
+        st.caption("買い物の履歴が増えると、よく一緒に買う商品が表示されます")
+
 # アイテム編集フォーム
 if st.session_state.get('editing_item_id'):
     st.subheader("商品の編集")
@@ -336,22 +357,15 @@ if st.session_state.get('editing_item_id'):
                 # 予定金額
                 edit_planned_price = st.number_input(
                     "予定金額", 
-                    min_value=0.0, 
-                    step=10.0, 
-                    value=float(edit_item.planned_price) if edit_item.planned_price else 0.0
+                    min_value=0, 
+                    step=10, 
+                    value=edit_item.planned_price or 0
                 )
             
             with col2:
                 # 店舗選択
+                # 店舗名は正規化名で一意なため重複除去は不要
                 stores = get_stores(user_id=st.session_state.get('user_id'))
-                # 重複する店舗名を除去
-                unique_stores = []
-                seen_names = set()
-                for s in stores:
-                    if s.name not in seen_names:
-                        unique_stores.append(s)
-                        seen_names.add(s.name)
-                stores = unique_stores
                 store_options = [("", "店舗を選択")] + [(str(s.id), s.name) for s in stores]
                 
                 # 現在の店舗を選択
@@ -412,12 +426,41 @@ if st.session_state.get('editing_item_id'):
             # 合計金額の表示
             total_price = edit_quantity * edit_planned_price
             st.metric(label="合計金額", value=f"¥{total_price:,.0f}")
+        
+        # 価格履歴（価格観測テーブルからの読み取りのみ）
+        if edit_item.item_id:
+            with st.expander("価格履歴", expanded=False):
+                usual_price = get_usual_price(st.session_state['user_id'], edit_item.item_id, edit_item.store_id)
+                if usual_price is not None:
+                    st.caption(f"いつもの価格: ¥{usual_price:,.0f}")
+                show_price_history(get_price_history(st.session_state['user_id'], edit_item.item_id))
 
 # 買い物リストの表示
 st.subheader("現在のリスト")
 # リスト全体の合計金額表示
 list_totals = get_shopping_list_total(shopping_list.id)
 st.metric(label="リスト合計金額", value=f"¥{list_totals['total_price']:,.0f}", delta=f"{list_totals['total_items']}点")
+
+# 予算（累計は更新時に維持されているため1行の読み取りのみ）
+budget_status = get_list_budget_status(shopping_list.id)
+if budget_status and budget_status["budget"] is not None:
+    budget_col1, budget_col2, budget_col3 = st.columns(3)
+    budget_col1.metric("予算", f"¥{budget_status['budget']:,.0f}")
+    budget_col2.metric("支出済み", f"¥{budget_status['spent_total']:,.0f}")
+    budget_col3.metric("残り", f"¥{budget_status['remaining']:,.0f}")
+    if budget_status["over_budget"]:
+        st.error(f"予算を ¥{-budget_status['remaining']:,.0f} 超過しています")
+    elif budget_status["planned_over_budget"]:
+        st.warning(f"予定金額（¥{budget_status['planned_total']:,.0f}）が予算を超えています")
+with st.expander("💰 予算の設定", expanded=False):
+    current_budget = budget_status["budget"] if budget_status and budget_status["budget"] is not None else 0
+    new_budget = st.number_input("このリストの予算（0で解除）", min_value=0, step=100, value=current_budget, key="list_budget_input")
+    if st.button("予算を保存", key="save_list_budget"):
+        if set_list_budget(shopping_list.id, new_budget or None):
+            st.success("予算を保存しました")
+            st.rerun()
+        else:
+            st.error("予算の保存に失敗しました")
 # ステータス凡例の色分け
 st.markdown("""
 **ステータス:**  
@@ -426,6 +469,47 @@ st.markdown("""
 <span style='background-color:#d4edda;color:#155724;padding:4px 8px;border-radius:4px;'>購入済み</span>
 """, unsafe_allow_html=True)
 
+# 過去の購入価格から最安の店舗割り当てを提案
+with st.expander("💴 最安店舗の提案", expanded=False):
+    st.caption("過去の購入価格（店舗ごとの中央値）から、リスト全体が最も安くなる店舗の割り当てを提案します。")
+    max_stores = st.number_input("訪問する店舗数の上限（0は無制限）", min_value=0, step=1, value=0, key="optimizer_max_stores")
+    if st.button("提案を計算", key="suggest_stores"):
+        st.session_state['store_suggestion'] = suggest_store_assignment(shopping_list.id, max_stores=int(max_stores) or None)
+    
+    suggestion = st.session_state.get('store_suggestion')
+    if suggestion is not None:
+        if not suggestion["assignments"]:
+            st.info("現在の割り当てより安くなる提案はありません")
+        else:
+            store_names = {s.id: s.name for s in get_stores(user_id=st.session_state.get('user_id'))}
+            list_items_by_id = {item.id: item for item in get_shopping_list_items(shopping_list.id)}
+            suggestion_rows = []
+            for list_item_id, new_store_id in suggestion["assignments"].items():
+                list_item = list_items_by_id.get(list_item_id)
+                if list_item is None:
+                    continue
+                suggestion_rows.append({
+                    "商品名": list_item.item.name if list_item.item else "不明なアイテム",
+                    "現在の店舗": store_names.get(list_item.store_id, "未指定"),
+                    "提案する店舗": "未指定（上限のため）" if new_store_id is None else store_names.get(new_store_id, "不明"),
+                })
+            st.dataframe(pd.DataFrame(suggestion_rows), hide_index=True, use_container_width=True)
+            cols = st.columns(2)
+            cols[0].metric("現在の想定金額（購入履歴がある商品）", f"¥{suggestion['current_total']:,.0f}")
+            cols[1].metric("提案の想定金額", f"¥{suggestion['expected_total']:,.0f}")
+            if suggestion["unpriced_item_ids"]:
+                st.caption(f"購入履歴がない{len(suggestion['unpriced_item_ids'])}件は金額に含めていません")
+            if suggestion["unassigned_item_ids"]:
+                st.caption(f"訪問する店舗で価格が分からない{len(suggestion['unassigned_item_ids'])}件は、店舗数の上限を超えないよう店舗を未指定にします")
+            if st.button("この割り当てを適用", type="primary", key="apply_store_suggestion"):
+                updated_count = bulk_update_store_assignments(suggestion["assignments"])
+                del st.session_state['store_suggestion']
+                if updated_count:
+                    show_success_message(f"{updated_count}個のアイテムの店舗を変更しました")
+                    st.rerun()
+                else:
+                    show_error_message("店舗の変更に失敗しました")
+
 # 複数選択コントロールを追加
 col_refresh, col_batch = st.columns([3, 1])
 with col_batch:
@@ -461,15 +545,8 @@ if st.session_state.get('show_batch_actions', False):
         
         elif batch_action == "店舗変更":
             # 店舗選択
+            # 店舗名は正規化名で一意なため重複除去は不要
             stores = get_stores(user_id=st.session_state.get('user_id'))
-            # 重複する店舗名を除去
-            unique_stores = []
-            seen_names = set()
-            for s in stores:
-                if s.name not in seen_names:
-                    unique_stores.append(s)
-                    seen_names.add(s.name)
-            stores = unique_stores
             store_options = [("", "店舗を選択")] + [(str(s.id), s.name) for s in stores]
             batch_store_id = st.selectbox(
                 "新しい購入予定店舗",
@@ -502,14 +579,7 @@ if st.session_state.get('show_batch_actions', False):
             # 日付一括変更
             batch_date = st.date_input("新しい予定日を選択")
             if st.button("日付を一括変更", type="primary"):
-                success_count = 0
-                for item_id in selected_ids:
-                    updated = update_shopping_list_item(
-                        item_id=item_id,
-                        planned_date=batch_date
-                    )
-                    if updated:
-                        success_count += 1
+                success_count = apply_list_item_changes({item_id: {"planned_date": batch_date} for item_id in selected_ids})
                 if success_count > 0:
                     show_success_message(f"{success_count}個のアイテムの予定日を変更しました")
                     reset_item_selection()
@@ -527,8 +597,6 @@ if st.session_state.get('show_batch_actions', False):
 items = get_shopping_list_items(shopping_list.id)
 
 if items:
-    # 元の数量を記録
-    original_quantities = {item.id: item.quantity if item.quantity else 1 for item in items}
     # アイテムデータをDataFrameに変換
     item_data = []
     
@@ -560,6 +628,8 @@ if items:
         df["予定日"] = pd.to_datetime(df["予定日"], format="%Y-%m-%d", errors="coerce")
         # NaN/NaT値の表示を改善
         df["予定日"] = df["予定日"].dt.date
+    # 表示時の値をIDで引けるようにしたスナップショット（編集後の表との比較用）
+    grid_snapshot = snapshot(df, "ID")
 
     # チェックボックス列を追加したデータエディタを表示
     edited_df = st.data_editor(
@@ -614,62 +684,21 @@ if items:
         key="item_table"
     )
     
-    # ❶ まず差分を検知
+    # チェックボックスの選択状態をセッションに反映し、変わった場合は再描画
     selection_changed = (df["選択"] != edited_df["選択"]).any()
-
-    # ❷ session_state を先に更新
-    for _, row in edited_df.iterrows():
-        st.session_state["item_selection"][row["ID"]] = row["選択"]
-
-    # ❸ その後に rerun（必要なら）
+    st.session_state["item_selection"].update(zip(edited_df["ID"].tolist(), edited_df["選択"].tolist()))
     if selection_changed:
         st.rerun()
 
-    # データエディタの再描画を条件付きで実行
-    if any(df["選択"] != edited_df["選択"]):
-        st.rerun()
-
-    # チェックボックスの状態を更新
-    for index, row in edited_df.iterrows():
-        item_id = row["ID"]
-        is_selected = row["選択"]
-        # 状態が変化した場合のみセッションを更新
-        if st.session_state['item_selection'].get(item_id) != is_selected:
-            st.session_state['item_selection'][item_id] = is_selected
-
-    # データフレームの選択状態をセッション状態に同期
-    for item_id, is_selected in st.session_state['item_selection'].items():
-        if item_id in df["ID"].values:
-            df.loc[df["ID"] == item_id, "選択"] = is_selected
-
-    # 数量変更と予定日変更をデータベースに反映
-    for _, row in edited_df.iterrows():
-        item_id = row["ID"]
-        new_qty = row["数量"]
-        old_qty = original_quantities.get(item_id)
-        if new_qty != old_qty:
-            updated = update_shopping_list_item(
-                item_id=item_id,
-                quantity=int(new_qty)
-            )
-            if updated:
-                show_success_message(f"{updated.item.name if updated.item else ''} の数量を{new_qty}に更新しました")
-        
-        # 予定日変更反映 - NaT値のチェックを追加
-        new_date = row.get("予定日")
-        old_date = next((item.planned_date for item in items if item.id == item_id), None)
-        
-        # NaT値のチェック (pandas.NaTType は直接比較できないため、文字列変換で確認)
-        is_valid_date = new_date is not None and str(new_date) != "NaT" and pd.notna(new_date)
-        
-        # 有効な日付のみを更新
-        if is_valid_date and new_date != old_date:
-            updated = update_shopping_list_item(
-                item_id=item_id,
-                planned_date=new_date
-            )
-            if updated:
-                show_success_message(f"{updated.item.name if updated.item else ''} の予定日を{new_date}に更新しました")
+    # 数量・予定日の変更を表示時のスナップショットとまとめて比較し、変更されたセルだけを1回で反映
+    edited_df["予定日"] = pd.to_datetime(edited_df["予定日"], errors="coerce").dt.date
+    changes = diff_grid(grid_snapshot, edited_df, {"数量": "quantity", "予定日": "planned_date"}, "ID")
+    if changes:
+        updated_count = apply_list_item_changes(changes)
+        if updated_count:
+            show_success_message(f"{updated_count}個のアイテムの数量・予定日を更新しました")
+        else:
+            show_error_message("アイテム情報の更新に失敗しました")
     
     # アイテム操作用のボタン
     for item in items:
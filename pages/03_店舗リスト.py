@@ -1,7 +1,13 @@
 import streamlit as st
 from utils.ui_utils import show_header, show_success_message, show_error_message, show_hamburger_menu, show_bottom_nav
 from utils.ui_utils import check_authentication, show_connection_indicator, patch_dark_background
-from utils.db_utils import get_shopping_list, get_shopping_list_items, update_shopping_list_item, get_shopping_list_total, close_db_session, record_purchase, get_latest_planned_price
+from utils.db_utils import get_shopping_list, get_shopping_list_items, update_shopping_list_item, close_db_session, record_purchase, get_latest_planned_prices
+from utils.db_utils import checkout_shopping_list
+from utils.checkout import planned_unit_price, needs_latest_price
+from utils.money import yen_total
+
+# 1つのカテゴリで一度に表示するアイテム数（「さらに表示」で追加する）
+ITEMS_PER_PAGE = 20
 
 # 新規: チェックボックス変更ハンドラ
 def handle_check(item_id):
@@ -9,6 +15,11 @@ def handle_check(item_id):
     update_shopping_list_item(item_id, checked=st.session_state[f"check_{item_id}"])
     close_db_session()
 
+# チェック済みをまとめて購入（コールバックで記録し、結果は次の描画で表示する）
+def handle_checkout(shopping_list_id, store_id, store_only):
+    st.session_state["checkout_result"] = checkout_shopping_list(shopping_list_id, store_id, store_only)
+    close_db_session()
+
 # 認証チェック
 if not check_authentication():
     st.stop()
@@ -48,13 +59,20 @@ show_header(f"{shopping_list.name} - 買い物モード")
 # 折りたたみ式メニュー
 show_hamburger_menu()
 
-# 合計金額表示
-list_totals = get_shopping_list_total(shopping_list.id)
+# 予定金額・商品のデフォルト価格がないアイテムの直近予定価格をまとめて取得
+unpriced_item_ids = [item.item_id for item in list_items if needs_latest_price(item)]
+latest_prices = get_latest_planned_prices(st.session_state.get('user_id'), unpriced_item_ids)
+
+# 合計金額表示（読み込み済みのアイテムから、各行と同じ予定単価で計算する）
+checked_list_items = [item for item in list_items if item.checked]
+list_total = yen_total((planned_unit_price(item, latest_prices) for item in list_items), (item.quantity for item in list_items))
+checked_total = yen_total((planned_unit_price(item, latest_prices) for item in checked_list_items), (item.quantity for item in checked_list_items))
 # 購入済み金額計算
-purchase_total = sum(p.actual_price * p.quantity for item in list_items for p in item.purchases)
+purchases = [p for item in list_items for p in item.purchases]
+purchase_total = yen_total((p.actual_price for p in purchases), (p.quantity for p in purchases))
 cols = st.columns(3)
-cols[0].metric("リスト合計金額", f"¥{list_totals['total_price']:,.0f}")
-cols[1].metric("チェック済み合計金額", f"¥{list_totals['checked_price']:,.0f}")
+cols[0].metric("リスト合計金額", f"¥{list_total:,.0f}")
+cols[1].metric("チェック済み合計金額", f"¥{checked_total:,.0f}")
 cols[2].metric("購入済み合計金額", f"¥{purchase_total:,.0f}")
 # ステータス色分け凡例
 st.markdown("""
@@ -64,139 +82,166 @@ st.markdown("""
 <span style='background-color:#d4edda;padding:4px;border-radius:4px;'>購入済み</span>
 """, unsafe_allow_html=True)
 
-# メインコンテンツ - 店舗別タブを作成
+# まとめて購入の結果
+if "checkout_result" in st.session_state:
+    checkout_result = st.session_state.pop("checkout_result")
+    if checkout_result is None:
+        show_error_message("まとめて購入の記録に失敗しました")
+    else:
+        if checkout_result["purchased"]:
+            show_success_message(f"{checkout_result['purchased']}件の購入（¥{checkout_result['total']:,.0f}）を記録しました")
+        if checkout_result["unpriced"]:
+            st.warning(f"金額が決まらない{checkout_result['unpriced']}件は記録していません。「購入記録」から金額を入力してください")
+
+# メインコンテンツ - 選択中の店舗・開いているカテゴリの表示中のページだけを描画する
 if list_items:
-    # 店舗情報を取得
+    # アイテムを店舗ごと・カテゴリごとに分類（同名の店舗を混ぜないよう店舗IDで分け、名前は表示にだけ使う）
     store_items = {}
-    no_store_items = []
-    
-    # アイテムを店舗ごとに分類
+    store_names = {}
     for item in list_items:
-        store_name = "未指定の店舗"
-        if item.store:
-            store_name = item.store.name
-            
-        if store_name not in store_items:
-            store_items[store_name] = []
-            
-        store_items[store_name].append(item)
+        store_names.setdefault(item.store_id, item.store.name if item.store else "未指定の店舗")
+        category_name = item.item.category.name if item.item and item.item.category else "未分類"
+        store_items.setdefault(item.store_id, {}).setdefault(category_name, []).append(item)
     
-    # タブを作成
-    store_names = list(store_items.keys())
-    tabs = st.tabs(store_names)
+    # 店舗の切り替え（タブと違い、選択中の店舗だけを描画する）
+    # ラベル・選択肢が変わるとウィジェットの状態が初期化されるため、件数は含めない
+    store_id = st.radio(
+        "店舗",
+        list(store_items),
+        format_func=store_names.get,
+        horizontal=True,
+        key="shopping_store",
+        label_visibility="collapsed",
+    )
+    categories = store_items[store_id]
+    checked_items = sum(1 for items in categories.values() for item in items if item.checked)
+    total_items = sum(len(items) for items in categories.values())
     
-    # 各店舗のタブ内容を作成
-    for i, store_name in enumerate(store_names):
-        with tabs[i]:
-            items = store_items[store_name]
-            checked_items = sum(1 for item in items if item.checked)
-            
-            # 進捗バー
-            st.caption(f"進捗: {checked_items}/{len(items)} アイテム")
-            progress = checked_items / len(items) if len(items) > 0 else 0
-            # 緑色のカスタムプログレスバー
-            bar_html = f'''
-            <div style="background-color:#e0e0e0;border-radius:8px;width:100%;height:22px;">
-                <div style="width:{progress*100:.1f}%;background-color:#4CAF50;height:100%;border-radius:8px;text-align:center;color:white;font-weight:bold;line-height:22px;">
-                    {progress*100:.1f}%
-                </div>
-            </div>
-            '''
-            st.markdown(bar_html, unsafe_allow_html=True)
-            
-            # アイテム一覧をカテゴリごとにグループ化
-            categories = {}
-            for item in items:
-                category_name = "未分類"
-                if item.item and item.item.category:
-                    category_name = item.item.category.name
-                
-                if category_name not in categories:
-                    categories[category_name] = []
-                    
-                categories[category_name].append(item)
-            
-            # カテゴリごとに表示
-            for category_name, category_items in categories.items():
-                with st.expander(f"{category_name} ({len(category_items)}アイテム)", expanded=True):
-                    for item in category_items:
-                        # ステータスに応じた背景色
-                        bgcolor = "#f8d7da"  # 未チェック
-                        if item.purchases:
-                            bgcolor = "#d4edda"  # 購入済み
-                        elif item.checked:
-                            bgcolor = "#fff3cd"  # チェック済み
-                        # カラフルな背景でアイテム表示
-                        st.markdown(f"<div style='background-color:{bgcolor}; padding:8px; border-radius:5px; margin-bottom:8px;'>", unsafe_allow_html=True)
-                        cols = st.columns([0.5, 2, 1, 1])
-                        with cols[0]:
-                            # チェックボックス（on_changeでDB更新）
-                            st.checkbox(
-                                "",
-                                value=item.checked,
-                                key=f"check_{item.id}",
-                                on_change=handle_check,
-                                args=(item.id,)
+    # 進捗バー
+    st.caption(f"進捗: {checked_items}/{total_items} アイテム")
+    progress = checked_items / total_items if total_items > 0 else 0
+    # 緑色のカスタムプログレスバー
+    bar_html = f'''
+    <div style="background-color:#e0e0e0;border-radius:8px;width:100%;height:22px;">
+        <div style="width:{progress*100:.1f}%;background-color:#4CAF50;height:100%;border-radius:8px;text-align:center;color:white;font-weight:bold;line-height:22px;">
+            {progress*100:.1f}%
+        </div>
+    </div>
+    '''
+    st.markdown(bar_html, unsafe_allow_html=True)
+    
+    # チェック済みで未購入のアイテムの購入をまとめて記録（この店舗 / リスト全体）
+    store_pending = sum(1 for items in categories.values() for item in items if item.checked and not item.purchases)
+    list_pending = sum(1 for item in list_items if item.checked and not item.purchases)
+    checkout_cols = st.columns(2)
+    checkout_cols[0].button(
+        f"この店舗のチェック済みを購入（{store_pending}件）",
+        key="checkout_store",
+        disabled=store_pending == 0,
+        on_click=handle_checkout,
+        args=(shopping_list.id, store_id, True),
+        use_container_width=True,
+    )
+    checkout_cols[1].button(
+        f"リスト全体のチェック済みを購入（{list_pending}件）",
+        key="checkout_list",
+        disabled=list_pending == 0,
+        on_click=handle_checkout,
+        args=(shopping_list.id, None, False),
+        use_container_width=True,
+    )
+    
+    # カテゴリごとの開閉（最初のカテゴリは開いた状態で表示）。開いているカテゴリの表示するページ分だけを描画する
+    visible_items = {}
+    category_containers = {}
+    for index, (category_name, category_items) in enumerate(categories.items()):
+        is_open = st.toggle(
+            f"{category_name} ({len(category_items)}アイテム)",
+            value=index == 0,
+            key=f"category_open_{store_id}_{category_name}"
+        )
+        if is_open:
+            shown = st.session_state.get(f"category_shown_{store_id}_{category_name}", ITEMS_PER_PAGE)
+            visible_items[category_name] = category_items[:shown]
+            category_containers[category_name] = st.container(border=True)
+    
+    # 開いているカテゴリのアイテムを、それぞれの見出しの下に表示
+    for category_name, category_container in category_containers.items():
+        category_items = categories[category_name]
+        with category_container:
+            for item in visible_items[category_name]:
+                # ステータスに応じた背景色
+                bgcolor = "#f8d7da"  # 未チェック
+                if item.purchases:
+                    bgcolor = "#d4edda"  # 購入済み
+                elif item.checked:
+                    bgcolor = "#fff3cd"  # チェック済み
+                # カラフルな背景でアイテム表示
+                st.markdown(f"<div style='background-color:{bgcolor}; padding:8px; border-radius:5px; margin-bottom:8px;'>", unsafe_allow_html=True)
+                cols = st.columns([0.5, 2, 1, 1])
+                with cols[0]:
+                    # チェックボックス（on_changeでDB更新）
+                    st.checkbox(
+                        "チェック",
+                        value=item.checked,
+                        label_visibility="collapsed",
+                        key=f"check_{item.id}",
+                        on_change=handle_check,
+                        args=(item.id,)
+                    )
+                with cols[1]:
+                    item_name = item.item.name if item.item else "不明なアイテム"
+                    st.write(f"{item_name} (×{item.quantity})")
+                with cols[2]:
+                    planned_price = planned_unit_price(item, latest_prices)
+                    st.write(f"¥{planned_price * (item.quantity or 0):,.0f}")
+                with cols[3]:
+                    if st.button("購入記録", key=f"buy_{item.id}"):
+                        st.session_state[f"record_purchase_{item.id}"] = True
+                        st.rerun()
+                st.markdown("</div>", unsafe_allow_html=True)
+                # 続き: div 内での購入記録モーダルなど
+                if st.session_state.get(f"record_purchase_{item.id}"):
+                    with st.container():
+                        with st.form(key=f"purchase_form_{item.id}"):
+                            st.subheader("購入金額を記録")
+                            # デフォルト購入金額: リスト上の予定価格 or 商品デフォルト価格 or 直近予定価格
+                            default_price = planned_unit_price(item, latest_prices)
+                            actual_price = st.number_input(
+                                "実際の金額", min_value=0, step=10,
+                                value=default_price or 0,
+                                key=f"actual_{item.id}"
                             )
-                        with cols[1]:
-                            item_name = item.item.name if item.item else "不明なアイテム"
-                            st.write(f"{item_name} (×{item.quantity})")
-                        with cols[2]:
-                            # 予定金額フォールバック: リスト上の値(>0) → 商品デフォルト価格(>0) → 過去リストの直近予定価格
-                            if item.planned_price is not None and item.planned_price > 0:
-                                planned_price = item.planned_price
-                            elif item.item and getattr(item.item, 'default_price', None) is not None and item.item.default_price > 0:
-                                planned_price = item.item.default_price
-                            else:
-                                user_id = st.session_state.get('user_id')
-                                planned_price = get_latest_planned_price(user_id, item.item.id) if item.item else 0
-                            st.write(f"¥{planned_price * (item.quantity or 0):,.0f}")
-                        with cols[3]:
-                            if st.button("購入記録", key=f"buy_{item.id}"):
-                                st.session_state[f"record_purchase_{item.id}"] = True
-                                st.rerun()
-                        st.markdown("</div>", unsafe_allow_html=True)
-                        # 続き: div 内での購入記録モーダルなど
-                        if st.session_state.get(f"record_purchase_{item.id}"):
-                            with st.container():
-                                with st.form(key=f"purchase_form_{item.id}"):
-                                    st.subheader("購入金額を記録")
-                                    # デフォルト購入金額: リスト上の予定価格 or 商品デフォルト価格 or 直近予定価格
-                                    if item.planned_price and item.planned_price > 0:
-                                        default_price = item.planned_price
-                                    elif item.item and getattr(item.item, 'default_price', None) and item.item.default_price > 0:
-                                        default_price = item.item.default_price
-                                    else:
-                                        user_id = st.session_state.get('user_id')
-                                        default_price = get_latest_planned_price(user_id, item.item.id) if item.item else 0
-                                    # Decimal to float
-                                    actual_price = st.number_input(
-                                        "実際の金額", min_value=0.0, step=10.0,
-                                        value=float(default_price),
-                                        key=f"actual_{item.id}"
-                                    )
-                                    quantity_input = st.number_input(
-                                        "数量", min_value=1, step=1,
-                                        value=item.quantity or 1,
-                                        key=f"qty_{item.id}"
-                                    )
-                                    if st.form_submit_button("記録する"):
-                                        purchase = record_purchase(
-                                            shopping_list_item_id=item.id,
-                                            actual_price=actual_price,
-                                            quantity=quantity_input
-                                        )
-                                        if purchase:
-                                            show_success_message("購入記録を保存しました")
-                                            del st.session_state[f"record_purchase_{item.id}"]
-                                            st.rerun()
-                                        else:
-                                            show_error_message("購入記録の保存に失敗しました")
-                                # キャンセルボタン（フォーム外）
-                                if st.button("キャンセル", key=f"cancel_{item.id}"):
+                            quantity_input = st.number_input(
+                                "数量", min_value=1, step=1,
+                                value=item.quantity or 1,
+                                key=f"qty_{item.id}"
+                            )
+                            if st.form_submit_button("記録する"):
+                                purchase = record_purchase(
+                                    shopping_list_item_id=item.id,
+                                    actual_price=actual_price,
+                                    quantity=quantity_input
+                                )
+                                if purchase:
+                                    show_success_message("購入記録を保存しました")
                                     del st.session_state[f"record_purchase_{item.id}"]
                                     st.rerun()
-                            st.divider()
+                                else:
+                                    show_error_message("購入記録の保存に失敗しました")
+                        # キャンセルボタン（フォーム外）
+                        if st.button("キャンセル", key=f"cancel_{item.id}"):
+                            del st.session_state[f"record_purchase_{item.id}"]
+                            st.rerun()
+                    st.divider()
+            
+            # 長いカテゴリは ITEMS_PER_PAGE 件ずつ表示
+            remaining = len(category_items) - len(visible_items[category_name])
+            if remaining > 0:
+                if st.button(f"さらに表示（残り{remaining}件）", key=f"more_{store_id}_{category_name}"):
+                    shown_key = f"category_shown_{store_id}_{category_name}"
+                    st.session_state[shown_key] = len(visible_items[category_name]) + ITEMS_PER_PAGE
+                    st.rerun()
 else:
     st.info("このリストには商品が登録されていません。リスト編集画面から商品を追加してください。")
 
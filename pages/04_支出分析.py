@@ -1,16 +1,19 @@
 import streamlit as st
-import pandas as pd
-import altair as alt
 from datetime import datetime, timedelta
-from utils.ui_utils import show_header, show_spending_chart
+from utils.ui_utils import show_header, show_spending_chart, show_success_message, show_error_message
 from utils.ui_utils import check_authentication, show_connection_indicator
-from utils.db_utils import get_user_purchases, get_category_spending, get_store_spending, update_purchase_date
+from utils.db_utils import get_spending_analytics, update_purchase_date
+from utils.db_utils import get_spending_forecast, import_purchases
 from utils.ui_utils import patch_dark_background
 
 # 認証チェック
 if not check_authentication():
     st.stop()
 
+# 重いライブラリはログイン済みの場合のみ読み込む
+import pandas as pd
+import altair as alt
+
 # ページ設定
 st.set_page_config(
     page_title="支出分析 | 買い物アプリ",
@@ -39,24 +42,25 @@ with st.sidebar:
         index=2
     )
     
-    # 期間の計算
-    today = datetime.now()
+    # 期間の計算（日の境界にそろえ、同じ日の再実行では同じ期間になるようにしてキャッシュを効かせる）
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    end_of_today = datetime.combine(today.date(), datetime.max.time())
     
     if period_option == "過去7日":
         start_date = today - timedelta(days=7)
-        end_date = today
+        end_date = end_of_today
     elif period_option == "過去30日":
         start_date = today - timedelta(days=30)
-        end_date = today
+        end_date = end_of_today
     elif period_option == "過去3ヶ月":
         start_date = today - timedelta(days=90)
-        end_date = today
+        end_date = end_of_today
     elif period_option == "今年":
         start_date = datetime(today.year, 1, 1)
-        end_date = today
+        end_date = end_of_today
     elif period_option == "すべて":
         start_date = datetime(2020, 1, 1)  # 十分古い日付
-        end_date = today
+        end_date = end_of_today
     else:  # カスタム
         date_col1, date_col2 = st.columns(2)
         with date_col1:
@@ -78,18 +82,24 @@ with st.sidebar:
     chart_type = st.radio("チャートタイプ", ["棒グラフ", "円グラフ"], horizontal=True)
     chart_type = "bar" if chart_type == "棒グラフ" else "pie"
 
-# メインコンテンツ - タブで分析種類を切り替え
-tab1, tab2, tab3 = st.tabs(["カテゴリ別支出", "店舗別支出", "購入履歴"])
+# メインコンテンツ - 分析種類を切り替え
+# （タブは非表示のものも毎回実行されるため、選択中のビューのデータだけを取得する）
+ANALYTICS_VIEW_KEYS = {"カテゴリ別支出": "category", "店舗別支出": "store", "購入履歴": "purchases", "支出予測": None}
+analytics_view = st.radio("分析の種類", list(ANALYTICS_VIEW_KEYS), horizontal=True, key="analytics_view",
+                          label_visibility="collapsed")
+view_key = ANALYTICS_VIEW_KEYS[analytics_view]
+analytics = get_spending_analytics(
+    user_id=st.session_state['user_id'],
+    start_date=start_date,
+    end_date=end_date,
+    views=[view_key]
+) if view_key else {}
 
-with tab1:
+if analytics_view == "カテゴリ別支出":
     st.subheader("カテゴリ別支出分析")
     
-    # カテゴリ別支出データを取得
-    category_spending = get_category_spending(
-        user_id=st.session_state['user_id'],
-        start_date=start_date,
-        end_date=end_date
-    )
+    # カテゴリ別支出データ
+    category_spending = analytics["category"]
     
     # グラフ表示
     if category_spending:
@@ -124,15 +134,11 @@ with tab1:
     else:
         st.info("選択した期間の購入データがありません")
 
-with tab2:
+elif analytics_view == "店舗別支出":
     st.subheader("店舗別支出分析")
     
-    # 店舗別支出データを取得
-    store_spending = get_store_spending(
-        user_id=st.session_state['user_id'],
-        start_date=start_date,
-        end_date=end_date
-    )
+    # 店舗別支出データ
+    store_spending = analytics["store"]
     
     # グラフ表示
     if store_spending:
@@ -170,15 +176,29 @@ with tab2:
     else:
         st.info("選択した期間の購入データがありません")
 
-with tab3:
+elif analytics_view == "購入履歴":
     st.subheader("購入履歴一覧")
+
+    # レシート・CSVからの一括取り込み
+    with st.expander("ファイルから購入を取り込む", expanded=False):
+        st.caption("列: 日付・店舗・商品名・単価・数量（CSVまたはJSON）。取り込み済みの行は重複して追加されません。")
+        purchase_file = st.file_uploader("購入ファイル", type=["csv", "json", "jsonl"], key="purchase_import_file")
+        encoding = st.selectbox("文字コード", ["utf-8-sig", "cp932"], format_func=lambda e: "UTF-8" if e == "utf-8-sig" else "Shift_JIS (Excel)")
+        if purchase_file is not None and st.button("取り込む"):
+            fmt = "csv" if purchase_file.name.lower().endswith(".csv") else "json"
+            purchase_file.seek(0)
+            result = import_purchases(st.session_state['user_id'], purchase_file, fmt, encoding)
+            if result is None:
+                show_error_message("購入の取り込みに失敗しました")
+            else:
+                show_success_message(
+                    f"{result['imported']}件を取り込みました（重複{result['duplicates']}件・エラー{result['error_count']}件）"
+                )
+                for error in result["errors"][:10]:
+                    st.warning(f"{error['line']}行目: {error['message']}")
     
-    # 購入履歴データを取得
-    purchases = get_user_purchases(
-        user_id=st.session_state['user_id'],
-        start_date=start_date,
-        end_date=end_date
-    )
+    # 購入履歴データ
+    purchases = analytics["purchases"]
     
     if purchases:
         # データをテーブル表示用に整形
@@ -193,7 +213,8 @@ with tab3:
                 "単価": purchase["actual_price"] if purchase["actual_price"] is not None else 0,
                 "数量": purchase["quantity"] if purchase["quantity"] is not None else 0,
                 "合計": purchase["total"] if purchase["total"] is not None else (purchase["actual_price"] or 0) * (purchase["quantity"] or 0),
-                "purchased_at": purchase["purchased_at"]
+                "purchased_at": purchase["purchased_at"],
+                "archived": purchase.get("archived", False)
             })
         
         # DataFrameに変換
@@ -206,6 +227,9 @@ with tab3:
         # 編集UI
         st.write("### 日付編集")
         for row in purchase_data:
+            if row["archived"]:
+                # アーカイブ済みの購入は集計済みのため編集しない
+                continue
             with st.expander(f"{row['日付']} | {row['商品名']} | {row['店舗名']}"):
                 new_date = st.date_input(
                     f"購入日付を編集（ID: {row['id']}）",
@@ -222,7 +246,7 @@ with tab3:
         
         # テーブル表示
         st.dataframe(
-            df.drop(columns=["id", "purchased_at"]),
+            df.drop(columns=["id", "purchased_at", "archived"]),
             column_config={
                 "日付": st.column_config.TextColumn("日付"),
                 "商品名": st.column_config.TextColumn("商品名"),
@@ -269,4 +293,46 @@ with tab3:
         )
         st.altair_chart(chart, use_container_width=True)
     else:
-        st.info("選択した期間の購入データがありません")
\ No newline at end of file
+        st.info("選択した期間の購入データがありません")
+
+else:  # 支出予測
+    st.subheader("来月の支出予測")
+    st.caption("過去の月次支出（最大24か月）のトレンドと季節性から予測します。選択中の表示期間には依存しません。")
+    
+    forecast_dimension = st.radio("予測の単位", ["カテゴリ別", "店舗別"], horizontal=True, key="forecast_dimension")
+    forecast = get_spending_forecast(
+        user_id=st.session_state['user_id'],
+        dimension='store' if forecast_dimension == "店舗別" else 'category'
+    )
+    
+    if forecast["forecasts"]:
+        st.metric(
+            f"{forecast['target_month'].year}年{forecast['target_month'].month}月の予測支出",
+            f"¥{forecast['total']:,.0f}"
+        )
+        st.caption(f"当てはめに使った月数: {forecast['history_months']}か月")
+        
+        label = "店舗名" if forecast_dimension == "店舗別" else "カテゴリ"
+        df = pd.DataFrame(forecast["forecasts"])
+        df = df.rename(columns={"key": label, "forecast": "予測金額", "last_month": "先月", "average": "月平均"})
+        
+        chart = alt.Chart(df).mark_bar().encode(
+            x=alt.X(f"{label}:N", sort="-y", title=label),
+            y=alt.Y("予測金額:Q", title="予測金額（円）"),
+            tooltip=[label, "予測金額", "先月", "月平均"]
+        )
+        st.altair_chart(chart, use_container_width=True)
+        
+        st.dataframe(
+            df,
+            column_config={
+                label: st.column_config.TextColumn(label),
+                "予測金額": st.column_config.NumberColumn("予測金額", format="¥%d"),
+                "先月": st.column_config.NumberColumn("先月", format="¥%d"),
+                "月平均": st.column_config.NumberColumn("月平均", format="¥%d"),
+            },
+            hide_index=True,
+            use_container_width=True
+        )
+    else:
+        st.info("予測に使える過去の購入データがありません")
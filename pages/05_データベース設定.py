@@ -1,8 +1,11 @@
 import streamlit as st
 import os
+import tempfile
 from utils.ui_utils import show_header, show_success_message, show_error_message
 from utils.ui_utils import check_authentication, show_connection_indicator
-from utils.db_utils import get_db_health_check
+from utils.db_utils import get_db_health_check, export_user_data, import_user_data, archive_old_lists
+from utils.db_utils import get_pool_status, reap_idle_sessions, POOL_IDLE_TRANSACTION_SECONDS
+from utils.archive import ARCHIVE_AFTER_DAYS
 from dotenv import load_dotenv
 from utils.ui_utils import patch_dark_background
 
@@ -69,6 +72,25 @@ else:
     st.code(masked_url, language="plaintext")
     st.caption("Railway PostgreSQLデータベースを使用しています")
 
+# 接続プールの利用状況
+st.subheader("接続プール")
+pool_labels = {"primary": "主DB", "replica": "リードレプリカ"}
+for pool_name, pool in get_pool_status().items():
+    if pool is None:
+        continue
+    st.caption(f"{pool_labels[pool_name]}（上限 {pool['capacity']}接続、取得のタイムアウト {pool['timeout_seconds']:.0f}秒）")
+    pool_cols = st.columns(4)
+    pool_cols[0].metric("使用中の接続", f"{pool['checked_out']}/{pool['capacity']}")
+    pool_cols[1].metric("オーバーフロー使用数", f"{pool['overflow_in_use']}/{pool['max_overflow']}")
+    pool_cols[2].metric("取得待ち（平均/最大）", f"{pool['wait_avg_ms']:.1f} / {pool['wait_max_ms']:.1f}ms")
+    pool_cols[3].metric("最長保持", f"{pool['longest_held_seconds']:.0f}秒")
+    if pool["timeouts"]:
+        st.error(f"接続の取得が{pool['timeouts']}回タイムアウトしました。プールの上限か、接続を持ったままのセッションを確認してください")
+    st.caption(f"トランザクション中のセッション: {pool['open_sessions']}件 / 回収済み: {pool['reaped']}件 / 取得回数: {pool['checkouts']}回")
+if POOL_IDLE_TRANSACTION_SECONDS > 0 and st.button("アイドルのセッションを回収"):
+    reaped = reap_idle_sessions()
+    show_success_message(f"{POOL_IDLE_TRANSACTION_SECONDS:.0f}秒以上使われていないセッションを{reaped}件回収しました")
+
 # Railway設定手順
 with st.expander("Railway PostgreSQLの設定手順", expanded=False):
     st.markdown("""
@@ -116,6 +138,52 @@ ENV=production
 また、`.env`ファイルの`DATABASE_URL`を適切な接続文字列に設定してください。
 """)
 
+# ユーザーデータのエクスポート・インポート
+st.subheader("データのエクスポート・インポート")
+st.caption("リスト・商品・購入履歴などをファイルに書き出し、別の環境やアカウントに取り込めます")
+
+export_col, import_col = st.columns(2)
+with export_col:
+    export_format = st.radio("形式", ["parquet", "csv"], horizontal=True,
+                             format_func=lambda fmt: "Parquet" if fmt == "parquet" else "CSV (gzip)")
+    if st.button("エクスポート"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bundle_path = os.path.join(tmp_dir, "shopping_data.zip")
+            counts = export_user_data(st.session_state['user_id'], bundle_path, export_format)
+            if counts is None:
+                show_error_message("エクスポートに失敗しました")
+            else:
+                with open(bundle_path, "rb") as f:
+                    st.session_state['export_bundle'] = f.read()
+                show_success_message(f"リスト{counts['shopping_lists']}件・購入履歴{counts['purchases']}件を書き出しました")
+    if st.session_state.get('export_bundle'):
+        st.download_button("ダウンロード", st.session_state['export_bundle'],
+                           file_name="shopping_data.zip", mime="application/zip")
+
+with import_col:
+    uploaded = st.file_uploader("バンドル（.zip）", type=["zip"])
+    if uploaded is not None and st.button("インポート"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bundle_path = os.path.join(tmp_dir, "bundle.zip")
+            with open(bundle_path, "wb") as f:
+                f.write(uploaded.getbuffer())
+            counts = import_user_data(st.session_state['user_id'], bundle_path)
+        if counts is None:
+            show_error_message("インポートに失敗しました")
+        else:
+            show_success_message(f"リスト{counts['shopping_lists']}件・購入履歴{counts['purchases']}件を取り込みました")
+
+# 古いリストのアーカイブ
+st.subheader("古い買い物リストのアーカイブ")
+st.caption("古いリストと購入履歴をアーカイブに移し、普段の一覧・分析を軽くします（支出分析で古い期間を選ぶとアーカイブも集計されます）")
+archive_days = st.number_input("この日数より前のリストをアーカイブ", min_value=30, value=ARCHIVE_AFTER_DAYS, step=30)
+if st.button("アーカイブ"):
+    counts = archive_old_lists(st.session_state['user_id'], int(archive_days))
+    if counts is None:
+        show_error_message("アーカイブに失敗しました")
+    else:
+        show_success_message(f"リスト{counts['shopping_lists']}件・購入履歴{counts['purchases']}件をアーカイブしました")
+
 # データベースの移行と操作
 with st.expander("データの移行と初期化", expanded=False):
     st.markdown("""
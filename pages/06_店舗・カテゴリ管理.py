@@ -1,5 +1,4 @@
 import streamlit as st
-import pandas as pd
 from utils.ui_utils import show_header, show_success_message, show_error_message, show_hamburger_menu, show_bottom_nav
 from utils.ui_utils import check_authentication, show_connection_indicator, patch_dark_background
 from utils.db_utils import get_stores, get_categories, create_store, create_category
@@ -8,6 +7,9 @@ from utils.db_utils import get_stores, get_categories, create_store, create_cate
 if not check_authentication():
     st.stop()
 
+# 重いライブラリはログイン済みの場合のみ読み込む
+import pandas as pd
+
 # ページ設定
 st.set_page_config(
     page_title="店舗・カテゴリ管理 | 買い物アプリ",
@@ -96,61 +98,36 @@ with tab1:
 
     # 重複店舗クリーンアップセクションを追加
     with st.expander("🧹 重複店舗のクリーンアップ", expanded=False):
-        st.write("同じ名前の店舗が複数登録されている場合、最も古い店舗を残して他を削除します。")
+        st.write("同じ名前（全角/半角・大文字/小文字・空白の違いを含む）の店舗が複数登録されている場合、最も古い店舗を残して他を削除します。")
         st.warning("この操作は元に戻せません。実行前にデータのバックアップをおすすめします。")
         
         if st.button("重複店舗をチェック", key="check_duplicate_stores"):
-            # 重複チェック（削除はまだしない）
-            from utils.db_utils import get_db_session
-            from sqlalchemy import func
-            from utils.models import Store
-            
-            session = get_db_session()
-            duplicate_stores = {}
+            # 重複チェック（削除はまだしない）: 1回のクエリで重複グループを取得
+            from utils.db_utils import find_duplicate_stores
+            duplicates = find_duplicate_stores(st.session_state['user_id'])
+            # セッションに重複店舗情報を保存（クリーンアップボタンの表示に使用）
+            st.session_state['duplicate_stores'] = {group["name"]: group["store_ids"] for group in duplicates}
+            if not duplicates:
+                st.success("重複している店舗はありません！")
+        
+        duplicate_stores = st.session_state.get('duplicate_stores')
+        if duplicate_stores:
+            st.warning(f"{len(duplicate_stores)}種類の店舗に重複があります")
+            for name, store_ids in duplicate_stores.items():
+                st.info(f"「{name}」が{len(store_ids)}件重複しています")
             
-            try:
-                # 重複店舗を検出
-                duplicates = session.query(
-                    Store.name, 
-                    func.count(Store.id).label('count')
-                ).filter(
-                    Store.user_id == st.session_state['user_id']
-                ).group_by(
-                    Store.name
-                ).having(
-                    func.count(Store.id) > 1
-                ).all()
+            # クリーンアップボタンを表示
+            if st.button("重複店舗をクリーンアップ", key="clean_duplicate_stores"):
+                from utils.db_utils import clean_duplicate_stores
+                result = clean_duplicate_stores(user_id=st.session_state['user_id'])
                 
-                if duplicates:
-                    st.warning(f"{len(duplicates)}種類の店舗に重複があります")
-                    
-                    for name, count in duplicates:
-                        st.info(f"「{name}」が{count}件重複しています")
-                        stores = session.query(Store).filter(
-                            Store.name == name,
-                            Store.user_id == st.session_state['user_id']
-                        ).order_by(Store.id).all()
-                        
-                        duplicate_stores[name] = [s.id for s in stores]
-                    
-                    # セッションに重複店舗情報を保存
-                    st.session_state['duplicate_stores'] = duplicate_stores
-                    
-                    # クリーンアップボタンを表示
-                    if st.button("重複店舗をクリーンアップ", key="clean_duplicate_stores"):
-                        from utils.db_utils import clean_duplicate_stores
-                        result = clean_duplicate_stores(user_id=st.session_state['user_id'])
-                        
-                        if "error" in result:
-                            st.error(f"クリーンアップ中にエラーが発生しました: {result['error']}")
-                        else:
-                            st.success(f"{result['cleaned']}件の重複店舗を削除しました。{result['remaining']}件の店舗が残っています。")
-                            # ページを再読み込み
-                            st.rerun()
+                if "error" in result:
+                    st.error(f"クリーンアップ中にエラーが発生しました: {result['error']}")
                 else:
-                    st.success("重複している店舗はありません！")
-            finally:
-                session.close()
+                    del st.session_state['duplicate_stores']
+                    st.success(f"{result['cleaned']}件の重複店舗を削除しました。{result['remaining']}件の店舗が残っています。")
+                    # ページを再読み込み
+                    st.rerun()
 
 # カテゴリ管理タブ
 with tab2:
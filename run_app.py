@@ -3,18 +3,46 @@
 Wrapper script to always launch the Streamlit app on a free port.
 Usage:
     python run_app.py
+    python run_app.py --workers 4      # or WEB_CONCURRENCY=4 python run_app.py
+
+With more than one worker, N Streamlit processes are started on free local
+ports behind a small reverse proxy (utils/worker_proxy.py) listening on PORT.
+The proxy pins each browser to one worker with a cookie, so the Streamlit
+session (WebSocket, uploads, media) always reaches the same process, and it
+restarts workers that exit or stop answering health checks.
 """
+import argparse
+import logging
 import os
 import subprocess
 from utils.port_utils import find_free_port
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Launch the Streamlit app")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("WEB_CONCURRENCY", 1)),
+        help="number of Streamlit worker processes (default: WEB_CONCURRENCY or 1)",
+    )
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     # Determine a free port (default fallback 8501)
     port = find_free_port(int(os.environ.get("PORT", 8501)))
     # Address to bind (default 0.0.0.0)
     address = os.environ.get("ADDRESS", "0.0.0.0")
 
+    if args.workers > 1:
+        # Imported lazily so the single-process path does not load tornado
+        from utils.worker_proxy import serve
+        logging.basicConfig(level=logging.INFO)
+        serve(args.workers, port, address)
+        return
+
     # Prepare environment for Streamlit
     env = os.environ.copy()
     env["STREAMLIT_SERVER_PORT"] = str(port)
@@ -0,0 +1,26 @@
+import os
+import sys
+import pytest
+
+# プロジェクトルートをインポートパスに追加
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """テストごとに一時SQLiteデータベースへ接続し直した db_utils を返す"""
+    from utils import db_utils
+    db_utils.close_db_session()
+    monkeypatch.setattr(db_utils, "DB_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    assert db_utils.init_db()
+    yield db_utils
+    db_utils.close_db_session()
+    db_utils.engine.dispose()
+
+
+@pytest.fixture
+def user_id(db):
+    """テスト用ユーザーのID"""
+    return db.register_user("test@example.com", "password", "テスト").id
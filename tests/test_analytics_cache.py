@@ -0,0 +1,70 @@
+import datetime
+
+
+def _purchase(db, user_id, name, price):
+    list_id = db.create_shopping_list(user_id=user_id, name=name).id
+    line_id = db.add_item_to_shopping_list(list_id, db.create_item(name, user_id).id, planned_price=price).id
+    return db.record_purchase(line_id, actual_price=price)
+
+
+def _count_fetches(db, monkeypatch):
+    calls = []
+    fetch = db._fetch_spending_analytics
+
+    def counting(user_id, start_date, end_date, views, include_archive):
+        calls.append(list(views))
+        return fetch(user_id, start_date, end_date, views, include_archive)
+    monkeypatch.setattr(db, "_fetch_spending_analytics", counting)
+    return calls
+
+
+def test_cached_views_are_not_read_again(db, user_id, monkeypatch):
+    _purchase(db, user_id, "牛乳", 200)
+    calls = _count_fetches(db, monkeypatch)
+    now = datetime.datetime.now()
+
+    first = db.get_spending_analytics(user_id, now - datetime.timedelta(days=30), now, views=["category"])
+    # 同じ日の別の時刻でも同じ期間として扱い、読み取り済みのビューはDBを読まない
+    later = now.replace(hour=23, minute=59)
+    second = db.get_spending_analytics(user_id, later - datetime.timedelta(days=30), later, views=["category", "store"])
+    assert second["category"] == first["category"]
+    assert calls == [["category"], ["store"]]
+
+
+def test_purchase_writes_invalidate_cached_results(db, user_id, monkeypatch):
+    _purchase(db, user_id, "牛乳", 200)
+    calls = _count_fetches(db, monkeypatch)
+    assert db.get_spending_analytics(user_id, views=["category"])["category"][0]["total_spending"] == 200
+
+    purchase = _purchase(db, user_id, "卵", 300)
+    assert db.get_spending_analytics(user_id, views=["category"])["category"][0]["total_spending"] == 500
+
+    # 購入日を期間外へ移すと、その期間の集計から外れる
+    start = datetime.datetime.now() - datetime.timedelta(days=7)
+    assert db.get_spending_analytics(user_id, start, views=["category"])["category"][0]["total_spending"] == 500
+    assert db.update_purchase_date(purchase.id, start - datetime.timedelta(days=3))
+    assert db.get_spending_analytics(user_id, start, views=["category"])["category"][0]["total_spending"] == 200
+    assert len(calls) == 4
+
+
+def test_other_users_cache_is_kept(db, user_id, monkeypatch):
+    other_id = db.register_user("other@example.com", "password", "別ユーザー").id
+    _purchase(db, user_id, "牛乳", 200)
+    calls = _count_fetches(db, monkeypatch)
+    db.get_spending_analytics(user_id, views=["category"])
+    _purchase(db, other_id, "卵", 300)
+    db.get_spending_analytics(user_id, views=["category"])
+    assert len(calls) == 1
+
+
+def test_bulk_store_assignment_invalidates_store_breakdown(db, user_id):
+    store_a = db.create_store(user_id, "A店").id
+    store_b = db.create_store(user_id, "B店").id
+    list_id = db.create_shopping_list(user_id=user_id, name="リスト").id
+    line_id = db.add_item_to_shopping_list(list_id, db.create_item("牛乳", user_id).id, store_id=store_a).id
+    db.record_purchase(line_id, actual_price=200)
+    stores = lambda: [row["store"] for row in db.get_spending_analytics(user_id, views=["store"])["store"]]
+    assert stores() == ["A店"]
+
+    assert db.bulk_update_store_assignments({line_id: store_b}) == 1
+    assert stores() == ["B店"]
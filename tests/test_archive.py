@@ -0,0 +1,87 @@
+import datetime
+
+from sqlalchemy import select, func
+
+from utils.models import MonthlyBudget, ShoppingList, Purchase, ArchivedPurchase, ArchivedSpendingSummary
+
+
+def _add_purchase(db, user_id, list_date, item_id, price, store_id=None):
+    """指定日のリストを作成して購入を記録（購入日もリストの日付にする）"""
+    list_id = db.create_shopping_list(user_id=user_id, date=list_date).id
+    line_id = db.add_item_to_shopping_list(list_id, item_id, store_id=store_id, planned_price=price).id
+    purchase_id = db.record_purchase(line_id, actual_price=price).id
+    db.update_purchase_date(purchase_id, datetime.datetime.combine(list_date, datetime.time(12)))
+    return list_id
+
+
+def _seed(db, user_id):
+    today = datetime.date.today()
+    store_id = db.create_store(user_id, "イオン").id
+    food_id = db.create_category("食品", user_id).id
+    milk_id = db.create_item("牛乳", user_id, category_id=food_id).id
+    bread_id = db.create_item("パン", user_id).id
+    old_date = today - datetime.timedelta(days=400)
+    _add_purchase(db, user_id, old_date, milk_id, 200, store_id)
+    _add_purchase(db, user_id, old_date, bread_id, 150)
+    _add_purchase(db, user_id, today, milk_id, 220, store_id)
+    return old_date
+
+
+def test_archive_moves_old_lists_and_keeps_totals(db, user_id):
+    old_date = _seed(db, user_id)
+    start = datetime.datetime.combine(old_date - datetime.timedelta(days=1), datetime.time.min)
+    before = db.get_category_spending(user_id, start)
+    with db.get_engine().connect() as conn:
+        budgets_before = conn.execute(select(MonthlyBudget.month, MonthlyBudget.spent_total).order_by(MonthlyBudget.month)).all()
+
+    counts = db.archive_old_lists(user_id, older_than_days=365)
+    assert counts == {"shopping_lists": 2, "shopping_list_items": 2, "purchases": 2}
+    # 2回目は移すものがない
+    assert db.archive_old_lists(user_id, older_than_days=365)["shopping_lists"] == 0
+
+    # 通常のクエリは新しいリストだけを読む
+    assert db.get_category_spending(user_id, start) == [{"category": "食品", "total_spending": 220.0}]
+    assert len(db.get_user_purchases(user_id, start)) == 1
+    # アーカイブを含めると移す前と同じ
+    assert db.get_category_spending(user_id, start, include_archive=True) == before
+    purchases = db.get_user_purchases(user_id, start, include_archive=True)
+    assert sorted((p["item_name"], p["archived"]) for p in purchases) == [("パン", True), ("牛乳", False), ("牛乳", True)]
+    stores = db.get_store_spending(user_id, start, include_archive=True)
+    assert {s["store"]: s["total_spending"] for s in stores} == {"イオン": 420.0, "未設定": 150.0}
+
+    with db.get_engine().begin() as conn:
+        assert conn.execute(select(func.count()).select_from(ArchivedSpendingSummary)).scalar() == 2
+        # 月別の累計は作り直してもアーカイブ分を含めて変わらない
+        db.budgets.rebuild_budget_totals(conn, user_id)
+        budgets_after = conn.execute(select(MonthlyBudget.month, MonthlyBudget.spent_total).order_by(MonthlyBudget.month)).all()
+    assert budgets_after == budgets_before
+
+
+def test_analytics_include_archive_only_when_period_reaches_it(db, user_id):
+    old_date = _seed(db, user_id)
+    db.archive_old_lists(user_id, older_than_days=365)
+
+    recent = db.get_spending_analytics(user_id, datetime.datetime.now() - datetime.timedelta(days=30), views=["category"])
+    assert recent["category"] == [{"category": "食品", "total_spending": 220.0}]
+    whole = db.get_spending_analytics(user_id, datetime.datetime.combine(old_date, datetime.time.min), views=["category"])
+    assert whole["category"] == [{"category": "食品", "total_spending": 420.0}, {"category": "未分類", "total_spending": 150.0}]
+
+
+def test_newest_list_is_never_archived(db, user_id):
+    # 最大IDの行を移すとSQLiteでIDが再利用されるため、古くても最新の行を含むリストは残す
+    item_id = db.create_item("牛乳", user_id).id
+    _add_purchase(db, user_id, datetime.date.today() - datetime.timedelta(days=400), item_id, 100)
+    assert db.archive_old_lists(user_id, older_than_days=365)["shopping_lists"] == 0
+    with db.get_engine().connect() as conn:
+        assert conn.execute(select(func.count()).select_from(ShoppingList)).scalar() == 1
+
+
+def test_export_includes_archived_lists(db, user_id, tmp_path):
+    _seed(db, user_id)
+    db.archive_old_lists(user_id, older_than_days=365)
+    counts = db.export_user_data(user_id, str(tmp_path / "bundle"), "csv")
+    assert counts["shopping_lists"] == 3
+    assert counts["purchases"] == 3
+    with db.get_engine().connect() as conn:
+        assert conn.execute(select(func.count()).select_from(Purchase)).scalar() == 1
+        assert conn.execute(select(func.count()).select_from(ArchivedPurchase)).scalar() == 2
@@ -0,0 +1,75 @@
+import datetime
+
+from utils.models import MonthlyBudget
+
+
+def test_totals_follow_item_and_purchase_changes(db, user_id):
+    shopping_list_id = db.create_shopping_list(user_id=user_id, name="週末", date=datetime.date(2025, 3, 1)).id
+    milk_id = db.create_item("牛乳", user_id).id
+    egg_id = db.create_item("卵", user_id).id
+    db.set_list_budget(shopping_list_id, 1000)
+
+    milk_line_id = db.add_item_to_shopping_list(shopping_list_id, milk_id, planned_price=200, quantity=2).id
+    egg_line_id = db.add_item_to_shopping_list(shopping_list_id, egg_id, planned_price=300).id
+    db.add_item_to_shopping_list(shopping_list_id, milk_id, quantity=1)  # 既存行の数量を加算
+    db.update_shopping_list_item(egg_line_id, planned_price=350)
+
+    status = db.get_list_budget_status(shopping_list_id)
+    assert status["planned_total"] == 200 * 3 + 350
+    assert status["spent_total"] == 0
+    assert status["remaining"] == 1000
+    assert not status["planned_over_budget"]
+
+    purchase_id = db.record_purchase(milk_line_id, actual_price=400, quantity=3).id
+    db.update_purchase_date(purchase_id, datetime.datetime(2025, 3, 2, 10, 0))
+    status = db.get_list_budget_status(shopping_list_id)
+    assert status["spent_total"] == 1200
+    assert status["over_budget"] and status["remaining"] == -200
+
+    march = db.get_monthly_budget_status(user_id, datetime.date(2025, 3, 15))
+    assert march["planned_total"] == 950 and march["spent_total"] == 1200
+
+    # 削除すると予定金額と連鎖削除される購入の金額が差し引かれる
+    db.delete_shopping_list_item(milk_line_id)
+    status = db.get_list_budget_status(shopping_list_id)
+    assert status["planned_total"] == 350 and status["spent_total"] == 0
+    march = db.get_monthly_budget_status(user_id, datetime.date(2025, 3, 1))
+    assert march["planned_total"] == 350 and march["spent_total"] == 0
+
+
+def test_purchase_date_and_list_date_move_months(db, user_id):
+    shopping_list_id = db.create_shopping_list(user_id=user_id, name="月末", date=datetime.date(2025, 1, 31)).id
+    bread_id = db.create_item("パン", user_id).id
+    line_id = db.add_item_to_shopping_list(shopping_list_id, bread_id, planned_price=150).id
+    purchase_id = db.record_purchase(line_id, actual_price=160).id
+    db.update_purchase_date(purchase_id, datetime.datetime(2025, 1, 31, 20, 0))
+    db.set_monthly_budget(user_id, datetime.date(2025, 2, 1), 100)
+
+    db.update_purchase_date(purchase_id, datetime.datetime(2025, 2, 1, 9, 0))
+    db.update_shopping_list(shopping_list_id, date=datetime.date(2025, 2, 1))
+
+    january = db.get_monthly_budget_status(user_id, datetime.date(2025, 1, 1))
+    february = db.get_monthly_budget_status(user_id, datetime.date(2025, 2, 1))
+    assert (january["planned_total"], january["spent_total"]) == (0, 0)
+    assert (february["planned_total"], february["spent_total"]) == (150, 160)
+    assert february["over_budget"] and february["budget"] == 100
+
+
+def test_rebuild_matches_incremental_totals(db, user_id):
+    shopping_list_id = db.create_shopping_list(user_id=user_id, name="再計算", date=datetime.date(2025, 4, 5)).id
+    rice_id = db.create_item("米", user_id).id
+    line_id = db.add_item_to_shopping_list(shopping_list_id, rice_id, planned_price=2000).id
+    purchase_id = db.record_purchase(line_id, actual_price=1900).id
+    db.update_purchase_date(purchase_id, datetime.datetime(2025, 4, 6))
+    db.set_monthly_budget(user_id, datetime.date(2025, 4, 1), 5000)
+    before = db.get_monthly_budget_status(user_id, datetime.date(2025, 4, 1))
+
+    with db.engine.begin() as conn:
+        db.budgets.rebuild_budget_totals(conn)
+    db.close_db_session()
+
+    assert db.get_monthly_budget_status(user_id, datetime.date(2025, 4, 1)) == before
+    assert db.get_list_budget_status(shopping_list_id)["spent_total"] == 1900
+    # 記録時（今日）の月から移した支出は0円の行として残る
+    rows = db.get_db_session().query(MonthlyBudget).filter(MonthlyBudget.spent_total != 0).all()
+    assert [row.month for row in rows] == [datetime.date(2025, 4, 1)]
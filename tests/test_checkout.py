@@ -0,0 +1,80 @@
+import datetime
+
+from sqlalchemy import event
+
+
+def _statements(db, func):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        result = func()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    return result, statements
+
+
+def _checked_list(db, user_id, count, store_id):
+    """店舗あり・なしのアイテムが交互に並ぶ、すべてチェック済みのリスト"""
+    list_id = db.create_shopping_list(user_id=user_id, name="今週").id
+    for n in range(count):
+        line_id = db.add_item_to_shopping_list(list_id, db.create_item(f"商品{n}", user_id).id,
+                                               store_id=store_id if n % 2 else None, planned_price=100 + n).id
+        db.update_shopping_list_item(line_id, checked=True)
+    db.close_db_session()
+    return list_id
+
+
+def test_checkout_records_checked_items_with_price_fallback(db, user_id):
+    old_list = db.create_shopping_list(user_id=user_id, name="先週", date=datetime.date(2025, 1, 1)).id
+    eggs = db.create_item("卵", user_id).id
+    db.add_item_to_shopping_list(old_list, eggs, planned_price=250)
+
+    list_id = db.create_shopping_list(user_id=user_id, name="今週").id
+    line_ids = {
+        "planned": db.add_item_to_shopping_list(list_id, db.create_item("牛乳", user_id).id, planned_price=200, quantity=2).id,
+        "default": db.add_item_to_shopping_list(list_id, db.create_item("パン", user_id, default_price=150).id).id,
+        "latest": db.add_item_to_shopping_list(list_id, eggs).id,
+        "unpriced": db.add_item_to_shopping_list(list_id, db.create_item("塩", user_id).id).id,
+        "unchecked": db.add_item_to_shopping_list(list_id, db.create_item("砂糖", user_id).id, planned_price=300).id,
+    }
+    bought = db.add_item_to_shopping_list(list_id, db.create_item("米", user_id).id, planned_price=2000).id
+    for line in ("planned", "default", "latest", "unpriced"):
+        db.update_shopping_list_item(line_ids[line], checked=True)
+    db.record_purchase(bought, actual_price=1980)
+
+    assert db.checkout_shopping_list(list_id) == {"purchased": 3, "total": 800, "unpriced": 1}
+    items = {item.id: item for item in db.get_shopping_list_items(list_id)}
+    paid = {line: [(p.actual_price, p.quantity) for p in items[line_id].purchases] for line, line_id in line_ids.items()}
+    assert paid == {"planned": [(200, 2)], "default": [(150, 1)], "latest": [(250, 1)], "unpriced": [], "unchecked": []}
+    assert db.get_list_budget_status(list_id)["spent_total"] == 1980 + 800
+    assert db.get_usual_price(user_id, eggs) == 250
+
+    # 記録済みのアイテムは二重に記録しない
+    assert db.checkout_shopping_list(list_id) == {"purchased": 0, "total": 0, "unpriced": 1}
+
+
+def test_checkout_one_store(db, user_id):
+    store_id = db.create_store(user_id, "スーパーA").id
+    list_id = db.create_shopping_list(user_id=user_id).id
+    at_store = db.add_item_to_shopping_list(list_id, db.create_item("牛乳", user_id).id, store_id=store_id, planned_price=200).id
+    no_store = db.add_item_to_shopping_list(list_id, db.create_item("パン", user_id).id, planned_price=150).id
+    for line_id in (at_store, no_store):
+        db.update_shopping_list_item(line_id, checked=True)
+
+    assert db.checkout_shopping_list(list_id, store_id, store_only=True)["purchased"] == 1
+    assert db.checkout_shopping_list(list_id, None, store_only=True)["total"] == 150
+    assert db.checkout_shopping_list(list_id)["purchased"] == 0
+
+
+def test_checkout_is_one_insert_regardless_of_item_count(db, user_id):
+    store_id = db.create_store(user_id, "スーパーA").id
+    small = _checked_list(db, user_id, 3, store_id)
+    large = _checked_list(db, user_id, 50, store_id)
+
+    small_result, small_statements = _statements(db, lambda: db.checkout_shopping_list(small))
+    large_result, large_statements = _statements(db, lambda: db.checkout_shopping_list(large))
+    assert (small_result["purchased"], large_result["purchased"]) == (3, 50)
+    assert len(large_statements) == len(small_statements)
+    for table in ("purchases", "price_observations", "item_price_stats"):
+        assert sum(1 for s in large_statements if s.startswith(f"INSERT INTO {table} ")) == 1, table
@@ -0,0 +1,54 @@
+import datetime
+
+import pytest
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "csv"])
+def test_export_and_import_remap_ids(db, user_id, tmp_path, fmt):
+    shared_category_id = db.create_category("乳製品", user_id=None).id
+    store_id = db.create_store(user_id, "スーパーA").id
+    milk_id = db.create_item("牛乳", user_id, category_id=shared_category_id).id
+    bread_id = db.create_item("パン", user_id).id
+    list_id = db.create_shopping_list(user_id=user_id, name="週末", date=datetime.date(2025, 3, 1)).id
+    db.set_list_budget(list_id, 1000)
+    db.set_monthly_budget(user_id, datetime.date(2025, 3, 1), 30000)
+    milk_line_id = db.add_item_to_shopping_list(list_id, milk_id, store_id=store_id, planned_price=200, quantity=2).id
+    db.add_item_to_shopping_list(list_id, bread_id, planned_price=150)
+    purchase_id = db.record_purchase(milk_line_id, actual_price=210, quantity=2).id
+    db.update_purchase_date(purchase_id, datetime.datetime(2025, 3, 2, 10, 0))
+
+    bundle = str(tmp_path / "bundle.zip")
+    counts = db.export_user_data(user_id, bundle, fmt)
+    assert counts == {"stores": 1, "categories": 1, "items": 2, "shopping_lists": 1,
+                      "shopping_list_items": 2, "purchases": 1, "monthly_budgets": 1}
+
+    other_id = db.register_user("other@example.com", "password", "別ユーザー").id
+    imported = db.import_user_data(other_id, bundle)
+    assert imported == counts
+
+    [new_list] = db.get_shopping_lists(other_id)
+    assert new_list.id != list_id and new_list.name == "週末"
+    lines = {line.item.name: line for line in db.get_shopping_list_items(new_list.id)}
+    assert lines["牛乳"].item_id != milk_id
+    assert lines["牛乳"].item.category_id == shared_category_id  # 共有カテゴリはそのまま使う
+    assert lines["牛乳"].store.name == "スーパーA" and lines["牛乳"].store.user_id == other_id
+    assert lines["牛乳"].purchases[0].purchased_at == datetime.datetime(2025, 3, 2, 10, 0)
+
+    # 累計と価格統計は取り込んだデータから作り直される
+    status = db.get_list_budget_status(new_list.id)
+    assert status["budget"] == 1000 and status["planned_total"] == 550 and status["spent_total"] == 420
+    march = db.get_monthly_budget_status(other_id, datetime.date(2025, 3, 1))
+    assert march["budget"] == 30000 and march["spent_total"] == 420
+    assert db.get_usual_price(other_id, lines["牛乳"].item_id, lines["牛乳"].store_id) == 210
+
+    # 同じバンドルをもう一度取り込むと店舗・商品は既存のものを使い、履歴だけが増える
+    db.import_user_data(other_id, bundle)
+    assert len(db.get_stores(other_id)) == 1
+    assert len(db.get_shopping_lists(other_id)) == 2
+
+
+def test_empty_tables_round_trip(db, user_id, tmp_path):
+    bundle = str(tmp_path / "empty")
+    counts = db.export_user_data(user_id, bundle)
+    assert set(counts.values()) == {0}
+    assert db.import_user_data(user_id, bundle) == counts
@@ -0,0 +1,49 @@
+import datetime
+
+import pandas as pd
+
+from utils.grid_sync import snapshot, diff_grid
+
+COLUMNS = {"数量": "quantity", "予定日": "planned_date"}
+
+
+def test_diff_grid_returns_only_changed_cells():
+    day = datetime.date(2025, 5, 1)
+    df = pd.DataFrame({
+        "ID": [10, 11, 12],
+        "数量": [1, 2, 3],
+        "予定日": [day, pd.NaT, day],
+    })
+    edited = df.copy()
+    edited.loc[0, "数量"] = 4
+    edited.loc[1, "予定日"] = day
+    edited.loc[2, "予定日"] = pd.NaT  # 空にしたセルは変更として扱わない
+
+    changes = diff_grid(snapshot(df, "ID"), edited, COLUMNS, "ID")
+    assert changes == {10: {"quantity": 4}, 11: {"planned_date": day}}
+    assert type(changes[10]["quantity"]) is int
+    assert diff_grid(snapshot(df, "ID"), df.copy(), COLUMNS, "ID") == {}
+
+
+def test_apply_list_item_changes_updates_rows_and_planned_total(db, user_id):
+    list_id = db.create_shopping_list(user_id=user_id).id
+    milk = db.add_item_to_shopping_list(list_id, db.create_item("牛乳", user_id).id, planned_price=200)
+    eggs = db.add_item_to_shopping_list(list_id, db.create_item("卵", user_id).id, planned_price=300)
+    day = datetime.date(2025, 5, 1)
+
+    assert db.apply_list_item_changes({
+        milk.id: {"quantity": 3},
+        eggs.id: {"quantity": 2, "planned_date": day},
+    }) == 2
+    items = {item.id: item for item in db.get_shopping_list_items(list_id)}
+    assert (items[milk.id].quantity, items[milk.id].planned_date) == (3, None)
+    assert (items[eggs.id].quantity, items[eggs.id].planned_date) == (2, day)
+    assert db.get_list_budget_status(list_id)["planned_total"] == 1200
+    assert db.get_shopping_list_total(list_id)["total_price"] == 1200
+
+
+def test_apply_list_item_changes_rejects_other_fields(db, user_id):
+    list_id = db.create_shopping_list(user_id=user_id).id
+    line = db.add_item_to_shopping_list(list_id, db.create_item("牛乳", user_id).id, planned_price=200)
+    assert db.apply_list_item_changes({line.id: {"planned_price": 0}}) == 0
+    assert db.get_list_budget_status(list_id)["planned_total"] == 200
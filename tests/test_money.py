@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from utils.money import to_yen, yen_total
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_to_yen_rounds_half_up():
+    assert to_yen(None) is None
+    assert to_yen(198) == 198
+    assert to_yen(198.5) == 199
+    assert to_yen(Decimal("198.49")) == 198
+    assert to_yen("1200") == 1200
+
+
+def test_yen_total_treats_missing_price_as_zero():
+    assert yen_total([100, None, 250], [2, 3, 1]) == 450
+    assert yen_total([], []) == 0
+
+
+def test_money_does_not_load_numpy():
+    # models が money を読み込むため、ここで NumPy を読み込むとログイン画面まで読み込むことになる
+    code = "import sys, utils.money, utils.models; assert 'numpy' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=ROOT_DIR)
+
+
+def test_prices_are_stored_and_summed_as_int(db, user_id):
+    list_id = db.create_shopping_list(user_id=user_id).id
+    item_id = db.create_item("牛乳", user_id, default_price=198.4).id
+    line = db.add_item_to_shopping_list(list_id, item_id, planned_price=199.5, quantity=2)
+    assert line.planned_price == 200
+    db.record_purchase(line.id, actual_price=180.2)
+
+    spending = db.get_category_spending(user_id)
+    assert spending == [{"category": "未分類", "total_spending": 360}]
+    assert type(spending[0]["total_spending"]) is int
+    assert type(db.get_user_purchases(user_id)[0]["actual_price"]) is int
+    assert db.get_shopping_list_total(list_id)["total_price"] == 400
+    assert db.get_list_budget_status(list_id)["spent_total"] == 360
+
+
+def test_migration_rounds_existing_decimal_prices(db, user_id):
+    list_id = db.create_shopping_list(user_id=user_id).id
+    item_id = db.create_item("牛乳", user_id).id
+    line_id = db.add_item_to_shopping_list(list_id, item_id, planned_price=200).id
+    db.close_db_session()
+    # 小数で保存されていた以前のDBを再現
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE shopping_list_items SET planned_price = 199.6 WHERE id = :id"), {"id": line_id})
+        conn.execute(text("UPDATE schema_version SET version = 3"))
+
+    db.engine.dispose()
+    assert db.init_db()
+    with db.engine.connect() as conn:
+        row = conn.execute(text("SELECT planned_price, typeof(planned_price) FROM shopping_list_items")).one()
+    assert tuple(row) == (200, "integer")
@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text, select
+
+from utils import pool_monitor
+from utils.models import User
+
+
+def test_status_tracks_checked_out_connections(db, user_id):
+    db.close_db_session()
+    with db.engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        status = db.get_pool_status()["primary"]
+        assert status["checked_out"] == 1
+        assert status["overflow_in_use"] == 0
+        assert status["longest_held_seconds"] >= 0
+        assert status["longest_held_thread"] is not None
+    status = db.get_pool_status()["primary"]
+    assert status["checked_out"] == 0
+    assert status["checkouts"] > 0
+    assert db.get_pool_status()["replica"] is None
+
+
+def test_checkout_timeout_raises_clear_error(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=pool_monitor.MonitoredQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.1)
+    pool_monitor.attach(engine, "test")
+    try:
+        with engine.connect():
+            with pytest.raises(pool_monitor.PoolExhaustedError, match="使用中 1/1"):
+                engine.connect()
+        assert pool_monitor.pool_status(engine.pool)["timeouts"] == 1
+    finally:
+        engine.dispose()
+
+
+def test_idle_session_of_running_thread_is_rolled_back_by_its_owner(db, user_id):
+    db.close_db_session()
+    session = db.get_db_session()
+    session.execute(select(User.id)).all()
+    assert session.in_transaction()
+    assert db.get_pool_status()["primary"]["open_sessions"] == 1
+
+    # 実行中・最近使ったセッションは回収しない
+    assert db.reap_idle_sessions(max_idle_seconds=60) == 0
+    # 所有者のスレッド（このテスト）が動いているため、回収スレッドはセッションに触れず要求だけする
+    assert db.reap_idle_sessions(max_idle_seconds=0) == 1
+    assert session.in_transaction()
+    assert db.get_pool_status()["primary"]["checked_out"] == 1
+    assert db.reap_idle_sessions(max_idle_seconds=0) == 0
+
+    # 所有者が次に取得したときに自分でロールバックし、接続を返す
+    session = db.get_db_session()
+    assert not session.in_transaction()
+    status = db.get_pool_status()["primary"]
+    assert (status["checked_out"], status["reaped"]) == (0, 1)
+    # セッションはそのまま使い続けられる
+    assert session.execute(select(User.id)).scalar() == user_id
+
+
+def test_idle_session_of_finished_thread_is_rolled_back_by_reaper(db, user_id):
+    session = db.get_session_factory()()
+
+    def script_run():
+        pool_monitor.claim_session(session)
+        session.execute(select(User.id)).all()
+
+    thread = threading.Thread(target=script_run)
+    thread.start()
+    thread.join()
+    assert session.in_transaction()
+    assert db.reap_idle_sessions(max_idle_seconds=0) == 1
+    assert not session.in_transaction()
+    assert db.get_pool_status()["primary"]["checked_out"] == 0
+    session.close()
+
+
+def test_reaper_never_touches_session_while_owner_uses_it(db, user_id, caplog):
+    """回収スレッドを回し続けながら、所有者のスレッドが同じトランザクションで読み続けても壊れない"""
+    session = db.get_session_factory()()
+    done = threading.Event()
+    errors = []
+
+    def reaper():
+        while not done.is_set():
+            try:
+                db.reap_idle_sessions(max_idle_seconds=0)
+            except Exception as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=reaper)
+    thread.start()
+    try:
+        for _ in range(200):
+            pool_monitor.claim_session(session)
+            assert session.execute(select(User.id)).scalar() == user_id
+            transaction = session.get_transaction()
+            assert session.execute(select(User.id)).scalar() == user_id
+            # 取得してから次に取得するまでの間に、別スレッドからロールバックされない
+            assert session.get_transaction() is transaction
+    finally:
+        done.set()
+        thread.join()
+    assert errors == []
+    # 所有者が接続を閉じた直後の判定でも回収処理はエラーにならない
+    assert [r.message for r in caplog.records if r.levelname == "ERROR"] == []
+    pool_monitor.claim_session(session)
+    session.close()
@@ -0,0 +1,50 @@
+import datetime
+from sqlalchemy import text
+from utils.models import ItemPriceStat
+
+
+def _purchase(db, list_id, item_id, store_id, price, day):
+    line = db.add_item_to_shopping_list(list_id, item_id, store_id=store_id)
+    purchase = db.record_purchase(line.id, actual_price=price, quantity=1)
+    db.update_purchase_date(purchase.id, datetime.datetime(2025, 1, day, 12, 0))
+    return purchase
+
+
+def test_record_purchase_maintains_price_stats(db, user_id):
+    store_id = db.create_store(user_id, "イオン").id
+    milk_id = db.create_item("牛乳", user_id).id
+    for day, price in [(3, 200), (1, 180), (2, 240)]:
+        # 同じ店舗・商品を別の行として追加するため、毎回別リストを使う
+        other = db.create_shopping_list(user_id=user_id, name=f"リスト{day}")
+        _purchase(db, other.id, milk_id, store_id, price, day)
+
+    stat = db.get_item_price_stats(user_id, milk_id, store_id)
+    assert stat.observation_count == 3
+    assert float(stat.min_price) == 180
+    assert float(stat.max_price) == 240
+    assert float(stat.last_price) == 200
+    assert stat.last_date == datetime.date(2025, 1, 3)
+    assert db.get_usual_price(user_id, milk_id) == 200
+
+    history = db.get_price_history(user_id, milk_id)
+    assert [float(o.price) for o in history] == [180, 240, 200]
+    assert {o.store_name for o in history} == {"イオン"}
+
+
+def test_backfill_imports_existing_purchases(db, user_id):
+    shopping_list = db.create_shopping_list(user_id=user_id, name="テスト")
+    bread = db.create_item("パン", user_id)
+    line = db.add_item_to_shopping_list(shopping_list.id, bread.id)
+    db.record_purchase(line.id, actual_price=150)
+    bread_id = bread.id
+    # 派生データがない状態（機能追加前のDB）を再現してからバックフィル
+    with db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM price_observations"))
+        conn.execute(text("DELETE FROM item_price_stats"))
+        assert db.price_history.backfill_price_observations(conn) == 1
+        assert db.price_history.backfill_price_observations(conn) == 0
+
+    db.close_db_session()
+    assert db.get_usual_price(user_id, bread_id) == 150
+    session = db.get_db_session()
+    assert session.query(ItemPriceStat).count() == 1
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+import streamlit as st
+from sqlalchemy import event, update
+
+from utils import ui_utils
+from utils.models import User
+
+
+@pytest.fixture
+def logged_in(db, user_id):
+    """ログイン画面と同じ手順でログインした状態にする"""
+    principal = db.login_user("test@example.com", "password")
+    ui_utils.set_principal(principal)
+    yield principal
+    for key in ['user_id', 'user_name', 'user_email', 'user_token', 'principal']:
+        st.session_state.pop(key, None)
+
+
+def _statements(db, func):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        func()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    return statements
+
+
+def test_login_keeps_principal_and_pages_skip_db(db, user_id, logged_in):
+    assert logged_in["user_id"] == user_id
+    assert logged_in["expires_at"] > time.time() + 13 * 24 * 60 * 60
+    assert st.session_state["user_token"] == logged_in["token"]
+
+    assert _statements(db, ui_utils.check_authentication) == []
+    assert st.session_state["user_name"] == "テスト"
+
+
+def test_token_is_reissued_and_user_reloaded_near_expiry(db, user_id, logged_in):
+    with db.get_engine().begin() as conn:
+        conn.execute(update(User).where(User.id == user_id).values(name="新しい名前"))
+    db.close_db_session()
+    ui_utils.init_session_state()
+    assert st.session_state["user_name"] == "テスト"
+
+    st.session_state["principal"] = {**logged_in, "expires_at": time.time() + 60}
+    ui_utils.init_session_state()
+    assert st.session_state["principal"]["expires_at"] > time.time() + 13 * 24 * 60 * 60
+    assert db.verify_jwt_token(st.session_state["user_token"]) == user_id
+    assert st.session_state["user_name"] == "新しい名前"
+
+
+def test_token_without_principal_is_verified_once(db, user_id, logged_in):
+    del st.session_state["principal"]
+    ui_utils.init_session_state()
+    assert st.session_state["principal"]["user_id"] == user_id
+
+    st.session_state.pop("principal")
+    st.session_state["user_token"] = "invalid"
+    ui_utils.init_session_state()
+    assert "user_id" not in st.session_state
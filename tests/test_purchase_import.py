@@ -0,0 +1,55 @@
+import datetime
+import io
+import json
+
+CSV_TEXT = """日付,店舗,商品名,単価,数量
+2025/03/01,イオン,牛乳,¥198,2
+2025/03/01,ｲｵﾝ,牛乳,¥198,2
+2025/03/01,イオン,パン,"1,080円",
+2025/03/02,,卵,250,1
+2025/03/02,イオン,,100,1
+"""
+
+
+def test_csv_import_resolves_names_and_dedupes(db, user_id):
+    existing_store_id = db.create_store(user_id, "イオン").id
+
+    result = db.import_purchases(user_id, io.BytesIO(CSV_TEXT.encode("utf-8")), "csv")
+    assert result["imported"] == 4
+    assert result["error_count"] == 1 and result["errors"][0]["line"] == 6
+    assert result["stores_created"] == 0  # 正規化名が同じ既存の店舗を使う
+    assert result["items_created"] == 3
+    assert result["lists_created"] == 2
+
+    purchases = db.get_user_purchases(user_id)
+    assert len(purchases) == 4  # 同じ内容の2行はどちらも取り込む
+    assert sum(p["actual_price"] * p["quantity"] for p in purchases) == 198 * 4 + 1080 + 250
+
+    march = db.get_monthly_budget_status(user_id, datetime.date(2025, 3, 1))
+    assert march["spent_total"] == 198 * 4 + 1080 + 250
+    milk = next(item for item in db.get_items_by_user(user_id) if item.name == "牛乳")
+    assert db.get_usual_price(user_id, milk.id, existing_store_id) == 198
+
+    # 同じファイルをもう一度取り込んでも増えない
+    again = db.import_purchases(user_id, io.BytesIO(CSV_TEXT.encode("utf-8")), "csv")
+    assert again["imported"] == 0 and again["duplicates"] == 4
+    assert len(db.get_user_purchases(user_id)) == 4
+
+
+def test_json_array_and_lines(db, user_id, tmp_path):
+    records = [
+        {"date": "2025-04-01 18:30", "store": "まいばす", "item": "豆腐", "price": 98, "quantity": 3},
+        {"date": "2025-04-02", "store": "まいばす", "item": "納豆", "price": "88"},
+    ]
+    array_path = tmp_path / "receipts.json"
+    array_path.write_text(json.dumps(records, ensure_ascii=False), encoding="utf-8")
+    assert db.import_purchases(user_id, str(array_path))["imported"] == 2
+
+    lines_path = tmp_path / "receipts.jsonl"
+    lines_path.write_text("\n".join(json.dumps(r, ensure_ascii=False) for r in records) + "\n", encoding="utf-8")
+    result = db.import_purchases(user_id, str(lines_path))
+    assert result["imported"] == 0 and result["duplicates"] == 2
+
+    tofu = next(p for p in db.get_user_purchases(user_id) if p["item_name"] == "豆腐")
+    assert tofu["purchased_at"] == datetime.datetime(2025, 4, 1, 18, 30)
+    assert tofu["store_name"] == "まいばす"
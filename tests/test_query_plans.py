@@ -0,0 +1,238 @@
+"""
+db_utils が発行するクエリの実行計画とクエリ数の回帰テスト
+
+実際に近い量のデータ（複数ユーザー・1年以上の週ごとの買い物・アーカイブ済みの履歴）を作成し、
+db_utils の読み取り関数が発行したクエリごとに実行計画（SQLite は EXPLAIN QUERY PLAN、PostgreSQL は EXPLAIN）を取得する。
+
+- よく使う経路（HOT_PATHS）は、テーブルの全件スキャンと、許可した数を超える並べ替え（一時B-tree・Sort）を失敗にする
+- すべての関数は、データ量によらないクエリ数の上限（WORKLOAD の1つ目の値）を超えたら失敗にする
+
+QUERY_PLAN_DATABASE_URL に空のPostgreSQLデータベースを指定するとPostgreSQLで確認する（テーブルは最後に削除する）。
+QUERY_PLAN_REPORT にファイルパスを指定すると、取得したすべての実行計画を書き出す。
+"""
+import contextlib
+import datetime
+import os
+import re
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event, insert, text
+
+from utils.models import Base, User, Store, Category, Item, ShoppingList, ShoppingListItem, Purchase
+
+USERS = 20
+WEEKS = 60  # アーカイブ対象（ARCHIVE_AFTER_DAYS より前）のリストも含む
+ITEMS = 50
+STORES = 3
+CATEGORIES = 4
+
+# 関数名 → (クエリ数の上限, 呼び出し)
+WORKLOAD = {
+    "get_user_purchases": (1, lambda db, ids: db.get_user_purchases(ids.user_id, ids.start, ids.end)),
+    "get_user_purchases(include_archive)": (1, lambda db, ids: db.get_user_purchases(ids.user_id, include_archive=True)),
+    "get_category_spending": (1, lambda db, ids: db.get_category_spending(ids.user_id, ids.start, ids.end)),
+    "get_store_spending": (1, lambda db, ids: db.get_store_spending(ids.user_id, ids.start, ids.end)),
+    "get_latest_planned_price": (1, lambda db, ids: db.get_latest_planned_price(ids.user_id, ids.item_id)),
+    "get_latest_planned_prices": (1, lambda db, ids: db.get_latest_planned_prices(ids.user_id, ids.item_ids)),
+    # 店舗・商品・カテゴリ・購入履歴はアイテム数によらず関連ごとに1回
+    "get_shopping_list_items": (5, lambda db, ids: db.get_shopping_list_items(ids.list_id)),
+    "get_shopping_list_total": (5, lambda db, ids: db.get_shopping_list_total(ids.list_id)),
+    "get_shopping_list_summaries": (1, lambda db, ids: db.get_shopping_list_summaries(ids.user_id)),
+    "get_shopping_lists": (1, lambda db, ids: db.get_shopping_lists(ids.user_id)),
+    "get_list_budget_status": (1, lambda db, ids: db.get_list_budget_status(ids.list_id)),
+    "get_monthly_budget_status": (1, lambda db, ids: db.get_monthly_budget_status(ids.user_id)),
+    "get_purchase_history": (1, lambda db, ids: db.get_purchase_history(ids.user_id)),
+    "get_monthly_spending": (1, lambda db, ids: db.get_monthly_spending(ids.user_id, ids.end.year, ids.end.month)),
+    # アーカイブに届くかの確認・3種類の集計・カテゴリ別と店舗別へのアーカイブのサマリーの合算
+    "get_spending_analytics": (6, lambda db, ids: db.get_spending_analytics(ids.user_id)),
+    "get_spending_forecast": (2, lambda db, ids: db.get_spending_forecast(ids.user_id)),
+    "get_price_history": (1, lambda db, ids: db.get_price_history(ids.user_id, ids.item_id)),
+    "get_item_price_stats": (1, lambda db, ids: db.get_item_price_stats(ids.user_id, ids.item_id)),
+    "get_usual_price": (1, lambda db, ids: db.get_usual_price(ids.user_id, ids.item_id)),
+    "suggest_store_assignment": (2, lambda db, ids: db.suggest_store_assignment(ids.list_id)),
+    "suggest_items": (4, lambda db, ids: db.suggest_items(ids.user_id, ids.item_ids)),
+    "get_items_by_user": (1, lambda db, ids: db.get_items_by_user(ids.user_id)),
+    "search_items": (1, lambda db, ids: db.search_items(ids.user_id, "商品1")),
+    "get_categories": (1, lambda db, ids: db.get_categories(ids.user_id)),
+    "get_stores": (1, lambda db, ids: db.get_stores(ids.user_id)),
+    "get_user_by_id": (1, lambda db, ids: db.get_user_by_id(ids.user_id)),
+}
+
+# よく使う経路 → 許可する並べ替えの数（利用者の行に絞り込んだ後の集計・結果の並べ替えのみ）
+HOT_PATHS = {
+    "get_user_purchases": 1,
+    "get_user_purchases(include_archive)": 2,
+    "get_category_spending": 2,
+    "get_store_spending": 2,
+    "get_latest_planned_price": 0,
+    "get_latest_planned_prices": 0,
+    "get_shopping_list_items": 0,
+}
+
+# SQLite: サブクエリ・副問い合わせ（anon_N）以外の SCAN は全件スキャン
+_SQLITE_FULL_SCAN = re.compile(r"^SCAN (?!\(|anon_\d|CONSTANT ROW)(\w+)")
+_PG_FULL_SCAN = re.compile(r"Seq Scan on (\w+)")
+_PG_SORT = re.compile(r"^(->\s+)?(Incremental )?Sort\b")
+
+
+def _seed(db) -> SimpleNamespace:
+    """複数ユーザーの1年以上分の買い物を一括で作成し、確認に使うIDを返す"""
+    today = datetime.date.today()
+    lists, lines, purchases = [], [], []
+    line_id = 0
+    for user_id in range(1, USERS + 1):
+        item_base = (user_id - 1) * ITEMS
+        for week in range(WEEKS):
+            list_id = len(lists) + 1
+            day = today - datetime.timedelta(days=7 * week + 1)
+            lists.append(dict(id=list_id, user_id=user_id, date=day, name=f"{day}の買い物", planned_total=0, spent_total=0))
+            for n in range(week % 3, ITEMS, 3):
+                line_id += 1
+                price = 100 + 10 * n
+                lines.append(dict(id=line_id, shopping_list_id=list_id, item_id=item_base + n + 1,
+                                  store_id=(user_id - 1) * STORES + n % STORES + 1, planned_price=price, quantity=1,
+                                  checked=True, created_at=datetime.datetime.combine(day, datetime.time(9))))
+                purchases.append(dict(shopping_list_item_id=line_id, actual_price=price, quantity=1,
+                                      purchased_at=datetime.datetime.combine(day, datetime.time(12))))
+    current_list_id = len(lists) + 1
+    lists.append(dict(id=current_list_id, user_id=1, date=today, name="今週の買い物", planned_total=0, spent_total=0))
+    for n in range(ITEMS):
+        line_id += 1
+        lines.append(dict(id=line_id, shopping_list_id=current_list_id, item_id=n + 1, store_id=n % STORES + 1,
+                          planned_price=0, quantity=1, checked=False, created_at=datetime.datetime.utcnow()))
+
+    with db.get_engine().begin() as conn:
+        conn.execute(insert(User), [dict(id=u, email=f"user{u}@example.com", password_hash="x", name=f"利用者{u}")
+                                    for u in range(1, USERS + 1)])
+        conn.execute(insert(Store), [dict(id=(u - 1) * STORES + s + 1, user_id=u, name=f"店舗{s}", normalized_name=f"店舗{s}")
+                                     for u in range(1, USERS + 1) for s in range(STORES)])
+        conn.execute(insert(Category), [dict(id=(u - 1) * CATEGORIES + c + 1, user_id=u, name=f"カテゴリ{c}")
+                                        for u in range(1, USERS + 1) for c in range(CATEGORIES)])
+        conn.execute(insert(Item), [dict(id=(u - 1) * ITEMS + n + 1, user_id=u, name=f"商品{n}",
+                                         category_id=(u - 1) * CATEGORIES + n % CATEGORIES + 1)
+                                    for u in range(1, USERS + 1) for n in range(ITEMS)])
+        conn.execute(insert(ShoppingList), lists)
+        conn.execute(insert(ShoppingListItem), lines)
+        conn.execute(insert(Purchase), purchases)
+        from utils import price_history, recommendations
+        price_history.backfill_price_observations(conn)
+        recommendations.rebuild_recommendation_stats(conn)
+        if conn.dialect.name == "postgresql":
+            # 一括で入れた行のIDに合わせて連番を進め、統計を更新する
+            for table in ("users", "stores", "categories", "items", "shopping_lists", "shopping_list_items"):
+                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"))
+            conn.execute(text("ANALYZE"))
+    assert db.archive_old_lists()["shopping_lists"] > 0
+
+    now = datetime.datetime.now()
+    return SimpleNamespace(
+        user_id=1, list_id=current_list_id, item_id=1, item_ids=list(range(1, ITEMS + 1, 2)),
+        start=now - datetime.timedelta(days=90), end=now,
+    )
+
+
+@pytest.fixture(scope="module")
+def plan_db(tmp_path_factory):
+    """実際に近い量のデータを入れたDBに接続した db_utils と、確認に使うIDを返す"""
+    from utils import db_utils
+    url = os.getenv("QUERY_PLAN_DATABASE_URL") or f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}"
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        db_utils.close_db_session()
+        monkeypatch.setattr(db_utils, "DB_URL", url)
+        assert db_utils.init_db()
+        try:
+            ids = _seed(db_utils)
+            yield db_utils, ids
+        finally:
+            db_utils.close_db_session()
+            if url.startswith("postgresql://"):
+                Base.metadata.drop_all(db_utils.engine)
+            db_utils.engine.dispose()
+
+
+@contextlib.contextmanager
+def _capture(engine):
+    """実行されたSQLと、ドライバに渡したパラメータを記録する"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def _run(db, ids, name):
+    """キャッシュ・セッションに残った結果を使わずに関数を呼び、発行されたSQLを返す"""
+    db.close_db_session()
+    db._analytics_cache.clear()
+    with _capture(db.engine) as statements:
+        WORKLOAD[name][1](db, ids)
+    return statements
+
+
+def _explain(engine, statement, parameters) -> list:
+    """実行計画の各行"""
+    with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            # テストのデータ量では順次スキャンの方が安く見積もられるため、使えるインデックスがない場合だけ順次スキャンにする
+            conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            return [row[0].strip() for row in conn.exec_driver_sql("EXPLAIN " + statement, parameters)]
+        return [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+
+
+def _plans(db, statements) -> list:
+    return [(statement, _explain(db.engine, statement, parameters))
+            for statement, parameters in statements
+            if statement.lstrip().upper().startswith(("SELECT", "WITH"))]
+
+
+def _full_scans(plan) -> list:
+    pattern = _PG_FULL_SCAN if any(_PG_FULL_SCAN.search(line) or "cost=" in line for line in plan) else _SQLITE_FULL_SCAN
+    return [match.group(1) for match in map(pattern.search, plan) if match]
+
+
+def _sort_count(plan) -> int:
+    return sum(1 for line in plan if "USE TEMP B-TREE" in line or _PG_SORT.match(line))
+
+
+def _describe(plans) -> str:
+    return "\n\n".join(statement.strip() + "\n" + "\n".join(f"  {line}" for line in plan) for statement, plan in plans)
+
+
+@pytest.mark.parametrize("name", list(HOT_PATHS))
+def test_hot_path_plans_use_indexes(plan_db, name):
+    db, ids = plan_db
+    plans = _plans(db, _run(db, ids, name))
+    assert plans, f"{name} がクエリを発行していません"
+
+    scans = [table for _, plan in plans for table in _full_scans(plan)]
+    assert not scans, f"{name} が全件スキャンしています: {scans}\n\n{_describe(plans)}"
+    sorts = sum(_sort_count(plan) for _, plan in plans)
+    assert sorts <= HOT_PATHS[name], f"{name} の並べ替えが {sorts} 回（上限 {HOT_PATHS[name]}）\n\n{_describe(plans)}"
+
+
+@pytest.mark.parametrize("name", list(WORKLOAD))
+def test_query_budget(plan_db, name):
+    db, ids = plan_db
+    statements = _run(db, ids, name)
+    budget = WORKLOAD[name][0]
+    assert len(statements) <= budget, \
+        f"{name} が {len(statements)} 回クエリを発行しました（上限 {budget}）\n\n" + "\n\n".join(s.strip() for s, _ in statements)
+
+
+def test_every_query_has_a_plan(plan_db):
+    db, ids = plan_db
+    report = []
+    for name in WORKLOAD:
+        plans = _plans(db, _run(db, ids, name))
+        assert all(plan for _, plan in plans), name
+        report.append(f"## {name}\n\n{_describe(plans)}")
+    path = os.getenv("QUERY_PLAN_REPORT")
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(report) + "\n")
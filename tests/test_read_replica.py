@@ -0,0 +1,56 @@
+import datetime
+import shutil
+
+import pytest
+
+
+@pytest.fixture
+def replica(db, tmp_path, monkeypatch):
+    """主DBのその時点のコピーを遅延したリードレプリカとして接続する"""
+    def connect():
+        db.close_db_session()
+        db.engine.dispose()
+        shutil.copyfile(db.engine.url.database, tmp_path / "replica.db")
+        monkeypatch.setattr(db, "DB_READ_URL", f"sqlite:///{tmp_path / 'replica.db'}")
+        assert db.init_db()
+    yield connect
+    db.close_db_session()
+    if db.read_engine is not None:
+        db.read_engine.dispose()
+    db._recent_writes.clear()
+
+
+def _purchase(db, user_id, name, price):
+    list_id = db.create_shopping_list(user_id=user_id, name=name).id
+    line_id = db.add_item_to_shopping_list(list_id, db.create_item(name, user_id).id, planned_price=price).id
+    return db.record_purchase(line_id, actual_price=price)
+
+
+def test_reads_go_to_replica_except_right_after_a_write(db, user_id, replica, monkeypatch):
+    _purchase(db, user_id, "牛乳", 200)
+    replica()
+    assert db.read_engine is not None
+
+    # 書き込んでいないユーザーの読み取りはレプリカ（この時点では主DBと同じ）
+    assert [p["item_name"] for p in db.get_user_purchases(user_id)] == ["牛乳"]
+
+    # 購入の記録直後は主DBから読むので、レプリカに未反映の購入も見える
+    _purchase(db, user_id, "卵", 300)
+    assert {p["item_name"] for p in db.get_user_purchases(user_id)} == {"牛乳", "卵"}
+    spending = db.get_spending_analytics(user_id, views=["store", "category"])
+    assert spending["category"][0]["total_spending"] == 500
+
+    # 猶予時間が過ぎるとレプリカ（卵の購入はまだ複製されていない）から読む
+    monkeypatch.setattr(db, "READ_YOUR_WRITES_SECONDS", 0)
+    assert [p["item_name"] for p in db.get_user_purchases(user_id)] == ["牛乳"]
+    db._analytics_cache.clear()  # 結果キャッシュを除いて読み取り先を確認
+    assert db.get_spending_analytics(user_id, views=["store", "category"])["category"][0]["total_spending"] == 200
+    # 主DBの読み取り（リスト・予算など）は影響を受けない
+    assert db.get_monthly_budget_status(user_id)["spent_total"] == 500
+
+
+def test_without_replica_everything_reads_primary(db, user_id):
+    assert db.read_engine is None
+    _purchase(db, user_id, "牛乳", 200)
+    assert db.get_read_session(user_id) is db.get_db_session()
+    assert db._recent_writes == {}
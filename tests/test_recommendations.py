@@ -0,0 +1,92 @@
+import datetime
+
+from sqlalchemy import event
+
+from utils.models import ItemCooccurrence, ItemUsageStat
+
+
+def _snapshot(session):
+    usage = {(r.user_id, r.item_id): (r.list_count, r.purchase_count) for r in session.query(ItemUsageStat)}
+    pairs = {(r.user_id, r.item_id, r.other_item_id): r.count for r in session.query(ItemCooccurrence)}
+    return usage, pairs
+
+
+def test_incremental_stats_match_rebuild(db, user_id):
+    bread, butter, jam, milk = (db.create_item(name, user_id).id for name in ["パン", "バター", "ジャム", "牛乳"])
+    first = db.create_shopping_list(user_id=user_id, name="1").id
+    second = db.create_shopping_list(user_id=user_id, name="2").id
+    for item_id in [bread, butter, jam]:
+        db.add_item_to_shopping_list(first, item_id)
+    line_id = db.add_item_to_shopping_list(second, bread).id
+    db.add_item_to_shopping_list(second, butter)
+    db.add_item_to_shopping_list(second, milk)
+    db.record_purchase(line_id, actual_price=200)
+    jam_line_id = db.add_item_to_shopping_list(second, jam).id
+    db.delete_shopping_list_item(jam_line_id)
+
+    incremental = _snapshot(db.get_db_session())
+    assert incremental[1][(user_id, bread, butter)] == 2
+    assert (user_id, milk, jam) not in incremental[1]
+    assert incremental[0][(user_id, bread)] == (2, 1)
+
+    with db.engine.begin() as conn:
+        db.recommendations.rebuild_recommendation_stats(conn)
+    db.close_db_session()
+    assert _snapshot(db.get_db_session()) == incremental
+
+
+def test_deleting_purchased_lines_keeps_stats_equal_to_rebuild(db, user_id):
+    bread, butter, jam, milk = (db.create_item(name, user_id).id for name in ["パン", "バター", "ジャム", "牛乳"])
+    list_id = db.create_shopping_list(user_id=user_id, name="1").id
+    lines = {item_id: db.add_item_to_shopping_list(list_id, item_id).id for item_id in [bread, butter, jam, milk]}
+    # 店舗違いの同じ商品の行（リストには残る）
+    extra_bread = db.add_item_to_shopping_list(list_id, bread, store_id=db.create_store(user_id, "A店").id).id
+    for line_id in [lines[bread], lines[bread], lines[jam], extra_bread]:
+        db.record_purchase(line_id, actual_price=100)
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        assert db.delete_shopping_list_items([lines[bread], lines[jam], lines[milk]])
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    # 組ごとの減算は1回のUPDATE（executemany）
+    assert sum(1 for s in statements if s.startswith("UPDATE item_cooccurrences")) == 1
+
+    incremental = _snapshot(db.get_db_session())
+    assert incremental[0][(user_id, bread)] == (1, 1)
+    assert incremental[0][(user_id, jam)] == (0, 0)
+
+    with db.engine.begin() as conn:
+        db.recommendations.rebuild_recommendation_stats(conn)
+    db.close_db_session()
+    rebuilt = _snapshot(db.get_db_session())
+    # 再作成ではリストから消えた商品の行は作られない（差分更新では回数0の行が残る）
+    assert rebuilt[1] == incremental[1]
+    assert rebuilt[0] == {key: counts for key, counts in incremental[0].items() if counts != (0, 0)}
+
+
+def test_suggestions_rank_cooccurring_items_first(db, user_id):
+    curry, rice, carrot, tissue = (db.create_item(name, user_id).id for name in ["カレールー", "米", "にんじん", "ティッシュ"])
+    for i in range(3):
+        list_id = db.create_shopping_list(user_id=user_id, name=f"カレー{i}").id
+        db.add_item_to_shopping_list(list_id, curry)
+        db.add_item_to_shopping_list(list_id, carrot)
+    for i in range(5):
+        list_id = db.create_shopping_list(user_id=user_id, name=f"日用品{i}").id
+        db.add_item_to_shopping_list(list_id, tissue)
+    list_id = db.create_shopping_list(user_id=user_id, name="ご飯").id
+    db.add_item_to_shopping_list(list_id, rice)
+
+    suggestions = db.suggest_items(user_id, [curry], k=3)
+    assert suggestions[0]["item_id"] == carrot
+    assert suggestions[0]["together_count"] == 3
+    assert curry not in [s["item_id"] for s in suggestions]
+
+    # 作成中のリストが空なら頻度・最近の利用から提案する
+    assert db.suggest_items(user_id, [], k=1)[0]["item_id"] == tissue
+
+    # 長く使っていない商品は頻度スコアが下がる
+    later = datetime.datetime.utcnow() + datetime.timedelta(days=365)
+    assert db.recommendations.suggest_items(db.get_db_session(), user_id, [], k=1, now=later)[0]["score"] < 0.01
@@ -0,0 +1,39 @@
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+
+def _count_statements(db):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        db.engine.dispose()
+        assert db.init_db()
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+    return statements
+
+
+def test_startup_with_current_schema_reads_one_row(db):
+    statements = _count_statements(db)
+    assert len(statements) == 1
+    assert "schema_version" in statements[0]
+
+
+def test_version_mismatch_runs_migrations(db):
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE schema_version SET version = 0"))
+    statements = _count_statements(db)
+    assert any("CREATE" in s or "PRAGMA" in s for s in statements)
+    with db.engine.connect() as conn:
+        assert conn.execute(text("SELECT version FROM schema_version")).scalar() == db.SCHEMA_VERSION
+
+
+def test_newer_schema_is_left_untouched(db):
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE schema_version SET version = :v"), {"v": db.SCHEMA_VERSION + 1})
+    statements = _count_statements(db)
+    assert len(statements) == 2  # 確認と、ロック取得後の再確認のみ
@@ -0,0 +1,78 @@
+import datetime
+from sqlalchemy import event
+
+
+def test_summaries_aggregate_counts_in_one_query(db, user_id):
+    older = db.create_shopping_list(user_id=user_id, name="先週", date=datetime.date(2025, 1, 1))
+    newer = db.create_shopping_list(user_id=user_id, name="今週", date=datetime.date(2025, 1, 8))
+    milk = db.create_item("牛乳", user_id)
+    bread = db.create_item("パン", user_id)
+    eggs = db.create_item("卵", user_id)
+    milk_line = db.add_item_to_shopping_list(newer.id, milk.id, planned_price=200, quantity=2)
+    db.add_item_to_shopping_list(newer.id, bread.id, planned_price=150)
+    db.add_item_to_shopping_list(newer.id, eggs.id)
+    db.record_purchase(milk_line.id, actual_price=210)
+    newer_id, older_id = newer.id, older.id
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        summaries = db.get_shopping_list_summaries(user_id)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+
+    assert len(statements) == 1
+    assert [s["id"] for s in summaries] == [newer_id, older_id]
+    assert summaries[0]["total_items"] == 3
+    assert summaries[0]["checked_items"] == 1
+    assert summaries[0]["purchased_items"] == 1
+    assert summaries[0]["total_price"] == 550
+    assert summaries[1]["total_items"] == 0
+    assert summaries[1]["total_price"] == 0
+
+
+def _count_statements(db, func):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        result = func()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    return result, len(statements)
+
+
+def test_list_items_load_relations_without_per_row_queries(db, user_id):
+    list_id = db.create_shopping_list(user_id=user_id).id
+    store_id = db.create_store(user_id, "イオン").id
+    category_id = db.create_category("食品", user_id).id
+    for n in range(10):
+        item_id = db.create_item(f"商品{n}", user_id, category_id=category_id).id
+        line_id = db.add_item_to_shopping_list(list_id, item_id, store_id=store_id, planned_price=100).id
+        db.record_purchase(line_id, actual_price=100)
+    db.close_db_session()
+
+    def read():
+        items = db.get_shopping_list_items(list_id)
+        return [(i.store.name, i.item.category.name, len(i.purchases)) for i in items]
+    rows, count = _count_statements(db, read)
+    assert rows == [("イオン", "食品", 1)] * 10
+    # アイテム・店舗・商品・カテゴリ・購入履歴をそれぞれ1回ずつ
+    assert count == 5
+
+
+def test_latest_planned_prices_skip_unpriced_lines(db, user_id):
+    milk = db.create_item("牛乳", user_id).id
+    bread = db.create_item("パン", user_id).id
+    eggs = db.create_item("卵", user_id).id
+    old_list = db.create_shopping_list(user_id=user_id).id
+    db.add_item_to_shopping_list(old_list, milk, planned_price=180)
+    db.add_item_to_shopping_list(old_list, bread, planned_price=150)
+    new_list = db.create_shopping_list(user_id=user_id).id
+    db.add_item_to_shopping_list(new_list, milk, planned_price=200)
+    db.add_item_to_shopping_list(new_list, bread)  # 予定金額なしの行は直近の価格として使わない
+
+    prices, count = _count_statements(db, lambda: db.get_latest_planned_prices(user_id, [milk, bread, eggs]))
+    assert prices == {milk: 200, bread: 150}
+    assert count == 1
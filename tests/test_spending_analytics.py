@@ -0,0 +1,34 @@
+import datetime
+import threading
+
+
+def test_views_are_fetched_concurrently_with_same_results(db, user_id, monkeypatch):
+    store_id = db.create_store(user_id, "イオン").id
+    list_id = db.create_shopping_list(user_id=user_id, name="週末").id
+    milk_id = db.create_item("牛乳", user_id).id
+    line_id = db.add_item_to_shopping_list(list_id, milk_id, store_id=store_id, planned_price=200, quantity=2).id
+    db.record_purchase(line_id, actual_price=180)
+    start, end = datetime.datetime(2000, 1, 1), datetime.datetime.now() + datetime.timedelta(days=1)
+
+    sequential = {view: func(user_id, start, end) for view, func in db.ANALYTICS_VIEWS.items()}
+
+    # 3つの読み取りが同時に実行されていることを確認（全員がそろうまで待つ）
+    barrier = threading.Barrier(len(db.ANALYTICS_VIEWS), timeout=10)
+    threads = set()
+    original = db._fetch_in_own_session
+
+    def fetch(func, *args):
+        threads.add(threading.get_ident())
+        barrier.wait()
+        return original(func, *args)
+
+    monkeypatch.setattr(db, "_fetch_in_own_session", fetch)
+    concurrent = db.get_spending_analytics(user_id, start, end)
+    assert concurrent == sequential
+    assert len(threads) == len(db.ANALYTICS_VIEWS)
+    assert concurrent["category"] == [{"category": "未分類", "total_spending": 360.0}]
+
+
+def test_single_view_only_runs_its_query(db, user_id, monkeypatch):
+    monkeypatch.setitem(db.ANALYTICS_VIEWS, "purchases", lambda *args: (_ for _ in ()).throw(AssertionError("not viewed")))
+    assert db.get_spending_analytics(user_id, views=["store"]) == {"store": []}
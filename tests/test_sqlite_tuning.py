@@ -0,0 +1,16 @@
+def test_pragmas_are_applied_on_every_connection(db):
+    with db.engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == db.SQLITE_BUSY_TIMEOUT_MS
+        assert conn.exec_driver_sql("PRAGMA cache_size").scalar() == db.SQLITE_PRAGMAS["cache_size"]
+
+
+def test_tuning_can_be_disabled(db, monkeypatch):
+    monkeypatch.setattr(db, "SQLITE_TUNING", False)
+    db.close_db_session()
+    db.engine.dispose()
+    assert db.init_db()
+    with db.engine.connect() as conn:
+        # WALはDBファイルに記録されるので残るが、接続ごとの設定は既定値に戻る
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 2  # FULL
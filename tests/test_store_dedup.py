@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from utils.models import Store, ShoppingListItem, normalize_store_name
+
+
+def test_normalize_store_name_absorbs_width_case_and_spaces():
+    assert normalize_store_name("ｲｵﾝ　本店") == normalize_store_name("イオン 本店")
+    assert normalize_store_name("  Ｃｏｓｔｃｏ  ") == "costco"
+    assert normalize_store_name("Seven  Eleven") == "seven eleven"
+    assert normalize_store_name(None) == ""
+
+
+def test_create_store_returns_existing_for_normalized_duplicate(db, user_id):
+    first = db.create_store(user_id=user_id, name="イオン")
+    second = db.create_store(user_id=user_id, name="ｲｵﾝ")
+    third = db.create_store(user_id=user_id, name="ｲｵﾝ", check_duplicate=False)
+    assert second.id == first.id
+    assert third.id == first.id
+    session = db.get_db_session()
+    assert session.query(Store).filter(Store.user_id == user_id).count() == 1
+
+
+def _insert_legacy_shared_duplicates(db):
+    """共有店舗の一意インデックスがなかった頃のDBのように、正規化名が同じ共有店舗を作る"""
+    with db.engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_stores_shared_normalized_name"))
+        conn.execute(text("INSERT INTO stores (id, name, normalized_name) VALUES (101, 'イオン', 'イオン'), (102, 'ｲｵﾝ', 'イオン'), (103, 'イオン ', 'イオン')"))
+
+
+def test_clean_duplicate_stores_remaps_list_items(db, user_id):
+    _insert_legacy_shared_duplicates(db)
+    shopping_list = db.create_shopping_list(user_id=user_id, name="テスト")
+    item = db.create_item("牛乳", user_id)
+    db.add_item_to_shopping_list(shopping_list.id, item.id, store_id=102)
+    db.add_item_to_shopping_list(shopping_list.id, item.id, store_id=103)
+
+    result = db.clean_duplicate_stores()
+
+    assert result["cleaned"] == 2
+    assert result["duplicates"]["イオン"] == {"kept_id": 101, "deleted_ids": [102, 103], "count": 3}
+    session = db.get_db_session()
+    store_ids = {row.store_id for row in session.query(ShoppingListItem.store_id)}
+    assert store_ids == {101}
+
+
+def test_get_stores_hides_shared_store_shadowed_by_own_store(db, user_id):
+    with db.engine.begin() as conn:
+        conn.execute(text("INSERT INTO stores (name, normalized_name) VALUES ('コストコ', 'コストコ'), ('ライフ', 'ライフ')"))
+    own = db.create_store(user_id=user_id, name="ｺｽﾄｺ")
+    stores = db.get_stores(user_id)
+    assert sorted(s.name for s in stores) == sorted(["ｺｽﾄｺ", "ライフ"])
+    assert own.id in {s.id for s in stores}
+
+
+def test_shared_stores_are_unique_by_normalized_name(db):
+    with db.engine.begin() as conn:
+        conn.execute(text("INSERT INTO stores (name, normalized_name) VALUES ('イオン', 'イオン')"))
+    with pytest.raises(IntegrityError):
+        with db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO stores (name, normalized_name) VALUES ('ｲｵﾝ', 'イオン')"))
+
+    shared = db.create_store(user_id=None, name="ｲｵﾝ", check_duplicate=False)
+    assert shared.name == "イオン"
+
+
+def test_migration_merges_shared_duplicates_before_creating_index(db, user_id):
+    _insert_legacy_shared_duplicates(db)
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE schema_version SET version = 5"))
+    db.engine.dispose()
+    assert db.init_db()
+
+    with db.engine.connect() as conn:
+        assert conn.execute(text("SELECT id FROM stores WHERE user_id IS NULL")).scalars().all() == [101]
+        indexes = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'stores'")).scalars().all()
+    assert "uq_stores_shared_normalized_name" in indexes
@@ -0,0 +1,98 @@
+import numpy as np
+from utils.store_optimizer import optimize_assignment
+
+nan = np.nan
+
+
+def test_unlimited_stores_picks_cheapest_per_item():
+    prices = np.array([
+        [100, 120, nan],
+        [300, 250, 260],
+        [nan, nan, nan],
+    ])
+    result = optimize_assignment(prices, np.array([1, 2, 1]))
+    assert list(result["store_indices"]) == [0, 1, -1]
+    assert result["expected_total"] == 100 + 500
+
+
+def test_store_cap_minimizes_total_with_worst_price_for_uncovered_items():
+    prices = np.array([
+        [100, 110, 90],
+        [200, 180, nan],
+        [nan, 50, 60],
+    ])
+    quantities = np.ones(3)
+    result = optimize_assignment(prices, quantities, max_stores=1)
+    # 店舗1だけで 110 + 180 + 50 = 340 が最小
+    assert list(result["chosen_stores"]) == [1]
+    assert list(result["store_indices"]) == [1, 1, 1]
+    assert result["expected_total"] == 340
+
+    result = optimize_assignment(prices, quantities, max_stores=2)
+    assert list(result["chosen_stores"]) == [1, 2]
+    assert result["expected_total"] == 90 + 180 + 50
+
+
+def test_greedy_fallback_matches_exhaustive_on_simple_case(monkeypatch):
+    from utils import store_optimizer
+    rng = np.random.default_rng(0)
+    prices = rng.integers(80, 120, size=(50, 8)).astype(float)
+    exhaustive = optimize_assignment(prices, np.ones(50), max_stores=3)
+    monkeypatch.setattr(store_optimizer, "MAX_EXHAUSTIVE_COMBINATIONS", 0)
+    greedy = optimize_assignment(prices, np.ones(50), max_stores=3)
+    assert len(greedy["chosen_stores"]) <= 3
+    assert greedy["expected_total"] >= exhaustive["expected_total"]
+
+
+def test_suggest_and_bulk_apply(db, user_id):
+    cheap = db.create_store(user_id, "安い店").id
+    pricey = db.create_store(user_id, "高い店").id
+    milk = db.create_item("牛乳", user_id).id
+    history = db.create_shopping_list(user_id=user_id, name="履歴").id
+    for store_id, price in [(cheap, 180), (pricey, 250)]:
+        line = db.add_item_to_shopping_list(history, milk, store_id=store_id)
+        db.record_purchase(line.id, actual_price=price)
+
+    draft = db.create_shopping_list(user_id=user_id, name="次回").id
+    line_id = db.add_item_to_shopping_list(draft, milk, store_id=pricey, quantity=2).id
+    suggestion = db.suggest_store_assignment(draft)
+    assert suggestion["assignments"] == {line_id: cheap}
+    assert suggestion["current_total"] == 500
+    assert suggestion["expected_total"] == 360
+
+    assert db.bulk_update_store_assignments(suggestion["assignments"]) == 1
+    assert [i.store_id for i in db.get_shopping_list_items(draft)] == [cheap]
+
+
+def test_suggestion_respects_store_cap_and_compares_same_lines(db, user_id):
+    store_a = db.create_store(user_id, "A店").id
+    store_b = db.create_store(user_id, "B店").id
+    items = {name: db.create_item(name, user_id).id for name in ("牛乳", "パン", "卵", "塩")}
+    history = db.create_shopping_list(user_id=user_id, name="履歴").id
+    for name, store_id, price in [("牛乳", store_a, 100), ("牛乳", store_b, 150),
+                                  ("パン", store_a, 200), ("パン", store_b, 180), ("卵", store_b, 300)]:
+        line = db.add_item_to_shopping_list(history, items[name], store_id=store_id)
+        db.record_purchase(line.id, actual_price=price)
+
+    draft = db.create_shopping_list(user_id=user_id, name="次回").id
+    line_ids = {name: db.add_item_to_shopping_list(draft, item_id, store_id=store_b).id for name, item_id in items.items()}
+    suggestion = db.suggest_store_assignment(draft, max_stores=1)
+
+    # A店だけで 100 + 200 + 卵はA店の価格が分からないため既知の最高値300 = 600（B店だけなら630）
+    assert suggestion["store_ids"] == [store_a]
+    assert suggestion["expected_total"] == 600
+    # 現在の割り当ても同じ3行（価格履歴がない塩は含めない）で比べる
+    assert suggestion["current_total"] == 150 + 180 + 300
+    # B店に残すと上限を超えるため、A店で買えるか分からない卵と価格履歴がない塩は店舗を未指定にする
+    assert suggestion["assignments"] == {
+        line_ids["牛乳"]: store_a, line_ids["パン"]: store_a, line_ids["卵"]: None, line_ids["塩"]: None,
+    }
+    assert suggestion["unassigned_item_ids"] == [line_ids["卵"], line_ids["塩"]]
+    assert suggestion["unpriced_item_ids"] == [line_ids["塩"]]
+
+    # 上限に余裕があれば現在の店舗のまま
+    assert db.suggest_store_assignment(draft, max_stores=2)["unassigned_item_ids"] == []
+
+    assert db.bulk_update_store_assignments(suggestion["assignments"]) == 4
+    stores = {item.id: item.store_id for item in db.get_shopping_list_items(draft)}
+    assert stores == {line_ids["牛乳"]: store_a, line_ids["パン"]: store_a, line_ids["卵"]: None, line_ids["塩"]: None}
@@ -0,0 +1,203 @@
+import sys
+import time
+
+from tornado import gen, httpclient, httpserver, ioloop, locks, testing, web, websocket
+
+from utils import worker_proxy
+from utils.worker_proxy import STICKY_COOKIE, Worker, WorkerPool, make_app
+
+
+class _Running:
+    """動き続けているワーカープロセスの代わり"""
+    pid = 0
+
+    def poll(self):
+        return None
+
+
+def _pool(count):
+    return WorkerPool([Worker(i, 9000 + i, ["true"], {}) for i in range(count)])
+
+
+def test_choose_prefers_least_connected_healthy_worker():
+    pool = _pool(3)
+    assert pool.choose() is None
+    for worker in pool.workers:
+        worker.healthy = True
+    pool.workers[0].connections = 2
+    pool.workers[1].connections = 1
+    pool.workers[2].healthy = False
+    assert pool.choose().index == 1
+
+
+def test_sticky_index_only_returns_live_ready_worker():
+    pool = _pool(3)
+    for worker in pool.workers:
+        worker.process = _Running()
+    pool.workers[1].ready = True
+    pool.workers[2].ready = True
+    pool.workers[2].process = None
+    assert pool.get(1) is pool.workers[1]
+    assert pool.get(0) is None  # 起動後まだ応答していない
+    assert pool.get(2) is None  # プロセスが終了している
+    assert pool.get(5) is None
+    assert pool.get(None) is None
+
+
+def test_dead_worker_is_restarted():
+    worker = Worker(0, testing.bind_unused_port()[1], [sys.executable, "-c", "import time; time.sleep(60)"], {})
+    pool = WorkerPool([worker])
+    worker.start()
+    try:
+        first = worker.process
+        first.kill()
+        first.wait()
+        worker.ready = worker.healthy = True
+        ioloop.IOLoop().run_sync(pool.check_health)
+        assert worker.process is not first
+        assert worker.alive
+        assert not worker.ready and not worker.healthy
+    finally:
+        worker.stop()
+
+
+class _Page(web.RequestHandler):
+    def initialize(self, name, state):
+        self.name = name
+
+    def get(self):
+        self.finish(self.name)
+
+
+class _Health(web.RequestHandler):
+    def initialize(self, name, state):
+        self.state = state
+
+    def get(self):
+        self.set_status(200 if self.state["healthy"] else 503)
+        self.finish("ok")
+
+
+class _Stream(websocket.WebSocketHandler):
+    def initialize(self, name, state):
+        self.name = name
+        self.state = state
+
+    async def prepare(self):
+        # ハンドシェイクを止めておけるようにする
+        await self.state["accept"].wait()
+
+    def open(self):
+        self.state["streams"] += 1
+        self.write_message(self.name)
+
+    def on_close(self):
+        self.state["streams"] -= 1
+
+
+class StickyProxyTest(testing.AsyncHTTPTestCase):
+    """偽のワーカー2つの前にプロキシを置き、Cookieでの固定を確かめる"""
+
+    def get_app(self):
+        workers = []
+        self.states = []
+        self.upstreams = []
+        for index in range(2):
+            sock, port = testing.bind_unused_port()
+            state = {"healthy": True, "accept": locks.Event(), "streams": 0}
+            state["accept"].set()
+            args = {"name": f"worker{index}", "state": state}
+            server = web.Application([
+                (r"/_stcore/health", _Health, args),
+                (r"/_stcore/stream", _Stream, args),
+                (r"/.*", _Page, args),
+            ])
+            upstream = httpserver.HTTPServer(server)
+            upstream.add_sockets([sock])
+            self.upstreams.append(upstream)
+            worker = Worker(index, port, ["true"], {})
+            worker.process = _Running()
+            workers.append(worker)
+            self.states.append(state)
+        self.pool = WorkerPool(workers)
+        return make_app(self.pool)
+
+    def tearDown(self):
+        for upstream in self.upstreams:
+            upstream.stop()
+        super().tearDown()
+
+    def _get(self, cookie=None):
+        headers = {"Cookie": f"{STICKY_COOKIE}={cookie}"} if cookie is not None else {}
+        return self.fetch("/", headers=headers)
+
+    @gen.coroutine
+    def _stream(self, cookie):
+        request = httpclient.HTTPRequest(
+            self.get_url("/_stcore/stream").replace("http", "ws", 1),
+            headers={"Cookie": f"{STICKY_COOKIE}={cookie}"},
+        )
+        connection = yield websocket.websocket_connect(request)
+        message = yield connection.read_message()
+        connection.close()
+        return message
+
+    @testing.gen_test
+    def _check_health(self):
+        yield self.pool.check_health()
+
+    def test_cookie_pins_http_and_websocket_to_one_worker(self):
+        self._check_health()
+        self.pool.workers[0].connections = 5  # 新しいセッションはworker1へ
+        response = self._get()
+        assert response.body == b"worker1"
+        assert f"{STICKY_COOKIE}=1" in response.headers["Set-Cookie"]
+
+        self.pool.workers[0].connections = 0
+        self.pool.workers[1].connections = 5
+        assert self._get("1").body == b"worker1"
+        assert self.io_loop.run_sync(lambda: self._stream("1")) == "worker1"
+        assert self.io_loop.run_sync(lambda: self._stream("0")) == "worker0"
+
+    def test_failed_health_check_keeps_live_worker_pinned(self):
+        self._check_health()
+        self.states[1]["healthy"] = False
+        for worker in self.pool.workers:
+            worker.started_at = time.monotonic() - worker_proxy.STARTUP_GRACE_SECONDS
+        self._check_health()
+        busy = self.pool.workers[1]
+        assert not busy.healthy and busy.ready and busy.failures == 1
+
+        # 固定済みのブラウザは同じワーカーのまま（Cookieを発行し直さない）
+        response = self._get("1")
+        assert response.body == b"worker1"
+        assert "Set-Cookie" not in response.headers
+        assert self.io_loop.run_sync(lambda: self._stream("1")) == "worker1"
+        # 新しいセッションは応答しているワーカーへ
+        assert self._get().body == b"worker0"
+
+    @testing.gen_test
+    def test_client_closing_during_upstream_connect_is_not_counted(self):
+        handlers = []
+        prepare = worker_proxy.StreamProxyHandler.prepare
+
+        def recording_prepare(handler):
+            handlers.append(handler)
+            return prepare(handler)
+        worker_proxy.StreamProxyHandler.prepare = recording_prepare
+        self.addCleanup(setattr, worker_proxy.StreamProxyHandler, "prepare", prepare)
+
+        yield self.pool.check_health()
+        state = self.states[0]
+        state["accept"].clear()
+        request = httpclient.HTTPRequest(
+            self.get_url("/_stcore/stream").replace("http", "ws", 1),
+            headers={"Cookie": f"{STICKY_COOKIE}=0"},
+        )
+        yield websocket.websocket_connect(request)
+        # ワーカーへの接続待ちの間にブラウザとの接続が切れる（tornado が接続の中断時に呼ぶ処理）
+        handlers[0].on_connection_close()
+        state["accept"].set()
+        yield gen.sleep(0.2)
+        assert self.pool.workers[0].connections == 0
+        assert state["streams"] == 0
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+ユーザーのデータ一式をバンドル（Parquet または gzip CSV）に書き出す・取り込むスクリプト
+
+使い方:
+    python transfer_user_data.py export <ユーザーID> <出力先(.zip またはディレクトリ)> [--format csv]
+    python transfer_user_data.py import <ユーザーID> <バンドル(.zip またはディレクトリ)>
+
+接続先は DATABASE_URL で指定する（別のインスタンスへ移す場合は export と import で切り替える）。
+"""
+
+import argparse
+import sys
+import time
+from utils.db_utils import export_user_data, import_user_data
+
+def main():
+    parser = argparse.ArgumentParser(description="ユーザーデータのエクスポート・インポート")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("user_id", type=int, help="対象のユーザーID（importでは取り込み先）")
+    parser.add_argument("path", help="バンドルのパス（.zip またはディレクトリ）")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet", help="exportの形式")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "export":
+        counts = export_user_data(args.user_id, args.path, args.format)
+    else:
+        counts = import_user_data(args.user_id, args.path)
+    if counts is None:
+        print("エラーが発生しました。ログを確認してください。")
+        sys.exit(1)
+
+    for table, count in counts.items():
+        print(f"  {table}: {count}件")
+    print(f"完了しました（{time.perf_counter() - start:.1f}秒）")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+古い買い物リストのアーカイブ（ホット／コールドの分離）
+
+日付が ARCHIVE_AFTER_DAYS 日より前の買い物リストを、リストアイテム・購入履歴ごと
+アーカイブ用のテーブル（archived_*）へ元のIDのまま移す。移した購入は
+日×カテゴリ名×店舗名ごとの支出サマリー（archived_spending_summaries）にも集計しておく。
+一覧・直近価格・支出分析の通常のクエリはホットなテーブルだけを読み、
+アーカイブした期間を含む履歴・分析のときだけアーカイブ側を合わせて読む。
+予算の累計・価格観測・おすすめの統計は集計済みの値なので、移しても変わらない。
+"""
+import datetime
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import select, insert, delete, func, literal
+
+from .models import (ShoppingList, ShoppingListItem, Purchase, Item, Category, Store,
+                     ArchivedShoppingList, ArchivedShoppingListItem, ArchivedPurchase, ArchivedSpendingSummary)
+from .sql_utils import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+# この日数より前の日付のリストをアーカイブする
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+# 1トランザクションで移すリスト数
+BATCH_SIZE = 500
+
+# (ホットなテーブル, アーカイブ用テーブル)。移す順（参照される側が先）
+_TABLE_PAIRS = (
+    (ShoppingList.__table__, ArchivedShoppingList.__table__),
+    (ShoppingListItem.__table__, ArchivedShoppingListItem.__table__),
+    (Purchase.__table__, ArchivedPurchase.__table__),
+)
+
+def archive_cutoff(today: Optional[datetime.date] = None, days: int = ARCHIVE_AFTER_DAYS) -> datetime.date:
+    """この日付より前のリストをアーカイブ対象とする基準日"""
+    return (today or datetime.date.today()) - datetime.timedelta(days=days)
+
+def _to_date(value) -> datetime.date:
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+def _newest_list_ids(executor) -> set:
+    """各テーブルの最大IDの行を含むリスト（SQLiteは最大ID+1で採番するため、移すとIDが再利用される）"""
+    lists, list_items, purchases = (hot for hot, _ in _TABLE_PAIRS)
+    ids = {
+        executor.execute(select(func.max(lists.c.id))).scalar(),
+        executor.execute(
+            select(list_items.c.shopping_list_id)
+            .where(list_items.c.id == select(func.max(list_items.c.id)).scalar_subquery())
+        ).scalar(),
+        executor.execute(
+            select(list_items.c.shopping_list_id)
+            .join_from(purchases, list_items, purchases.c.shopping_list_item_id == list_items.c.id)
+            .where(purchases.c.id == select(func.max(purchases.c.id)).scalar_subquery())
+        ).scalar(),
+    }
+    ids.discard(None)
+    return ids
+
+def _summarize(executor, list_ids: List[int]) -> None:
+    """移すリストの購入を日×カテゴリ×店舗ごとに集計し、サマリーに加算"""
+    lists, list_items, purchases = (hot for hot, _ in _TABLE_PAIRS)
+    day = func.date(purchases.c.purchased_at)
+    category = func.coalesce(Category.name, '未分類')
+    store = func.coalesce(Store.name, '未設定')
+    rows = executor.execute(
+        select(
+            lists.c.user_id,
+            day.label('day'),
+            category.label('category_name'),
+            store.label('store_name'),
+            func.sum(purchases.c.actual_price * purchases.c.quantity).label('total'),
+            func.count(purchases.c.id).label('purchase_count'),
+        ).select_from(
+            purchases
+            .join(list_items, purchases.c.shopping_list_item_id == list_items.c.id)
+            .join(lists, list_items.c.shopping_list_id == lists.c.id)
+            .outerjoin(Item.__table__, list_items.c.item_id == Item.id)
+            .outerjoin(Category.__table__, Item.category_id == Category.id)
+            .outerjoin(Store.__table__, list_items.c.store_id == Store.id)
+        ).where(lists.c.id.in_(list_ids))
+        .group_by(lists.c.user_id, day, category, store)
+    ).all()
+    if not rows:
+        return
+
+    summaries = ArchivedSpendingSummary.__table__
+    stmt = dialect_insert(executor, summaries)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[summaries.c.user_id, summaries.c.day, summaries.c.category_name, summaries.c.store_name],
+        set_={
+            "total": summaries.c.total + stmt.excluded.total,
+            "purchase_count": summaries.c.purchase_count + stmt.excluded.purchase_count,
+        }
+    )
+    executor.execute(stmt, [
+        {"user_id": row.user_id, "day": _to_date(row.day), "category_name": row.category_name,
+         "store_name": row.store_name, "total": row.total, "purchase_count": row.purchase_count}
+        for row in rows
+    ])
+
+def _move_lists(executor, list_ids: List[int]) -> Dict[str, int]:
+    """リストとそのアイテム・購入履歴をアーカイブ用テーブルへ移す（INSERT ... SELECT と DELETE のみ）"""
+    lists, list_items, purchases = (hot for hot, _ in _TABLE_PAIRS)
+    line_ids = select(list_items.c.id).where(list_items.c.shopping_list_id.in_(list_ids))
+    filters = {
+        lists.name: lists.c.id.in_(list_ids),
+        list_items.name: list_items.c.shopping_list_id.in_(list_ids),
+        purchases.name: purchases.c.shopping_list_item_id.in_(line_ids),
+    }
+
+    _summarize(executor, list_ids)
+    now = datetime.datetime.utcnow()
+    for hot, archived in _TABLE_PAIRS:
+        columns = [column.name for column in hot.c if column.name in archived.c]
+        values = [hot.c[name] for name in columns]
+        if 'archived_at' in archived.c:
+            columns.append('archived_at')
+            values.append(literal(now, archived.c.archived_at.type))
+        executor.execute(insert(archived).from_select(columns, select(*values).where(filters[hot.name])))
+
+    # 参照する側から削除
+    counts = {}
+    for hot, _ in reversed(_TABLE_PAIRS):
+        counts[hot.name] = executor.execute(delete(hot).where(filters[hot.name])).rowcount
+    return counts
+
+def archive_old_lists(executor, before: datetime.date, user_id: Optional[int] = None,
+                      batch_size: int = BATCH_SIZE, on_batch: Optional[Callable[[], Any]] = None) -> Dict[str, int]:
+    """
+    日付が before より前の買い物リストを BATCH_SIZE 件ずつアーカイブする
+
+    Args:
+        executor: SQLAlchemyのConnectionまたはSession
+        before (date): この日付より前のリストが対象
+        user_id (int, optional): 対象ユーザー（省略時は全ユーザー）
+        batch_size (int): 1回に移すリスト数
+        on_batch (callable, optional): 1回分を移すたびに呼ぶ関数（コミットして書き込みロックを手放すため）
+
+    Returns:
+        dict: テーブル名 → 移した行数
+    """
+    lists = ShoppingList.__table__
+    counts = {hot.name: 0 for hot, _ in _TABLE_PAIRS}
+    excluded = _newest_list_ids(executor)
+    query = select(lists.c.id).where(lists.c.date < before).order_by(lists.c.id).limit(batch_size)
+    if user_id is not None:
+        query = query.where(lists.c.user_id == user_id)
+    if excluded:
+        query = query.where(lists.c.id.not_in(sorted(excluded)))
+
+    while True:
+        list_ids = list(executor.execute(query).scalars())
+        if not list_ids:
+            break
+        for table, count in _move_lists(executor, list_ids).items():
+            counts[table] += count
+        if on_batch:
+            on_batch()
+    if counts[lists.name]:
+        logger.info(f"{before}より前の買い物リストをアーカイブしました: {counts}")
+    return counts
+
+def get_archive_horizon(executor, user_id: int) -> Optional[datetime.date]:
+    """アーカイブ済みの購入の最も新しい購入日（アーカイブがなければ None）"""
+    summaries = ArchivedSpendingSummary.__table__
+    value = executor.execute(select(func.max(summaries.c.day)).where(summaries.c.user_id == user_id)).scalar()
+    return _to_date(value) if value is not None else None
+
+def period_reaches_archive(executor, user_id: int, start_date: Optional[datetime.date]) -> bool:
+    """期間の開始（None は全期間）がアーカイブ済みの最新の購入日以前か"""
+    horizon = get_archive_horizon(executor, user_id)
+    if horizon is None:
+        return False
+    return start_date is None or _to_date(start_date) <= horizon
+
+def get_archived_spending(executor, user_id: int, dimension: str = 'category',
+                          start_date: Optional[datetime.datetime] = None,
+                          end_date: Optional[datetime.datetime] = None) -> List[Any]:
+    """
+    アーカイブ済みの支出をカテゴリ別（dimension='store' で店舗別）にサマリーから集計する
+
+    期間は日単位で判定する（start_date・end_date の日を含む）。
+
+    Returns:
+        list: (key, total) の行
+    """
+    summaries = ArchivedSpendingSummary.__table__
+    key = summaries.c.store_name if dimension == 'store' else summaries.c.category_name
+    query = select(key.label('key'), func.sum(summaries.c.total).label('total'))\
+        .where(summaries.c.user_id == user_id).group_by(key)
+    if start_date:
+        query = query.where(summaries.c.day >= _to_date(start_date))
+    if end_date:
+        query = query.where(summaries.c.day <= _to_date(end_date))
+    return executor.execute(query).all()
@@ -0,0 +1,255 @@
+"""
+リスト別・月別の予算と、予定金額・支出金額の累計
+
+予定金額（planned_price × quantity）と支出金額（actual_price × quantity）の合計は
+アイテムや購入の追加・変更・削除のたびに差分だけを加算して維持する。
+「残りいくら使えるか」「予算超過か」は shopping_lists / monthly_budgets の1行を読むだけで判定できる。
+予定はリストの日付の月、支出は購入日の月に計上する。
+"""
+import datetime
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select, update, func, bindparam
+
+from .models import MonthlyBudget, ShoppingList, ShoppingListItem, Purchase, ArchivedShoppingList, ArchivedSpendingSummary
+from .sql_utils import dialect_insert
+from .money import to_yen
+
+logger = logging.getLogger(__name__)
+
+def month_start(value) -> datetime.date:
+    """日時・日付・ISO形式文字列をその月の月初の日付に変換"""
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    elif not isinstance(value, datetime.date):
+        value = datetime.date.fromisoformat(str(value)[:10])
+    return value.replace(day=1)
+
+def planned_amount(list_item) -> int:
+    """リストアイテムの予定金額（円。価格未設定は0）"""
+    return (to_yen(list_item.planned_price) or 0) * (list_item.quantity or 0)
+
+def _ensure_month_rows(executor, keys: Iterable[tuple]) -> None:
+    """(user_id, 月初) の月次行がなければ作成（同時実行でも重複しない）"""
+    rows = [{"user_id": user_id, "month": month, "planned_total": 0, "spent_total": 0} for user_id, month in set(keys)]
+    if rows:
+        stmt = dialect_insert(executor, MonthlyBudget.__table__).on_conflict_do_nothing(
+            index_elements=['user_id', 'month']
+        )
+        executor.execute(stmt, rows)
+
+def _add_to_lists(executor, column: str, amounts: Dict[int, int]) -> None:
+    """リストの累計カラムに差分を加算（DB側で加算するので同時更新でも失われない）"""
+    lists = ShoppingList.__table__
+    params = [{"list_id": list_id, "amount": amount} for list_id, amount in amounts.items() if amount]
+    if params:
+        # 複数リスト分を1回の executemany で更新
+        executor.execute(
+            update(lists).where(lists.c.id == bindparam("list_id")).values({column: lists.c[column] + bindparam("amount")}),
+            params
+        )
+
+def _add_to_months(executor, column: str, amounts: Dict[tuple, int]) -> None:
+    """月次行の累計カラムに差分を加算"""
+    amounts = {key: amount for key, amount in amounts.items() if amount}
+    if not amounts:
+        return
+    _ensure_month_rows(executor, amounts)
+    months = MonthlyBudget.__table__
+    executor.execute(
+        update(months)
+        .where(months.c.user_id == bindparam("target_user_id"), months.c.month == bindparam("target_month"))
+        .values({column: months.c[column] + bindparam("amount"), "updated_at": datetime.datetime.utcnow()}),
+        [{"target_user_id": user_id, "target_month": month, "amount": amount} for (user_id, month), amount in amounts.items()]
+    )
+
+def add_planned(session, shopping_list_id: int, amount: int) -> None:
+    """リストの予定金額に差分を加算し、リストの日付の月にも計上する（コミットは呼び出し側）"""
+    add_planned_many(session, {shopping_list_id: amount})
+
+def add_planned_many(session, amounts: Dict[int, int]) -> None:
+    """複数リストの予定金額に差分をまとめて加算する（{リストID: 差分}）"""
+    amounts = {list_id: amount for list_id, amount in amounts.items() if amount}
+    if not amounts:
+        return
+    by_month = defaultdict(int)
+    for row in session.execute(
+        select(ShoppingList.id, ShoppingList.user_id, ShoppingList.date).where(ShoppingList.id.in_(amounts))
+    ):
+        by_month[(row.user_id, month_start(row.date))] += amounts[row.id]
+    _add_to_lists(session, 'planned_total', amounts)
+    _add_to_months(session, 'planned_total', by_month)
+
+def record_spending(session, records: Iterable[Dict[str, Any]]) -> None:
+    """
+    購入記録の金額をリストと購入月の支出に加算する（コミットは呼び出し側）
+
+    Args:
+        session: SQLAlchemyセッション
+        records: {"shopping_list_id", "user_id", "price", "quantity", "purchased_at"} のリスト
+    """
+    by_list = defaultdict(int)
+    by_month = defaultdict(int)
+    for r in records:
+        amount = to_yen(r["price"]) * (r.get("quantity") or 1)
+        by_list[r["shopping_list_id"]] += amount
+        by_month[(r["user_id"], month_start(r["purchased_at"] or datetime.date.today()))] += amount
+    _add_to_lists(session, 'spent_total', by_list)
+    _add_to_months(session, 'spent_total', by_month)
+
+def move_spending(session, user_id: int, amount: int, old_date, new_date) -> None:
+    """購入日の変更に合わせて支出を別の月へ移す"""
+    old_month, new_month = month_start(old_date), month_start(new_date)
+    if amount and old_month != new_month:
+        _add_to_months(session, 'spent_total', {(user_id, old_month): -amount, (user_id, new_month): amount})
+
+def move_list_date(session, shopping_list_id: int, new_date) -> None:
+    """リストの日付の変更に合わせて予定金額を別の月へ移す（日付の更新自体は呼び出し側）"""
+    row = session.execute(
+        select(ShoppingList.user_id, ShoppingList.date, ShoppingList.planned_total).where(ShoppingList.id == shopping_list_id)
+    ).first()
+    if row is None:
+        return
+    old_month, new_month = month_start(row.date), month_start(new_date)
+    amount = row.planned_total or 0
+    if amount and old_month != new_month:
+        _add_to_months(session, 'planned_total', {(row.user_id, old_month): -amount, (row.user_id, new_month): amount})
+
+def remove_list_items(session, list_items: List[ShoppingListItem]) -> None:
+    """削除するリストアイテム（と連鎖削除される購入）の金額を累計から差し引く"""
+    planned_by_list = defaultdict(int)
+    planned_by_month = defaultdict(int)
+    spent_by_list = defaultdict(int)
+    spent_by_month = defaultdict(int)
+    for list_item in list_items:
+        shopping_list = list_item.shopping_list
+        amount = planned_amount(list_item)
+        planned_by_list[shopping_list.id] -= amount
+        planned_by_month[(shopping_list.user_id, month_start(shopping_list.date))] -= amount
+        for purchase in list_item.purchases:
+            spent = purchase.actual_price * purchase.quantity
+            spent_by_list[shopping_list.id] -= spent
+            spent_by_month[(shopping_list.user_id, month_start(purchase.purchased_at))] -= spent
+    _add_to_lists(session, 'planned_total', planned_by_list)
+    _add_to_lists(session, 'spent_total', spent_by_list)
+    _add_to_months(session, 'planned_total', planned_by_month)
+    _add_to_months(session, 'spent_total', spent_by_month)
+
+def rebuild_budget_totals(executor, user_id: Optional[int] = None) -> None:
+    """
+    アイテムと購入履歴から累計を作り直す（機能追加前のDBの補完・不整合の修復用）
+
+    Args:
+        executor: SQLAlchemyのConnectionまたはSession
+        user_id (int, optional): 対象ユーザー（省略時は全ユーザー）
+    """
+    lists = ShoppingList.__table__
+    list_items = ShoppingListItem.__table__
+    purchases = Purchase.__table__
+    months = MonthlyBudget.__table__
+
+    planned = select(
+        func.coalesce(func.sum(func.coalesce(list_items.c.planned_price, 0) * list_items.c.quantity), 0)
+    ).where(list_items.c.shopping_list_id == lists.c.id).scalar_subquery()
+    spent = select(
+        func.coalesce(func.sum(purchases.c.actual_price * purchases.c.quantity), 0)
+    ).select_from(
+        purchases.join(list_items, purchases.c.shopping_list_item_id == list_items.c.id)
+    ).where(list_items.c.shopping_list_id == lists.c.id).scalar_subquery()
+
+    list_filter = [lists.c.user_id == user_id] if user_id is not None else []
+    executor.execute(update(lists).where(*list_filter).values(planned_total=planned, spent_total=spent))
+
+    month_filter = [months.c.user_id == user_id] if user_id is not None else []
+    executor.execute(update(months).where(*month_filter).values(planned_total=0, spent_total=0))
+
+    # 日単位で集計してから月にまとめる（月の切り出しはDBごとに関数が異なるため）
+    planned_by_month = defaultdict(int)
+    for row in executor.execute(
+        select(lists.c.user_id, lists.c.date, func.sum(lists.c.planned_total).label('amount'))
+        .where(*list_filter).group_by(lists.c.user_id, lists.c.date)
+    ):
+        planned_by_month[(row.user_id, month_start(row.date))] += int(row.amount or 0)
+
+    spent_by_month = defaultdict(int)
+    purchase_day = func.date(purchases.c.purchased_at)
+    for row in executor.execute(
+        select(lists.c.user_id, purchase_day.label('day'), func.sum(purchases.c.actual_price * purchases.c.quantity).label('amount'))
+        .select_from(
+            purchases
+            .join(list_items, purchases.c.shopping_list_item_id == list_items.c.id)
+            .join(lists, list_items.c.shopping_list_id == lists.c.id)
+        ).where(*list_filter).group_by(lists.c.user_id, purchase_day)
+    ):
+        spent_by_month[(row.user_id, month_start(row.day))] += int(row.amount or 0)
+
+    # アーカイブ済みのリストは保持している累計と支出サマリーから計上する
+    archived_lists = ArchivedShoppingList.__table__
+    summaries = ArchivedSpendingSummary.__table__
+    for row in executor.execute(
+        select(archived_lists.c.user_id, archived_lists.c.date, func.sum(archived_lists.c.planned_total).label('amount'))
+        .where(*([archived_lists.c.user_id == user_id] if user_id is not None else []))
+        .group_by(archived_lists.c.user_id, archived_lists.c.date)
+    ):
+        planned_by_month[(row.user_id, month_start(row.date))] += int(row.amount or 0)
+    for row in executor.execute(
+        select(summaries.c.user_id, summaries.c.day, func.sum(summaries.c.total).label('amount'))
+        .where(*([summaries.c.user_id == user_id] if user_id is not None else []))
+        .group_by(summaries.c.user_id, summaries.c.day)
+    ):
+        spent_by_month[(row.user_id, month_start(row.day))] += int(row.amount or 0)
+
+    _add_to_months(executor, 'planned_total', planned_by_month)
+    _add_to_months(executor, 'spent_total', spent_by_month)
+
+def budget_status(budget, planned_total, spent_total) -> Dict[str, Any]:
+    """予算と累計から残額・超過を計算"""
+    planned_total = int(planned_total or 0)
+    spent_total = int(spent_total or 0)
+    budget = int(budget) if budget is not None else None
+    return {
+        "budget": budget,
+        "planned_total": planned_total,
+        "spent_total": spent_total,
+        "remaining": budget - spent_total if budget is not None else None,
+        "over_budget": budget is not None and spent_total > budget,
+        "planned_over_budget": budget is not None and planned_total > budget,
+    }
+
+def get_list_budget_status(session, shopping_list_id: int) -> Optional[Dict[str, Any]]:
+    """リストの予算状況（1行の読み取り）"""
+    row = session.execute(
+        select(ShoppingList.budget, ShoppingList.planned_total, ShoppingList.spent_total)
+        .where(ShoppingList.id == shopping_list_id)
+    ).first()
+    if row is None:
+        return None
+    return budget_status(row.budget, row.planned_total, row.spent_total)
+
+def get_monthly_budget_status(session, user_id: int, month) -> Dict[str, Any]:
+    """月の予算状況（1行の読み取り。行がなければ予算なし・0円）"""
+    month = month_start(month)
+    row = session.execute(
+        select(MonthlyBudget.budget, MonthlyBudget.planned_total, MonthlyBudget.spent_total)
+        .where(MonthlyBudget.user_id == user_id, MonthlyBudget.month == month)
+    ).first()
+    status = budget_status(*row) if row else budget_status(None, 0, 0)
+    status["month"] = month
+    return status
+
+def set_list_budget(session, shopping_list_id: int, budget: Optional[float]) -> None:
+    """リストの予算を設定（None で解除）"""
+    session.execute(update(ShoppingList.__table__).where(ShoppingList.id == shopping_list_id).values(budget=budget))
+
+def set_monthly_budget(session, user_id: int, month, budget: Optional[float]) -> None:
+    """月の予算を設定（None で解除）"""
+    month = month_start(month)
+    _ensure_month_rows(session, [(user_id, month)])
+    months = MonthlyBudget.__table__
+    session.execute(
+        update(months)
+        .where(months.c.user_id == user_id, months.c.month == month)
+        .values(budget=budget, updated_at=datetime.datetime.utcnow())
+    )
@@ -0,0 +1,121 @@
+"""
+買い物モードの「チェック済みをまとめて購入」
+
+チェック済みで未購入のリストアイテム（リスト全体または1つの店舗）の購入を、1回の複数行INSERTで記録する。
+金額は1件ずつの購入記録と同じく、リスト上の予定金額 → 商品のデフォルト価格 → 過去のリストの直近の予定金額 の順に決め、
+直近の予定金額は対象の商品についてまとめて1回のクエリで取得する。
+"""
+import datetime
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select, insert
+from sqlalchemy.orm import joinedload
+
+from .models import Item, ShoppingList, ShoppingListItem, Purchase
+
+logger = logging.getLogger(__name__)
+
+def planned_unit_price(list_item: ShoppingListItem, latest_prices: Dict[int, int]) -> int:
+    """予定単価: リスト上の値(>0) → 商品デフォルト価格(>0) → 過去リストの直近予定価格（どれもなければ0）"""
+    if list_item.planned_price is not None and list_item.planned_price > 0:
+        return list_item.planned_price
+    if list_item.item and list_item.item.default_price is not None and list_item.item.default_price > 0:
+        return list_item.item.default_price
+    return latest_prices.get(list_item.item_id, 0) if list_item.item else 0
+
+def needs_latest_price(list_item: ShoppingListItem) -> bool:
+    """予定金額・商品のデフォルト価格がなく、直近の予定金額が必要か"""
+    return planned_unit_price(list_item, {}) == 0 and list_item.item is not None
+
+def latest_planned_prices(session, user_id: int, item_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    複数の商品について、そのユーザーのリストで直近に設定した予定金額（0円より大きいもの）を1回のクエリで取得
+
+    Returns:
+        dict: 商品ID → 予定金額（予定金額を設定したことがない商品は含まない）
+    """
+    item_ids = set(item_ids)
+    if not item_ids:
+        return {}
+    # 商品ごとに (item_id, created_at DESC) のインデックスを新しい順にたどり、最初に見つかった行だけを読む
+    latest = (
+        select(ShoppingListItem.planned_price)
+        .join(ShoppingList, ShoppingListItem.shopping_list_id == ShoppingList.id)
+        .where(ShoppingListItem.item_id == Item.id)
+        .where(ShoppingList.user_id == user_id)
+        .where(ShoppingListItem.planned_price > 0)
+        .order_by(ShoppingListItem.created_at.desc(), ShoppingListItem.id.desc())
+        .limit(1)
+        .correlate(Item)
+        .scalar_subquery()
+    )
+    rows = session.execute(select(Item.id, latest.label('planned_price')).where(Item.id.in_(item_ids)))
+    return {row.id: row.planned_price for row in rows if row.planned_price is not None}
+
+def pending_items(session, shopping_list_id: int, store_id: Optional[int] = None,
+                  store_only: bool = False) -> List[ShoppingListItem]:
+    """チェック済みで購入が未記録のリストアイテム（store_only なら store_id の店舗のみ。None は店舗未指定）"""
+    query = (
+        session.query(ShoppingListItem)
+        .options(
+            joinedload(ShoppingListItem.item),
+            joinedload(ShoppingListItem.store),
+            joinedload(ShoppingListItem.shopping_list),
+        )
+        .filter(ShoppingListItem.shopping_list_id == shopping_list_id)
+        .filter(ShoppingListItem.checked.is_(True))
+        .filter(~ShoppingListItem.purchases.any())
+    )
+    if store_only:
+        query = query.filter(ShoppingListItem.store_id.is_(None) if store_id is None else ShoppingListItem.store_id == store_id)
+    return query.order_by(ShoppingListItem.id).all()
+
+def checkout(session, shopping_list_id: int, store_id: Optional[int] = None,
+             store_only: bool = False) -> Dict[str, Any]:
+    """
+    チェック済みで未購入のアイテムの購入を予定単価・リストの数量でまとめて記録する（コミットは呼び出し側）
+
+    予定単価が決まらない（0円の）アイテムは記録せず、件数だけを返す（購入記録ボタンで金額を入力して記録する）。
+
+    Returns:
+        dict: {"records": 派生データ更新用の購入記録のリスト, "unpriced": 金額が決まらず記録しなかった件数}
+    """
+    items = pending_items(session, shopping_list_id, store_id, store_only)
+    if not items:
+        return {"records": [], "unpriced": 0}
+    user_id = items[0].shopping_list.user_id
+    latest_prices = latest_planned_prices(session, user_id, [item.item_id for item in items if needs_latest_price(item)])
+
+    priced = [(item, planned_unit_price(item, latest_prices)) for item in items]
+    unpriced = sum(1 for _, price in priced if not price)
+    priced = [(item, price) for item, price in priced if price]
+    if not priced:
+        return {"records": [], "unpriced": unpriced}
+
+    purchased_at = datetime.datetime.utcnow()
+    # 1回の複数行INSERTで追加する。RETURNING の行の順序は保証されないため、採番された購入IDはリストアイテムIDで対応付ける
+    purchase_ids = dict(session.execute(
+        insert(Purchase).returning(Purchase.shopping_list_item_id, Purchase.id),
+        [
+            {"shopping_list_item_id": item.id, "actual_price": price, "quantity": item.quantity or 1, "purchased_at": purchased_at}
+            for item, price in priced
+        ],
+    ).all())
+
+    records = [
+        {
+            "purchase_id": purchase_ids[item.id],
+            "user_id": user_id,
+            "shopping_list_id": shopping_list_id,
+            "item_id": item.item_id,
+            "store_id": item.store_id,
+            "store_name": item.store.name if item.store else None,
+            "price": price,
+            "quantity": item.quantity or 1,
+            "purchased_at": purchased_at,
+        }
+        for item, price in priced
+    ]
+    logger.info(f"{len(records)}件の購入をまとめて記録しました（リスト {shopping_list_id}）")
+    return {"records": records, "unpriced": unpriced}
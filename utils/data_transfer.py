@@ -0,0 +1,412 @@
+"""
+ユーザーデータのエクスポート・インポート
+
+ユーザーの店舗・カテゴリ・商品・買い物リスト・リストアイテム・購入履歴・月予算を、
+サーバーサイドカーソルで CHUNK_SIZE 行ずつ読み出し、テーブルごとのファイル
+（zstd圧縮のParquet または gzip圧縮のCSV）に書き出す。メモリに載るのは1チャンク分だけ。
+インポートは同じ形式のバンドルをチャンクごとに一括INSERTし、元のIDを新しいIDに
+置き換えて参照を張り直す。累計・価格統計・おすすめ統計は取り込み後にユーザー単位で作り直す。
+
+バンドルはディレクトリ（manifest.json とテーブルごとのファイル）か、それをまとめた .zip。
+"""
+import csv
+import datetime
+import gzip
+import json
+import logging
+import os
+import tempfile
+import zipfile
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from sqlalchemy import select, insert, or_, union, union_all, literal_column
+
+from .models import Store, Category, Item, ShoppingList, ShoppingListItem, Purchase, MonthlyBudget, normalize_store_name
+from .models import ArchivedShoppingList, ArchivedShoppingListItem, ArchivedPurchase
+from .money import to_yen
+from . import budgets
+from . import price_history
+from . import recommendations
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+# 1回に読み書きする行数
+CHUNK_SIZE = 5000
+
+# バンドルに含めるテーブルと列（型は "int" / "yen"（円単位の整数）/ "float" / "str" / "bool" / "date" / "datetime"）
+# 金額を小数で書き出していた以前のバンドルも、取り込み時に円単位に丸める
+# shared は user_id が NULL の共有データ（初期カテゴリ・商品など）かどうか
+TABLE_COLUMNS: Dict[str, List[Tuple[str, str]]] = {
+    "stores": [("id", "int"), ("name", "str"), ("category", "str"), ("shared", "bool")],
+    "categories": [("id", "int"), ("name", "str"), ("shared", "bool")],
+    "items": [("id", "int"), ("name", "str"), ("default_price", "yen"), ("category_id", "int"), ("shared", "bool")],
+    "shopping_lists": [("id", "int"), ("date", "date"), ("name", "str"), ("memo", "str"),
+                       ("budget", "yen"), ("created_at", "datetime")],
+    "shopping_list_items": [("id", "int"), ("shopping_list_id", "int"), ("item_id", "int"), ("store_id", "int"),
+                            ("planned_price", "yen"), ("checked", "bool"), ("quantity", "int"),
+                            ("created_at", "datetime"), ("planned_date", "date")],
+    "purchases": [("id", "int"), ("shopping_list_item_id", "int"), ("actual_price", "yen"),
+                  ("quantity", "int"), ("purchased_at", "datetime")],
+    "monthly_budgets": [("month", "date"), ("budget", "yen")],
+}
+
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+def _to_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value))
+
+# 列の型ごとの値の変換（DBの値・CSVの文字列のどちらからでも変換できる）
+_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    "int": int,
+    "yen": to_yen,
+    "float": float,
+    "str": str,
+    "bool": lambda value: value in (True, 1, "1", "True", "true"),
+    "date": _to_date,
+    "datetime": _to_datetime,
+}
+
+def _csv_value(value):
+    """CSVに書く値（NULLは空文字、日付はISO形式、真偽値は1/0）"""
+    if value is None:
+        return ""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+def _file_name(table: str, fmt: str) -> str:
+    return f"{table}.parquet" if fmt == "parquet" else f"{table}.csv.gz"
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+    types = {"int": pa.int64(), "yen": pa.int64(), "float": pa.float64(), "str": pa.string(), "bool": pa.bool_(),
+             "date": pa.date32(), "datetime": pa.timestamp("us")}
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+def _convert(rows, columns) -> List[List[Any]]:
+    """行の値を列の型に揃える（NULLはそのまま）"""
+    converters = [_CONVERTERS[kind] for _, kind in columns]
+    return [[None if value is None else convert(value) for value, convert in zip(row, converters)] for row in rows]
+
+def _write_table(directory: str, table: str, chunks: Iterator[List[Any]], fmt: str) -> int:
+    """チャンク（行のリスト）を順に1ファイルへ書き出し、行数を返す"""
+    columns = TABLE_COLUMNS[table]
+    path = os.path.join(directory, _file_name(table, fmt))
+    count = 0
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = _arrow_schema(columns)
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            for chunk in chunks:
+                rows = _convert(chunk, columns)
+                arrays = [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                count += len(rows)
+    else:
+        with gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow([name for name, _ in columns])
+            for chunk in chunks:
+                rows = _convert(chunk, columns)
+                writer.writerows([_csv_value(value) for value in row] for row in rows)
+                count += len(rows)
+    return count
+
+def _read_table(directory: str, table: str, fmt: str, chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    """バンドルのファイルを chunk_size 行ずつ辞書のリストとして読み出す"""
+    columns = TABLE_COLUMNS[table]
+    path = os.path.join(directory, _file_name(table, fmt))
+    if not os.path.exists(path):
+        return
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        if parquet_file.num_row_groups == 0:  # 行のないテーブル
+            return
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+    else:
+        with gzip.open(path, "rt", newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            while True:
+                chunk = list(islice(reader, chunk_size))
+                if not chunk:
+                    break
+                rows = _convert([[row.get(name) or None for name, _ in columns] for row in chunk], columns)
+                yield [dict(zip([name for name, _ in columns], row)) for row in rows]
+
+def _stream(conn, query, chunk_size: int) -> Iterator[List[Any]]:
+    """サーバーサイドカーソルで chunk_size 行ずつ取得"""
+    result = conn.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+    for partition in result.partitions():
+        yield partition
+
+def _export_queries(user_id: int) -> Dict[str, Any]:
+    """テーブルごとのエクスポート用クエリ（ユーザーのデータと、それが参照する共有データ。アーカイブ済みのリストも含める）"""
+    user_list_ids = select(ShoppingList.id).where(ShoppingList.user_id == user_id)
+    user_lines = ShoppingListItem.shopping_list_id.in_(user_list_ids)
+    archived_list_ids = select(ArchivedShoppingList.id).where(ArchivedShoppingList.user_id == user_id)
+    archived_lines = ArchivedShoppingListItem.shopping_list_id.in_(archived_list_ids)
+    used_item_ids = union(select(ShoppingListItem.item_id).where(user_lines),
+                          select(ArchivedShoppingListItem.item_id).where(archived_lines))
+    used_store_ids = union(select(ShoppingListItem.store_id).where(user_lines),
+                           select(ArchivedShoppingListItem.store_id).where(archived_lines))
+    item_filter = or_(Item.user_id == user_id, Item.id.in_(used_item_ids))
+    used_category_ids = select(Item.category_id).where(item_filter)
+
+    def with_archive(table: str, hot, archived, hot_filter, archived_filter):
+        # 元のIDのまま移しているので、ID順に並べればホットとアーカイブの行は混ざっても一意
+        columns = [name for name, _ in TABLE_COLUMNS[table]]
+        return union_all(
+            select(*(hot.__table__.c[name] for name in columns)).where(hot_filter),
+            select(*(archived.__table__.c[name] for name in columns)).where(archived_filter),
+        ).order_by(literal_column("id"))
+
+    return {
+        "stores": select(Store.id, Store.name, Store.category, Store.user_id.is_(None))
+            .where(or_(Store.user_id == user_id, Store.id.in_(used_store_ids))).order_by(Store.id),
+        "categories": select(Category.id, Category.name, Category.user_id.is_(None))
+            .where(or_(Category.user_id == user_id, Category.id.in_(used_category_ids))).order_by(Category.id),
+        "items": select(Item.id, Item.name, Item.default_price, Item.category_id, Item.user_id.is_(None))
+            .where(item_filter).order_by(Item.id),
+        "shopping_lists": with_archive("shopping_lists", ShoppingList, ArchivedShoppingList,
+                                       ShoppingList.user_id == user_id, ArchivedShoppingList.user_id == user_id),
+        "shopping_list_items": with_archive("shopping_list_items", ShoppingListItem, ArchivedShoppingListItem,
+                                            user_lines, archived_lines),
+        "purchases": with_archive(
+            "purchases", Purchase, ArchivedPurchase,
+            Purchase.shopping_list_item_id.in_(select(ShoppingListItem.id).where(user_lines)),
+            ArchivedPurchase.shopping_list_item_id.in_(select(ArchivedShoppingListItem.id).where(archived_lines))),
+        "monthly_budgets": select(MonthlyBudget.month, MonthlyBudget.budget)
+            .where(MonthlyBudget.user_id == user_id, MonthlyBudget.budget.isnot(None)).order_by(MonthlyBudget.month),
+    }
+
+def export_user_data(conn, user_id: int, path: str, fmt: str = "parquet", chunk_size: int = CHUNK_SIZE) -> Dict[str, int]:
+    """
+    ユーザーのデータをバンドルに書き出す
+
+    Args:
+        conn: SQLAlchemyのConnection
+        user_id (int): ユーザーID
+        path (str): 出力先ディレクトリ（".zip" で終わる場合はzipファイル）
+        fmt (str): 'parquet' または 'csv'（gzip圧縮）
+        chunk_size (int): 1回に読み書きする行数
+
+    Returns:
+        dict: テーブル名 → 書き出した行数
+    """
+    if fmt not in ("parquet", "csv"):
+        raise ValueError(f"未対応の形式です: {fmt}")
+    if path.endswith(".zip"):
+        with tempfile.TemporaryDirectory() as directory:
+            counts = export_user_data(conn, user_id, directory, fmt, chunk_size)
+            # Parquet・gzipは圧縮済みなのでzipでは圧縮しない
+            with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as archive:
+                for name in sorted(os.listdir(directory)):
+                    archive.write(os.path.join(directory, name), name)
+        return counts
+
+    os.makedirs(path, exist_ok=True)
+    counts = {
+        table: _write_table(path, table, _stream(conn, query, chunk_size), fmt)
+        for table, query in _export_queries(user_id).items()
+    }
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "format": fmt,
+        "exported_at": datetime.datetime.utcnow().isoformat(),
+        "counts": counts,
+    }
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    logger.info(f"ユーザー{user_id}のデータを書き出しました: {counts}")
+    return counts
+
+def _insert_returning_ids(conn, table, rows: List[Dict[str, Any]]) -> List[int]:
+    """複数行を一括INSERTし、行の順に新しいIDを返す"""
+    if not rows:
+        return []
+    result = conn.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows)
+    return list(result.scalars())
+
+def _import_stores(conn, user_id: int, chunks, now) -> Dict[int, int]:
+    """店舗を取り込む（正規化名が同じ既存の店舗があればそれを使う）"""
+    stores = Store.__table__
+    shared = {}
+    owned = {}
+    for row in conn.execute(select(stores.c.id, stores.c.normalized_name, stores.c.user_id)
+                            .where(or_(stores.c.user_id == user_id, stores.c.user_id.is_(None)))):
+        (owned if row.user_id == user_id else shared)[row.normalized_name] = row.id
+
+    id_map = {}
+    for chunk in chunks:
+        pending = []
+        for row in chunk:
+            normalized = normalize_store_name(row["name"])
+            existing = (row["shared"] and shared.get(normalized)) or owned.get(normalized)
+            if existing:
+                id_map[row["id"]] = existing
+            else:
+                pending.append((row, normalized))
+        new_rows = {}
+        for row, normalized in pending:
+            new_rows.setdefault(normalized, {"name": row["name"], "normalized_name": normalized,
+                                             "category": row["category"], "user_id": user_id, "created_at": now})
+        for normalized, new_id in zip(new_rows, _insert_returning_ids(conn, stores, list(new_rows.values()))):
+            owned[normalized] = new_id
+        for row, normalized in pending:
+            id_map[row["id"]] = owned[normalized]
+    return id_map
+
+def _import_categories(conn, user_id: int, chunks, now) -> Dict[int, int]:
+    """カテゴリを取り込む（名前が同じ既存のカテゴリがあればそれを使う）"""
+    categories = Category.__table__
+    shared = {}
+    owned = {}
+    for row in conn.execute(select(categories.c.id, categories.c.name, categories.c.user_id)
+                            .where(or_(categories.c.user_id == user_id, categories.c.user_id.is_(None)))
+                            .order_by(categories.c.id)):
+        (owned if row.user_id == user_id else shared).setdefault(row.name, row.id)
+
+    id_map = {}
+    for chunk in chunks:
+        pending = []
+        for row in chunk:
+            existing = (row["shared"] and shared.get(row["name"])) or owned.get(row["name"])
+            if existing:
+                id_map[row["id"]] = existing
+            else:
+                pending.append(row)
+        new_rows = [{"name": name, "user_id": user_id, "created_at": now} for name in dict.fromkeys(r["name"] for r in pending)]
+        for new_row, new_id in zip(new_rows, _insert_returning_ids(conn, categories, new_rows)):
+            owned[new_row["name"]] = new_id
+        for row in pending:
+            id_map[row["id"]] = owned[row["name"]]
+    return id_map
+
+def _import_items(conn, user_id: int, chunks, category_map: Dict[int, int], now) -> Dict[int, int]:
+    """商品を取り込む（名前とカテゴリが同じ既存の商品があればそれを使う）"""
+    items = Item.__table__
+    shared = {}
+    owned = {}
+    for row in conn.execute(select(items.c.id, items.c.name, items.c.category_id, items.c.user_id)
+                            .where(or_(items.c.user_id == user_id, items.c.user_id.is_(None)))
+                            .order_by(items.c.id)):
+        (owned if row.user_id == user_id else shared).setdefault((row.name, row.category_id), row.id)
+
+    id_map = {}
+    for chunk in chunks:
+        pending = []
+        for row in chunk:
+            key = (row["name"], category_map.get(row["category_id"]))
+            existing = (row["shared"] and shared.get(key)) or owned.get(key)
+            if existing:
+                id_map[row["id"]] = existing
+            else:
+                pending.append((row, key))
+        new_rows = {}
+        for row, key in pending:
+            new_rows.setdefault(key, {"name": key[0], "category_id": key[1], "default_price": row["default_price"],
+                                      "user_id": user_id, "created_at": now})
+        for key, new_id in zip(new_rows, _insert_returning_ids(conn, items, list(new_rows.values()))):
+            owned[key] = new_id
+        for row, key in pending:
+            id_map[row["id"]] = owned[key]
+    return id_map
+
+def import_user_data(conn, user_id: int, path: str, chunk_size: int = CHUNK_SIZE) -> Dict[str, int]:
+    """
+    バンドルのデータをユーザーのデータとして取り込む（コミットは呼び出し側）
+
+    IDはすべて新しく採番し、リストアイテム・購入履歴の参照を対応付け直す。
+    店舗・カテゴリ・商品は既存の同名のものがあればそれを使う。
+
+    Args:
+        conn: SQLAlchemyのConnection（1トランザクションで取り込む）
+        user_id (int): 取り込み先のユーザーID
+        path (str): バンドルのディレクトリまたはzipファイル
+        chunk_size (int): 1回に読み書きする行数
+
+    Returns:
+        dict: テーブル名 → 取り込んだ行数
+    """
+    if zipfile.is_zipfile(path):
+        with tempfile.TemporaryDirectory() as directory:
+            with zipfile.ZipFile(path) as archive:
+                archive.extractall(directory)
+            return import_user_data(conn, user_id, directory, chunk_size)
+
+    with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"未対応のバンドル形式です: {manifest.get('format_version')}")
+    fmt = manifest["format"]
+
+    def read(table):
+        return _read_table(path, table, fmt, chunk_size)
+
+    now = datetime.datetime.utcnow()
+    store_map = _import_stores(conn, user_id, read("stores"), now)
+    category_map = _import_categories(conn, user_id, read("categories"), now)
+    item_map = _import_items(conn, user_id, read("items"), category_map, now)
+    counts = {"stores": len(store_map), "categories": len(category_map), "items": len(item_map)}
+
+    list_map = {}
+    for chunk in read("shopping_lists"):
+        rows = [{"user_id": user_id, "date": r["date"], "name": r["name"], "memo": r["memo"], "budget": r["budget"],
+                 "created_at": r["created_at"] or now, "planned_total": 0, "spent_total": 0} for r in chunk]
+        list_map.update(zip((r["id"] for r in chunk), _insert_returning_ids(conn, ShoppingList.__table__, rows)))
+    counts["shopping_lists"] = len(list_map)
+
+    line_map = {}
+    for chunk in read("shopping_list_items"):
+        chunk = [r for r in chunk if r["shopping_list_id"] in list_map]
+        rows = [{
+            "shopping_list_id": list_map[r["shopping_list_id"]],
+            "item_id": item_map.get(r["item_id"]),
+            "store_id": store_map.get(r["store_id"]),
+            "planned_price": r["planned_price"],
+            "checked": bool(r["checked"]),
+            "quantity": r["quantity"],
+            "created_at": r["created_at"] or now,
+            "planned_date": r["planned_date"],
+        } for r in chunk]
+        line_map.update(zip((r["id"] for r in chunk), _insert_returning_ids(conn, ShoppingListItem.__table__, rows)))
+    counts["shopping_list_items"] = len(line_map)
+
+    counts["purchases"] = 0
+    for chunk in read("purchases"):
+        rows = [{
+            "shopping_list_item_id": line_map[r["shopping_list_item_id"]],
+            "actual_price": r["actual_price"],
+            "quantity": r["quantity"],
+            "purchased_at": r["purchased_at"] or now,
+        } for r in chunk if r["shopping_list_item_id"] in line_map]
+        if rows:
+            conn.execute(insert(Purchase.__table__), rows)
+        counts["purchases"] += len(rows)
+
+    counts["monthly_budgets"] = 0
+    for chunk in read("monthly_budgets"):
+        for r in chunk:
+            budgets.set_monthly_budget(conn, user_id, r["month"], r["budget"])
+        counts["monthly_budgets"] += len(chunk)
+
+    # 累計・価格統計・おすすめ統計を取り込んだデータから作り直す
+    budgets.rebuild_budget_totals(conn, user_id)
+    price_history.backfill_price_observations(conn, user_id)
+    recommendations.rebuild_recommendation_stats(conn, user_id)
+    logger.info(f"ユーザー{user_id}にデータを取り込みました: {counts}")
+    return counts
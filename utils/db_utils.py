@@ -1,13 +1,24 @@
 import os
-import psycopg2
+import sys
+import threading
+import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker, scoped_session
-import bcrypt
+from sqlalchemy import create_engine, event, text, DateTime, Integer, inspect, select, delete, update, func, case, and_, exists
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import sessionmaker, scoped_session, aliased, selectinload
 import streamlit as st
-from .models import Base, User, Store, Category, Item, ShoppingList, ShoppingListItem, Purchase
+from cachetools import TTLCache
+from .models import Base, User, Store, Category, Item, ShoppingList, ShoppingListItem, Purchase, normalize_store_name
+from .models import PriceObservation, ItemPriceStat, SchemaVersion, ArchivedShoppingListItem
+from .money import Yen, to_yen, yen_total
+from . import price_history
+from . import archive
+from . import budgets
+from . import recommendations
+from . import checkout
+from . import pool_monitor
+import contextlib
 import datetime
-import jwt
 from typing import Optional, List, Dict, Any, Union
 import logging
 
@@ -20,102 +31,360 @@ load_dotenv()
 
 def get_connection():
     """psycopg2でPostgreSQLへの生接続を取得"""
+    import psycopg2
     return psycopg2.connect(os.environ["DATABASE_URL"])
 
 # データベース接続情報
 DB_URL = os.getenv("DATABASE_URL", "sqlite:///shopping_app.db")
+# 分析・履歴の読み取りに使うリードレプリカ（未設定なら主DBから読む）
+DB_READ_URL = os.getenv("DATABASE_READ_URL")
+# 書き込んだユーザーの読み取りを主DBに向ける秒数（レプリカの遅延より長くする）
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "10"))
+# SQLiteの性能設定（SQLITE_TUNING=0 で無効にしてロールバックジャーナルの既定動作に戻す）
+SQLITE_TUNING = os.getenv("SQLITE_TUNING", "1") != "0"
+# ロック待ちの上限（ミリ秒）。これを超えると "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# 接続ごとに設定するPRAGMA
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",        # 書き込み中も読み取りをブロックしない
+    "synchronous": "NORMAL",      # WALではコミットごとのfsyncを省いても破損しない（電源断時は直近のコミットのみ失われうる）
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    "cache_size": -64000,         # ページキャッシュ 64MB（負の値はKB単位）
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+# 支出分析の結果キャッシュの件数と有効期限（他のワーカーでの書き込みは検知できないため期限で補う）
+ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", "512"))
+ANALYTICS_CACHE_TTL_SECONDS = float(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", "300"))
+# 接続プールから接続を取得するまで待つ秒数（超えると PoolExhaustedError）
+POOL_TIMEOUT_SECONDS = float(os.getenv("POOL_TIMEOUT_SECONDS", "30"))
+# この秒数SQLを実行せずにトランザクションを開いたままのセッションをロールバックして接続を返す（0で無効）
+POOL_IDLE_TRANSACTION_SECONDS = float(os.getenv("POOL_IDLE_TRANSACTION_SECONDS", "300"))
 JWT_SECRET = os.getenv("JWT_SECRET", "shopping_app_development_secret_key_2025")  # .envから読み込む
 ENV = os.getenv("ENV", "development")
 
-# SQLAlchemy エンジンとセッション
+# SQLAlchemy エンジンとセッション（初回利用時に get_engine() で一度だけ作成）
 engine = None
 SessionLocal = None
+_db_ready = False  # init_db（テーブル作成・マイグレーション）が完了したか
+_init_lock = threading.Lock()
+# リードレプリカのエンジンとセッション（DATABASE_READ_URL 設定時のみ）
+read_engine = None
+ReadSessionLocal = None
+# ユーザーID → 最後に書き込んだ時刻（time.monotonic）
+_recent_writes: Dict[int, float] = {}
+_recent_writes_lock = threading.Lock()
+# 支出分析の結果キャッシュ（キーにユーザーの購入バージョンを含め、書き込み後の古い結果は使われずに追い出される）
+_analytics_cache = TTLCache(maxsize=ANALYTICS_CACHE_SIZE, ttl=ANALYTICS_CACHE_TTL_SECONDS)
+_analytics_cache_lock = threading.Lock()
+# ユーザーID → 購入バージョン（None は全ユーザー共通の世代）
+_purchase_versions: Dict[Optional[int], int] = {}
+
+# スキーマのバージョン。テーブル・カラム・インデックスの追加やデータ移行を加えたら上げる
+SCHEMA_VERSION = 6
+# 店舗名の一意インデックス（作成前に重複店舗の統合が必要）
+STORE_UNIQUE_INDEXES = ('uq_stores_user_normalized_name', 'uq_stores_shared_normalized_name')
+# マイグレーションを1プロセスだけで実行するためのPostgreSQLアドバイザリロックのキー
+MIGRATION_LOCK_KEY = 0x53484F50
+
+def _resolve_db_url(url: str) -> str:
+    """SQLiteの相対パスを絶対パスに変換（PostgreSQLはそのまま）"""
+    if url.startswith('sqlite:///'):
+        db_path = url.replace('sqlite:///', '')
+        if not os.path.isabs(db_path):
+            # 相対パスの場合は現在の作業ディレクトリからの絶対パスに変換
+            abs_db_path = os.path.join(os.getcwd(), db_path)
+            # ディレクトリが存在しない場合は作成
+            os.makedirs(os.path.dirname(abs_db_path), exist_ok=True)
+            return f"sqlite:///{abs_db_path}"
+    return url
+
+def _create_engine(final_db_url: str, **kwargs):
+    """接続先に応じた設定でエンジンを作成"""
+    # PostgreSQLエンジン設定
+    if final_db_url.startswith('postgresql://'):
+        logger.info("PostgreSQL接続を使用します")
+        return create_engine(
+            final_db_url, 
+            poolclass=pool_monitor.MonitoredQueuePool,
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            pool_size=10,
+            max_overflow=20,
+            pool_timeout=POOL_TIMEOUT_SECONDS,
+            echo=False,  # デバッグ時はTrueに
+            **kwargs
+        )
+    # SQLiteエンジン設定
+    logger.info("SQLite接続を使用します")
+    if not SQLITE_TUNING:
+        return create_engine(
+            final_db_url, 
+            pool_pre_ping=True,
+            pool_recycle=3600,
+            echo=False,  # デバッグ時はTrueに
+            **kwargs
+        )
+    sqlite_engine = create_engine(
+        final_db_url,
+        # 接続ごとにPRAGMAとページキャッシュを持つため、接続を使い回すプールにする
+        poolclass=pool_monitor.MonitoredQueuePool,
+        pool_size=10,
+        max_overflow=20,
+        pool_timeout=POOL_TIMEOUT_SECONDS,
+        pool_pre_ping=True,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        echo=False,  # デバッグ時はTrueに
+        **kwargs
+    )
+    event.listen(sqlite_engine, "connect", _apply_sqlite_pragmas)
+    return sqlite_engine
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """SQLiteの接続時に性能設定のPRAGMAを適用"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
 
 def init_db():
     """データベース接続を初期化する"""
-    global engine, SessionLocal
+    global engine, SessionLocal, _db_ready, read_engine, ReadSessionLocal
     
     try:
-        # SQLiteの場合は相対パスを絶対パスに変換
-        if DB_URL.startswith('sqlite:///'):
-            db_path = DB_URL.replace('sqlite:///', '')
-            if not os.path.isabs(db_path):
-                # 相対パスの場合は現在の作業ディレクトリからの絶対パスに変換
-                abs_db_path = os.path.join(os.getcwd(), db_path)
-                # ディレクトリが存在しない場合は作成
-                os.makedirs(os.path.dirname(abs_db_path), exist_ok=True)
-                final_db_url = f"sqlite:///{abs_db_path}"
-            else:
-                final_db_url = DB_URL
-        else:
-            # PostgreSQLの場合
-            final_db_url = DB_URL
-            
+        final_db_url = _resolve_db_url(DB_URL)
         logger.info(f"データベース接続URL: {final_db_url} [環境: {ENV}]")
-        
-        # PostgreSQLエンジン設定
-        if final_db_url.startswith('postgresql://'):
-            engine = create_engine(
-                final_db_url, 
-                pool_pre_ping=True,
-                pool_recycle=3600,
-                pool_size=10,
-                max_overflow=20,
-                echo=False  # デバッグ時はTrueに
-            )
-            logger.info("PostgreSQL接続を使用します")
-        else:
-            # SQLiteエンジン設定
-            engine = create_engine(
-                final_db_url, 
-                pool_pre_ping=True,
-                pool_recycle=3600,
-                echo=False  # デバッグ時はTrueに
-            )
-            logger.info("SQLite接続を使用します")
+        engine = _create_engine(final_db_url)
+        pool_monitor.attach(engine, "primary")
         
         # セッションファクトリを作成
         SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
         
-        # テーブル作成（存在しない場合）
-        Base.metadata.create_all(bind=engine)
-        logger.info("データベース接続を初期化しました")
-        
-        # PostgreSQL環境の場合、planned_dateカラムが存在しない場合は追加
-        if final_db_url.startswith('postgresql://'):
-            from sqlalchemy import inspect
-            inspector = inspect(engine)
-            columns = [col['name'] for col in inspector.get_columns('shopping_list_items')]
-            if 'planned_date' not in columns:
-                with engine.connect() as conn:
-                    conn.execute(text("ALTER TABLE shopping_list_items ADD COLUMN planned_date DATE;"))
-                logger.info("shopping_list_itemsテーブルにplanned_dateカラムを追加しました")
+        # スキーマが最新ならバージョン行の読み取り1回で完了（DDL・カタログ参照なし）
+        stored_version = _get_schema_version()
+        if stored_version != SCHEMA_VERSION:
+            with _migration_lock(final_db_url):
+                # ロック待ちの間に他のプロセスが更新していれば何もしない
+                stored_version = _get_schema_version()
+                if stored_version is None or stored_version < SCHEMA_VERSION:
+                    _migrate_schema(final_db_url)
+                elif stored_version > SCHEMA_VERSION:
+                    logger.warning(f"DBのスキーマ（v{stored_version}）がアプリ（v{SCHEMA_VERSION}）より新しいため、マイグレーションを行いません")
         
-        # Railway PostgreSQL使用時のテスト接続
-        if final_db_url.startswith('postgresql://'):
-            try:
-                # 単純なクエリでテスト
-                with engine.connect() as connection:
-                    result = connection.execute(text("SELECT 1"))
-                    logger.info(f"Railway PostgreSQL接続テスト成功: {result.fetchone()[0]}")
-            except Exception as e:
-                logger.error(f"Railway接続テストエラー: {e}")
+        # リードレプリカ（スキーマは主DBからの複製に任せ、マイグレーションは行わない）
+        # 読み取りだけなので自動コミットにし、レプリケーションを妨げる待機中のトランザクションを残さない
+        if DB_READ_URL:
+            read_engine = _create_engine(_resolve_db_url(DB_READ_URL), isolation_level="AUTOCOMMIT")
+            pool_monitor.attach(read_engine, "replica")
+            ReadSessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=read_engine))
+            logger.info("分析・履歴の読み取りにリードレプリカを使用します")
+        else:
+            read_engine = None
+            ReadSessionLocal = None
+        logger.info("データベース接続を初期化しました")
         
+        # 接続先が変わった場合に前のDBの集計結果を返さない
+        with _analytics_cache_lock:
+            _analytics_cache.clear()
+        pool_monitor.start_reaper(_pool_monitors, POOL_IDLE_TRANSACTION_SECONDS)
+        _db_ready = True
         return True
     except Exception as e:
         logger.error(f"データベース接続エラー: {e}")
         return False
 
+def _get_schema_version() -> Optional[int]:
+    """DBに記録されたスキーマのバージョン（テーブルがない・未記録の場合は None）"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1)).scalar()
+    except SQLAlchemyError:
+        return None
+
+@contextlib.contextmanager
+def _migration_lock(final_db_url: str):
+    """マイグレーション中に他のプロセス（ワーカー）が同時にDDLを実行しないようにするロック"""
+    if final_db_url.startswith('postgresql://'):
+        # セッション単位のアドバイザリロック（接続を閉じれば自動で解放される）
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+                conn.commit()
+        return
+    
+    # SQLiteはDBファイルの隣のロックファイルで排他（fcntlがない環境ではロックしない）
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    lock_path = final_db_url.replace('sqlite:///', '') + '.migrate.lock'
+    with open(lock_path, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _migrate_schema(final_db_url: str):
+    """テーブル作成と既存DBのマイグレーションを行い、スキーマのバージョンを記録する"""
+    # テーブル作成（存在しない場合）
+    existing_tables = set(inspect(engine).get_table_names())
+    Base.metadata.create_all(bind=engine)
+    
+    # 価格観測テーブルを新設した場合は既存の購入履歴から取り込む
+    if 'price_observations' not in existing_tables:
+        with engine.begin() as conn:
+            price_history.backfill_price_observations(conn)
+    
+    # 店舗名の正規化カラムと一意インデックスを整備
+    _migrate_store_normalized_names()
+    # 予算の累計カラムを追加・補完
+    _migrate_budget_totals(existing_tables)
+    # おすすめ用の利用統計テーブルを新設した場合は既存のリストから作成
+    if 'item_usage_stats' not in existing_tables:
+        with engine.begin() as conn:
+            recommendations.rebuild_recommendation_stats(conn)
+    # 購入の取り込み用の重複防止カラムを追加
+    _migrate_purchase_import_hash()
+    # 金額を円単位の整数に変換
+    _migrate_money_to_yen(final_db_url)
+    # 既存テーブルに後から追加したインデックスを作成
+    _ensure_indexes()
+    
+    # PostgreSQL環境の場合、planned_dateカラムが存在しない場合は追加
+    if final_db_url.startswith('postgresql://'):
+        inspector = inspect(engine)
+        columns = [col['name'] for col in inspector.get_columns('shopping_list_items')]
+        if 'planned_date' not in columns:
+            with engine.begin() as conn:
+                conn.execute(text("ALTER TABLE shopping_list_items ADD COLUMN planned_date DATE;"))
+            logger.info("shopping_list_itemsテーブルにplanned_dateカラムを追加しました")
+    
+    with engine.begin() as conn:
+        updated = conn.execute(
+            update(SchemaVersion.__table__).where(SchemaVersion.id == 1)
+            .values(version=SCHEMA_VERSION, updated_at=datetime.datetime.utcnow())
+        ).rowcount
+        if not updated:
+            conn.execute(SchemaVersion.__table__.insert().values(id=1, version=SCHEMA_VERSION))
+    logger.info(f"スキーマをv{SCHEMA_VERSION}に更新しました")
+
+def get_engine():
+    """エンジンを取得（未初期化なら初期化。複数スレッドから呼ばれても初期化は一度だけ）"""
+    if not _db_ready:
+        with _init_lock:
+            if not _db_ready:
+                init_db()
+    return engine
+
+def get_session_factory():
+    """セッションファクトリ（scoped_session）を取得"""
+    get_engine()
+    return SessionLocal
+
+def _migrate_store_normalized_names():
+    """既存DBのstoresにnormalized_nameを追加・補完し、重複を統合してから一意インデックスを作成"""
+    inspector = inspect(engine)
+    columns = [col['name'] for col in inspector.get_columns('stores')]
+    index_names = [ix['name'] for ix in inspector.get_indexes('stores')]
+    
+    with engine.begin() as conn:
+        if 'normalized_name' not in columns:
+            conn.execute(text("ALTER TABLE stores ADD COLUMN normalized_name VARCHAR"))
+            logger.info("storesテーブルにnormalized_nameカラムを追加しました")
+        
+        # 正規化はPython側（NFKC）で行うため、未設定の行だけまとめて更新
+        rows = conn.execute(text("SELECT id, name FROM stores WHERE normalized_name IS NULL")).all()
+        if rows:
+            conn.execute(
+                text("UPDATE stores SET normalized_name = :normalized_name WHERE id = :id"),
+                [{"id": row.id, "normalized_name": normalize_store_name(row.name)} for row in rows]
+            )
+        
+        missing = [name for name in STORE_UNIQUE_INDEXES if name not in index_names]
+        if missing:
+            # 一意インデックス作成前に既存の重複（共有店舗同士を含む）を統合しておく
+            merged = _merge_duplicate_stores(conn)
+            if merged:
+                logger.info(f"重複店舗を{sum(len(v['deleted_ids']) for v in merged.values())}件統合しました")
+            for index in Store.__table__.indexes:
+                if index.name in missing:
+                    index.create(bind=conn)
+            logger.info(f"storesテーブルに一意インデックスを作成しました: {', '.join(missing)}")
+
+def _migrate_budget_totals(existing_tables):
+    """既存DBのshopping_listsに予算・累計カラムを追加し、累計を既存データから作成"""
+    columns = [col['name'] for col in inspect(engine).get_columns('shopping_lists')]
+    added = False
+    with engine.begin() as conn:
+        if 'budget' not in columns:
+            conn.execute(text("ALTER TABLE shopping_lists ADD COLUMN budget BIGINT"))
+            added = True
+        for column in ('planned_total', 'spent_total'):
+            if column not in columns:
+                conn.execute(text(f"ALTER TABLE shopping_lists ADD COLUMN {column} BIGINT NOT NULL DEFAULT 0"))
+                added = True
+        if added:
+            logger.info("shopping_listsテーブルに予算カラムを追加しました")
+        if added or 'monthly_budgets' not in existing_tables:
+            budgets.rebuild_budget_totals(conn)
+
+def _migrate_purchase_import_hash():
+    """既存DBのpurchasesにimport_hashカラムを追加（一意インデックスは _ensure_indexes で作成）"""
+    columns = [col['name'] for col in inspect(engine).get_columns('purchases')]
+    if 'import_hash' not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE purchases ADD COLUMN import_hash VARCHAR"))
+        logger.info("purchasesテーブルにimport_hashカラムを追加しました")
+
+def _migrate_money_to_yen(final_db_url: str):
+    """既存DBの金額カラム（NUMERIC）の値を円単位の整数に変換"""
+    money_columns = [
+        (table.name, column.name)
+        for table in Base.metadata.sorted_tables for column in table.columns if isinstance(column.type, Yen)
+    ]
+    converted = 0
+    with engine.begin() as conn:
+        if final_db_url.startswith('postgresql://'):
+            inspector = inspect(conn)
+            for table, column in money_columns:
+                types = {col['name']: col['type'] for col in inspector.get_columns(table)}
+                if column in types and not isinstance(types[column], Integer):
+                    conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT USING ROUND({column})"))
+                    converted += 1
+        else:
+            # SQLiteは列の型宣言を変えられないため、小数で入っている値だけ整数に丸めて入れ直す
+            # （NUMERIC型の列でも整数値は整数のまま格納され、SUMも整数で返る）
+            for table, column in money_columns:
+                converted += conn.execute(text(
+                    f"UPDATE {table} SET {column} = CAST(ROUND({column}) AS INTEGER) WHERE typeof({column}) = 'real'"
+                )).rowcount
+    if converted:
+        logger.info("金額カラムを円単位の整数に変換しました")
+
+def _ensure_indexes():
+    """モデルに定義されたインデックスのうち、既存テーブルに未作成のものを作成"""
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in STORE_UNIQUE_INDEXES:
+                    # 重複統合が必要なため _migrate_store_normalized_names で作成する
+                    continue
+                index.create(bind=conn, checkfirst=True)
+
 def get_db_health_check() -> Dict[str, Any]:
     """データベース接続の健全性確認"""
     is_pg = DB_URL.startswith('postgresql://')
     db_type = "PostgreSQL" if is_pg else "SQLite"
     
     try:
-        if engine is None:
-            init_db()
-            
-        with engine.connect() as connection:
+        with get_engine().connect() as connection:
             start_time = datetime.datetime.now()
             result = connection.execute(text("SELECT 1"))
             end_time = datetime.datetime.now()
@@ -135,19 +404,83 @@ def get_db_health_check() -> Dict[str, Any]:
             "environment": ENV
         }
 
+def _pool_monitors() -> List[pool_monitor.PoolMonitor]:
+    """監視中の接続プール（主DB・リードレプリカ）"""
+    return [e.pool.monitor for e in (engine, read_engine) if e is not None and getattr(e.pool, 'monitor', None)]
+
+def get_pool_status() -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    接続プールの利用状況を取得
+
+    Returns:
+        dict: "primary" / "replica" → pool_monitor.pool_status の結果（監視していないプール・未設定は None）
+    """
+    get_engine()
+    result = {}
+    for name, target in (("primary", engine), ("replica", read_engine)):
+        has_monitor = target is not None and getattr(target.pool, 'monitor', None) is not None
+        result[name] = pool_monitor.pool_status(target.pool) if has_monitor else None
+    return result
+
+def reap_idle_sessions(max_idle_seconds: Optional[float] = None) -> int:
+    """トランザクションを開いたまま放置されたセッションをロールバックして接続を返す（回収したセッション数）"""
+    if max_idle_seconds is None:
+        max_idle_seconds = POOL_IDLE_TRANSACTION_SECONDS
+    return sum(pool_monitor.reap_idle_sessions(monitor, max_idle_seconds) for monitor in _pool_monitors())
+
 def get_db_session():
     """データベースセッションを取得"""
     if 'db_session' not in st.session_state:
-        if SessionLocal is None:
-            init_db()
-        st.session_state['db_session'] = SessionLocal()
+        st.session_state['db_session'] = get_session_factory()()
     
-    return st.session_state['db_session']
+    # 回収スレッドに所有者を伝え、回収を要求されていればこのスレッドでロールバックする
+    return pool_monitor.claim_session(st.session_state['db_session'])
+
+def _mark_user_write(user_id: Optional[int]):
+    """ユーザーの書き込みを記録（支出分析のキャッシュを無効にし、直後の読み取りはレプリカの遅延を避けて主DBから行う）"""
+    _bump_purchase_version(user_id)
+    if read_engine is not None and user_id is not None:
+        with _recent_writes_lock:
+            _recent_writes[user_id] = time.monotonic()
+
+def _bump_purchase_version(user_id: Optional[int]):
+    """ユーザー（None は全ユーザー）の購入バージョンを上げ、キャッシュ済みの支出分析を使わないようにする"""
+    with _analytics_cache_lock:
+        _purchase_versions[user_id] = _purchase_versions.get(user_id, 0) + 1
+
+def _purchase_version(user_id: int) -> tuple:
+    """キャッシュのキーに含める購入バージョン"""
+    with _analytics_cache_lock:
+        return (_purchase_versions.get(None, 0), _purchase_versions.get(user_id, 0))
+
+def _reads_from_primary(user_id: Optional[int]) -> bool:
+    """読み取りを主DBで行うか（レプリカ未設定、または直近に書き込んだユーザー）"""
+    if read_engine is None:
+        return True
+    with _recent_writes_lock:
+        written_at = _recent_writes.get(user_id)
+        if written_at is None:
+            return False
+        if time.monotonic() - written_at < READ_YOUR_WRITES_SECONDS:
+            return True
+        del _recent_writes[user_id]
+        return False
+
+def get_read_session(user_id: Optional[int] = None):
+    """分析・履歴の読み取り用セッションを取得（レプリカがなければ get_db_session と同じ）"""
+    get_engine()
+    if _reads_from_primary(user_id):
+        return get_db_session()
+    if 'db_read_session' not in st.session_state:
+        st.session_state['db_read_session'] = ReadSessionLocal()
+    return pool_monitor.claim_session(st.session_state['db_read_session'])
 
 def close_db_session():
     """データベースセッションをクローズ"""
-    if 'db_session' in st.session_state:
-        session = st.session_state['db_session']
+    for key in ('db_session', 'db_read_session'):
+        if key not in st.session_state:
+            continue
+        session = st.session_state[key]
         try:
             if session.is_active:
                 session.rollback()
@@ -156,35 +489,69 @@ def close_db_session():
             import logging
             logging.warning(f"DBセッションのクローズ時に例外: {e}")
         finally:
-            del st.session_state['db_session']
+            del st.session_state[key]
 
 # 認証関連の関数
 def hash_password(password: str) -> str:
     """パスワードをハッシュ化する"""
+    import bcrypt
     salt = bcrypt.gensalt()
     hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed.decode('utf-8')
 
 def check_password(password: str, hashed_password: str) -> bool:
     """パスワードをチェックする"""
+    import bcrypt
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def create_jwt_token(user_id: int) -> str:
     """JWTトークンを作成"""
+    import jwt
     payload = {
         "user_id": user_id,
         "exp": datetime.datetime.utcnow() + datetime.timedelta(days=14)  # 2週間有効
     }
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
-def verify_jwt_token(token: str) -> Optional[int]:
-    """JWTトークンを検証してユーザーIDを取得"""
+def _decode_jwt_token(token: str) -> Optional[Dict[str, Any]]:
+    """JWTトークンを検証してペイロードを取得（無効・期限切れは None）"""
+    import jwt
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        return payload.get("user_id")
+        return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
     except jwt.PyJWTError:
         return None
 
+def verify_jwt_token(token: str) -> Optional[int]:
+    """JWTトークンを検証してユーザーIDを取得"""
+    payload = _decode_jwt_token(token)
+    return payload.get("user_id") if payload else None
+
+def _principal(user: User, token: str) -> Optional[Dict[str, Any]]:
+    """ログイン中のユーザーの情報（セッションに保持し、ページごとのDB参照を省く）"""
+    payload = _decode_jwt_token(token)
+    if payload is None or payload.get("user_id") != user.id:
+        return None
+    return {
+        "user_id": user.id,
+        "name": user.name,
+        "email": user.email,
+        "token": token,
+        "expires_at": payload["exp"],  # UNIX時刻
+    }
+
+def load_principal(token: str) -> Optional[Dict[str, Any]]:
+    """トークンを検証し、ユーザー情報をDBから読んでログイン情報を作る（無効なトークン・削除されたユーザーは None）"""
+    user_id = verify_jwt_token(token)
+    if not user_id:
+        return None
+    user = get_user_by_id(user_id)
+    return _principal(user, token) if user else None
+
+def refresh_principal(user_id: int) -> Optional[Dict[str, Any]]:
+    """ユーザー情報を読み直し、トークンを再発行したログイン情報を作る（削除されたユーザーは None）"""
+    user = get_user_by_id(user_id)
+    return _principal(user, create_jwt_token(user.id)) if user else None
+
 def logout_user():
     """ログアウト処理。セッション状態はui_utils.pyのlogout関数で処理"""
     # トークン無効化やセッション処理のためのフック（必要に応じて拡張）
@@ -219,7 +586,7 @@ def register_user(email: str, password: str, name: str) -> Optional[User]:
         return None
 
 def login_user(email: str, password: str) -> Optional[Dict[str, Any]]:
-    """ユーザーログイン"""
+    """ユーザーログイン（成功時はユーザーID・名前・メールアドレス・トークンと有効期限を返す）"""
     session = get_db_session()
     try:
         user = session.query(User).filter(User.email == email).first()
@@ -228,14 +595,7 @@ def login_user(email: str, password: str) -> Optional[Dict[str, Any]]:
             return None
             
         # ログイン成功の場合、JWTトークンを生成
-        token = create_jwt_token(user.id)
-        
-        return {
-            "user_id": user.id,
-            "name": user.name,
-            "email": user.email,
-            "token": token
-        }
+        return _principal(user, create_jwt_token(user.id))
     except Exception as e:
         logger.error(f"ログインエラー: {e}")
         return None
@@ -288,7 +648,13 @@ def get_stores(user_id: Optional[int] = None) -> List[Store]:
         query = session.query(Store)
         if user_id:
             # ユーザー固有 + ユーザーに紐づかないデフォルト店舗
-            query = query.filter((Store.user_id == user_id) | (Store.user_id.is_(None)))
+            # （ユーザーが同じ正規化名の店舗を持つデフォルト店舗は除外し、店舗名を一意にする）
+            own_store = aliased(Store)
+            shadowed = exists().where(
+                own_store.user_id == user_id,
+                own_store.normalized_name == Store.normalized_name
+            )
+            query = query.filter((Store.user_id == user_id) | (Store.user_id.is_(None) & ~shadowed))
         return query.all()
     except Exception as e:
         logger.error(f"店舗一覧取得エラー: {e}")
@@ -298,26 +664,31 @@ def create_store(user_id, name, category=None, check_duplicate=True):
     """
     新しい店舗を作成する
     
+    正規化した店舗名で (user_id, normalized_name) の一意インデックスが張られているため、
+    同じユーザーの同名店舗（全角/半角・大文字/小文字・空白違いを含む）は重複作成されない。
+    
     Args:
         user_id (int): ユーザーID
         name (str): 店舗名
         category (str, optional): カテゴリ
-        check_duplicate (bool): 重複チェックを行うかどうか
+        check_duplicate (bool): 作成前に既存店舗を検索するかどうか（Falseでも一意制約で重複は防がれる）
         
     Returns:
         Store: 作成された店舗オブジェクト、または既存の店舗（重複時）
     """
-    from .models import Store
-    
     session = get_db_session()
+    normalized_name = normalize_store_name(name)
+    
+    def find_existing():
+        return session.query(Store).filter(
+            Store.user_id == user_id,
+            Store.normalized_name == normalized_name
+        ).first()
+    
     try:
-        # 重複チェック（同じユーザーの同じ名前の店舗を検索）
+        # 重複チェック（同じユーザーの正規化後に同じ名前の店舗を検索）
         if check_duplicate:
-            existing_store = session.query(Store).filter(
-                Store.user_id == user_id,
-                Store.name == name
-            ).first()
-            
+            existing_store = find_existing()
             if existing_store:
                 return existing_store
         
@@ -328,7 +699,13 @@ def create_store(user_id, name, category=None, check_duplicate=True):
             category=category
         )
         session.add(store)
-        session.commit()
+        try:
+            session.commit()
+        except IntegrityError:
+            # 同時作成などで一意制約に抵触した場合は既存の店舗を返す
+            session.rollback()
+            return find_existing()
+        session.refresh(store)
         return store
     except Exception as e:
         session.rollback()
@@ -336,10 +713,115 @@ def create_store(user_id, name, category=None, check_duplicate=True):
     finally:
         session.close()
 
+def _merge_duplicate_stores(executor, user_id: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    正規化名が同じ店舗を、最も古い（IDが最小の）店舗に集合演算で統合する
+    
+    発行するSQLは重複数に関係なく「対応表の取得・参照の付け替え・削除」の一定数。
+    
+    Args:
+        executor: SQLAlchemyのConnectionまたはSession
+        user_id (int, optional): 特定ユーザーの店舗のみ対象にする場合に指定
+        
+    Returns:
+        dict: 残した店舗名ごとの {"kept_id", "deleted_ids", "count"}
+    """
+    stores = Store.__table__
+    list_items = ShoppingListItem.__table__
+    
+    # (user_id, normalized_name) ごとに残す店舗ID（最小ID）を求める
+    groups = select(
+        stores.c.user_id,
+        stores.c.normalized_name,
+        func.min(stores.c.id).label('keep_id')
+    ).group_by(
+        stores.c.user_id,
+        stores.c.normalized_name
+    ).having(
+        func.count(stores.c.id) > 1
+    )
+    if user_id:
+        groups = groups.where(stores.c.user_id == user_id)
+    groups = groups.subquery()
+    keep = stores.alias('keep')
+    
+    # 削除対象ID → 残すIDの対応表を1回のクエリで取得
+    mapping_rows = executor.execute(
+        select(stores.c.id, groups.c.keep_id, keep.c.name.label('keep_name'))
+        .join_from(stores, groups, and_(
+            stores.c.normalized_name == groups.c.normalized_name,
+            stores.c.user_id.is_not_distinct_from(groups.c.user_id)
+        ))
+        .join(keep, keep.c.id == groups.c.keep_id)
+        .where(stores.c.id != groups.c.keep_id)
+        .order_by(groups.c.keep_id, stores.c.id)
+    ).all()
+    
+    if not mapping_rows:
+        return {}
+    
+    keep_id_map = {row.id: row.keep_id for row in mapping_rows}
+    duplicates = {}
+    for row in mapping_rows:
+        group = duplicates.setdefault(row.keep_name, {"kept_id": row.keep_id, "deleted_ids": [], "count": 1})
+        group["deleted_ids"].append(row.id)
+        group["count"] += 1
+    
+    # 買い物リストアイテム（アーカイブ済みを含む）・価格観測の店舗参照を一括で付け替え
+    for table in (list_items, ArchivedShoppingListItem.__table__, PriceObservation.__table__):
+        executor.execute(
+            update(table)
+            .where(table.c.store_id.in_(list(keep_id_map)))
+            .values(store_id=case(keep_id_map, value=table.c.store_id))
+        )
+    
+    # 価格統計は付け替え後の観測から作り直す
+    executor.execute(delete(ItemPriceStat.__table__).where(ItemPriceStat.__table__.c.store_id.in_(list(keep_id_map))))
+    price_history.rebuild_price_stats(executor, store_ids=sorted(set(keep_id_map.values())))
+    
+    # 重複店舗を一括削除
+    executor.execute(delete(stores).where(stores.c.id.in_(list(keep_id_map))))
+    return duplicates
+
+def find_duplicate_stores(user_id: int) -> List[Dict[str, Any]]:
+    """
+    正規化名が重複している店舗を1回のクエリで検出する
+    
+    Returns:
+        list: [{"name": 残る店舗名, "count": 件数, "store_ids": [ID昇順]}]
+    """
+    session = get_db_session()
+    try:
+        groups = session.query(
+            Store.normalized_name.label('normalized_name')
+        ).filter(
+            Store.user_id == user_id
+        ).group_by(
+            Store.normalized_name
+        ).having(
+            func.count(Store.id) > 1
+        ).subquery()
+        
+        rows = session.query(Store.id, Store.name, Store.normalized_name)\
+            .join(groups, Store.normalized_name == groups.c.normalized_name)\
+            .filter(Store.user_id == user_id)\
+            .order_by(Store.normalized_name, Store.id)\
+            .all()
+        
+        duplicates = {}
+        for row in rows:
+            group = duplicates.setdefault(row.normalized_name, {"name": row.name, "count": 0, "store_ids": []})
+            group["count"] += 1
+            group["store_ids"].append(row.id)
+        return list(duplicates.values())
+    except Exception as e:
+        logger.error(f"重複店舗検出エラー: {e}")
+        return []
+
 def clean_duplicate_stores(user_id=None):
     """
     重複している店舗を検出して削除する
-    同じ名前の店舗が複数ある場合、最も古いものを残して他を削除
+    正規化後に同じ名前の店舗が複数ある場合、最も古いものを残して他を削除
     
     Args:
         user_id (int, optional): 特定ユーザーの店舗のみ対象にする場合に指定
@@ -347,9 +829,6 @@ def clean_duplicate_stores(user_id=None):
     Returns:
         dict: 処理結果の情報（削除数、残存数など）
     """
-    from sqlalchemy import func
-    from .models import Store
-    
     session = get_db_session()
     result = {
         "cleaned": 0,
@@ -358,58 +837,17 @@ def clean_duplicate_stores(user_id=None):
     }
     
     try:
-        # ユーザーごとに同じ名前の店舗をカウント
-        query = session.query(
-            Store.name, 
-            Store.user_id, 
-            func.count(Store.id).label('count')
-        ).group_by(
-            Store.name, 
-            Store.user_id
-        ).having(
-            func.count(Store.id) > 1
-        )
-        
-        if user_id:
-            query = query.filter(Store.user_id == user_id)
-        
-        duplicate_groups = query.all()
-        
-        # 重複している店舗ごとに処理
-        for name, user_id, count in duplicate_groups:
-            # 同じ名前の店舗を取得（IDの昇順）
-            stores = session.query(Store).filter(
-                Store.name == name,
-                Store.user_id == user_id
-            ).order_by(Store.id).all()
-            
-            # 最初の店舗を残し、残りを削除対象にする
-            keep_store = stores[0]
-            duplicates = stores[1:]
-            
-            # 重複店舗のIDを記録
-            result["duplicates"][name] = {
-                "kept_id": keep_store.id,
-                "deleted_ids": [s.id for s in duplicates],
-                "count": count
-            }
-            
-            # 重複店舗を削除
-            for store in duplicates:
-                # 関連する買い物リストの店舗IDを更新
-                # (この実装は実際のモデル構造に応じて調整が必要)
-                session.query(ShoppingListItem).filter(
-                    ShoppingListItem.store_id == store.id
-                ).update({"store_id": keep_store.id})
-                
-                # 店舗を削除
-                session.delete(store)
-                result["cleaned"] += 1
+        result["duplicates"] = _merge_duplicate_stores(session, user_id)
+        result["cleaned"] = sum(len(group["deleted_ids"]) for group in result["duplicates"].values())
         
         # 残りの店舗数をカウント
-        result["remaining"] = session.query(Store).count()
+        result["remaining"] = session.query(func.count(Store.id)).scalar()
         
         session.commit()
+        if result["cleaned"]:
+            # 店舗別の集計・予測の店舗名が変わる
+            _invalidate_forecasts(user_id)
+            _mark_user_write(user_id)
         return result
     except Exception as e:
         session.rollback()
@@ -497,6 +935,74 @@ def get_shopping_lists(user_id: int, limit: int = 20) -> List[ShoppingList]:
         logger.error(f"買い物リスト一覧取得エラー: {e}")
         return []
 
+def get_shopping_list_summaries(user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    ユーザーの買い物リスト一覧を集計値付きで取得する（リスト数・件数に関係なく1クエリ）
+
+    Args:
+        user_id (int): ユーザーID
+        limit (int): 取得するリスト数の上限
+
+    Returns:
+        list: [{"id", "name", "date", "memo", "total_items", "checked_items", "purchased_items", "total_price", "budget", "spent_total"}]
+    """
+    session = get_db_session()
+    try:
+        # 先に対象リストを絞り込んでから、アイテムを結合して集計する
+        lists = select(
+            ShoppingList.id,
+            ShoppingList.name,
+            ShoppingList.date,
+            ShoppingList.memo,
+            ShoppingList.budget,
+            ShoppingList.planned_total,
+            ShoppingList.spent_total
+        ).where(
+            ShoppingList.user_id == user_id
+        ).order_by(
+            ShoppingList.date.desc(), ShoppingList.id.desc()
+        ).limit(limit).subquery()
+        
+        purchased = exists().where(Purchase.shopping_list_item_id == ShoppingListItem.id)
+        query = select(
+            lists.c.id,
+            lists.c.name,
+            lists.c.date,
+            lists.c.memo,
+            func.count(ShoppingListItem.id).label('total_items'),
+            func.coalesce(func.sum(case((ShoppingListItem.checked == True, 1), else_=0)), 0).label('checked_items'),
+            func.coalesce(func.sum(case((purchased, 1), else_=0)), 0).label('purchased_items'),
+            lists.c.budget,
+            lists.c.planned_total,
+            lists.c.spent_total
+        ).select_from(lists).outerjoin(
+            ShoppingListItem, ShoppingListItem.shopping_list_id == lists.c.id
+        ).group_by(
+            lists.c.id, lists.c.name, lists.c.date, lists.c.memo,
+            lists.c.budget, lists.c.planned_total, lists.c.spent_total
+        ).order_by(
+            lists.c.date.desc(), lists.c.id.desc()
+        )
+        
+        summaries = []
+        for row in session.execute(query):
+            summaries.append({
+                "id": row.id,
+                "name": row.name,
+                "date": row.date,
+                "memo": row.memo,
+                "total_items": row.total_items,
+                "checked_items": row.checked_items,
+                "purchased_items": row.purchased_items,
+                "total_price": row.planned_total or 0,
+                "budget": row.budget,
+                "spent_total": row.spent_total or 0
+            })
+        return summaries
+    except Exception as e:
+        logger.error(f"買い物リスト集計取得エラー: {e}")
+        return []
+
 def get_shopping_list(list_id: int) -> Optional[ShoppingList]:
     """IDから買い物リストを取得"""
     session = get_db_session()
@@ -519,6 +1025,8 @@ def update_shopping_list(list_id: int, name: Optional[str] = None, memo: Optiona
         if memo is not None:
             shopping_list.memo = memo
         if date is not None:
+            # 予定金額をリストの新しい日付の月へ移す
+            budgets.move_list_date(session, list_id, date)
             shopping_list.date = date
             
         session.commit()
@@ -549,9 +1057,11 @@ def add_item_to_shopping_list(
             
         if existing_item:
             # すでに存在する場合は数量を更新
+            before = budgets.planned_amount(existing_item)
             existing_item.quantity += quantity
             if planned_price is not None:
-                existing_item.planned_price = planned_price
+                existing_item.planned_price = to_yen(planned_price)
+            budgets.add_planned(session, shopping_list_id, budgets.planned_amount(existing_item) - before)
             session.commit()
             session.refresh(existing_item)
             return existing_item
@@ -561,11 +1071,13 @@ def add_item_to_shopping_list(
             shopping_list_id=shopping_list_id,
             item_id=item_id,
             store_id=store_id,
-            planned_price=planned_price,
+            planned_price=to_yen(planned_price),
             quantity=quantity,
             checked=False
         )
+        recommendations.record_item_added(session, shopping_list_id, item_id)
         session.add(list_item)
+        budgets.add_planned(session, shopping_list_id, budgets.planned_amount(list_item))
         session.commit()
         session.refresh(list_item)
         return list_item
@@ -575,10 +1087,16 @@ def add_item_to_shopping_list(
         return None
 
 def get_shopping_list_items(shopping_list_id: int, store_id: Optional[int] = None) -> List[ShoppingListItem]:
-    """買い物リスト内のアイテム一覧を取得"""
+    """買い物リスト内のアイテム一覧を取得（店舗・商品・カテゴリ・購入履歴もまとめて読み込む）"""
     session = get_db_session()
     try:
+        # 画面で参照する関連を行ごとに読み込まないよう、関連ごとに1回のクエリで読み込む
         query = session.query(ShoppingListItem)\
+            .options(
+                selectinload(ShoppingListItem.store),
+                selectinload(ShoppingListItem.item).selectinload(Item.category),
+                selectinload(ShoppingListItem.purchases),
+            )\
             .filter(ShoppingListItem.shopping_list_id == shopping_list_id)
             
         if store_id:
@@ -606,10 +1124,11 @@ def get_shopping_list_total(shopping_list_id: int) -> dict:
     session = get_db_session()
     try:
         items = get_shopping_list_items(shopping_list_id)
-        total_price = sum((item.planned_price or 0) * item.quantity for item in items)
+        checked = [item for item in items if item.checked]
+        total_price = yen_total((item.planned_price for item in items), (item.quantity for item in items))
         total_items = len(items)
-        checked_items = sum(1 for item in items if item.checked)
-        checked_price = sum((item.planned_price or 0) * item.quantity for item in items if item.checked)
+        checked_items = len(checked)
+        checked_price = yen_total((item.planned_price for item in checked), (item.quantity for item in checked))
         return {
             "total_price": total_price,
             "total_items": total_items,
@@ -633,12 +1152,15 @@ def update_shopping_list_item(
 ) -> Optional[ShoppingListItem]:
     """買い物リストアイテムを更新（チェック状態、数量、店舗、価格、予定日）"""
     # 新規セッションを使用
-    session = SessionLocal()
+    session = get_session_factory()()
     try:
         list_item = session.query(ShoppingListItem).filter(ShoppingListItem.id == item_id).first()
         if not list_item:
             return None
         
+        before = budgets.planned_amount(list_item)
+        # 購入済みのアイテムの店舗を変えると店舗別の支出が変わる
+        store_changed = store_id is not None and store_id != list_item.store_id and bool(list_item.purchases)
         if checked is not None:
             list_item.checked = checked
         if quantity is not None:
@@ -646,12 +1168,17 @@ def update_shopping_list_item(
         if store_id is not None:
             list_item.store_id = store_id
         if planned_price is not None:
-            list_item.planned_price = planned_price
+            list_item.planned_price = to_yen(planned_price)
         if planned_date is not None:
             list_item.planned_date = planned_date
+        budgets.add_planned(session, list_item.shopping_list_id, budgets.planned_amount(list_item) - before)
         
         session.commit()
         session.refresh(list_item)
+        if store_changed:
+            # 店舗の変更は購入IDの差分集計では拾えないため、店舗別の予測キャッシュも破棄する
+            _invalidate_forecasts(list_item.shopping_list.user_id)
+            _mark_user_write(list_item.shopping_list.user_id)
         return list_item
     except Exception as e:
         logger.error(f"買い物リストアイテム更新エラー: {e}")
@@ -668,6 +1195,7 @@ def delete_shopping_list_item(item_id: int) -> bool:
         if not list_item:
             return False
             
+        _on_list_items_deleted(session, [list_item])
         session.delete(list_item)
         session.commit()
         return True
@@ -689,12 +1217,13 @@ def remove_item_from_shopping_list(item_id: int) -> bool:
         return False
     
     try:
-        session = SessionLocal()
+        session = get_session_factory()()
         item = session.query(ShoppingListItem).filter(ShoppingListItem.id == item_id).first()
         
         if not item:
             return False
         
+        _on_list_items_deleted(session, [item])
         session.delete(item)
         session.commit()
         return True
@@ -717,13 +1246,16 @@ def delete_shopping_list_items(item_ids: List[int]) -> bool:
         return False
     
     try:
-        session = SessionLocal()
+        session = get_session_factory()()
         
         # 一括削除を実行
+        deleted_items = []
         for item_id in item_ids:
             item = session.query(ShoppingListItem).filter(ShoppingListItem.id == item_id).first()
             if item:
+                deleted_items.append(item)
                 session.delete(item)
+        _on_list_items_deleted(session, deleted_items)
         
         session.commit()
         return True
@@ -734,6 +1266,103 @@ def delete_shopping_list_items(item_ids: List[int]) -> bool:
     finally:
         session.close()
 
+def bulk_update_store_assignments(assignments: Dict[int, int]) -> int:
+    """
+    複数の買い物リストアイテムの店舗を1回のUPDATEで変更する
+
+    Args:
+        assignments (dict): {リストアイテムID: 店舗ID}
+
+    Returns:
+        int: 更新した行数（失敗時は0）
+    """
+    if not assignments:
+        return 0
+    session = get_db_session()
+    try:
+        list_items = ShoppingListItem.__table__
+        # 購入済みのアイテムの店舗を変えると店舗別の支出が変わるため、対象のユーザーを先に求める
+        purchased_user_ids = session.execute(
+            select(ShoppingList.user_id).distinct()
+            .join(ShoppingListItem, ShoppingListItem.shopping_list_id == ShoppingList.id)
+            .where(ShoppingListItem.id.in_(list(assignments)), ShoppingListItem.purchases.any())
+        ).scalars().all()
+        result = session.execute(
+            update(list_items)
+            .where(list_items.c.id.in_(list(assignments)))
+            .values(store_id=case(assignments, value=list_items.c.id))
+        )
+        session.commit()
+        # セッション内のオブジェクトを最新の状態に
+        session.expire_all()
+        for user_id in purchased_user_ids:
+            _invalidate_forecasts(user_id)
+            _mark_user_write(user_id)
+        return result.rowcount
+    except Exception as e:
+        logger.error(f"店舗一括更新エラー: {e}")
+        session.rollback()
+        return 0
+
+def apply_list_item_changes(changes: Dict[int, Dict[str, Any]]) -> int:
+    """
+    データエディタで変更されたリストアイテムの数量・予定日を1トランザクションで反映する
+
+    Args:
+        changes (dict): {リストアイテムID: {"quantity" / "planned_date": 値}}（grid_sync.diff_grid の結果）
+
+    Returns:
+        int: 更新した行数（失敗時は0）
+    """
+    if not changes:
+        return 0
+    session = get_db_session()
+    try:
+        from . import grid_sync
+        updated = grid_sync.apply_list_item_changes(session, changes)
+        session.commit()
+        # セッション内のオブジェクトを最新の状態に
+        session.expire_all()
+        return updated
+    except Exception as e:
+        logger.error(f"リストアイテム一括更新エラー: {e}")
+        session.rollback()
+        return 0
+
+def suggest_store_assignment(shopping_list_id: int, max_stores: Optional[int] = None) -> Dict[str, Any]:
+    """
+    過去の購入価格から、期待合計金額が最小になる店舗割り当てを提案する
+
+    Args:
+        shopping_list_id (int): 買い物リストID
+        max_stores (int, optional): 訪問する店舗数の上限
+
+    Returns:
+        dict: store_optimizer.suggest_store_assignment の結果（失敗時は空の提案）
+    """
+    session = get_db_session()
+    try:
+        from . import store_optimizer
+        return store_optimizer.suggest_store_assignment(session, shopping_list_id, max_stores)
+    except Exception as e:
+        logger.error(f"店舗割り当て提案エラー: {e}")
+        return {"assignments": {}, "expected_total": 0.0, "current_total": 0.0, "store_ids": [], "unpriced_item_ids": []}
+
+def _invalidate_forecasts(user_id: int):
+    """支出予測のキャッシュを破棄（予測モジュールが未読み込みならキャッシュもないので何もしない）"""
+    forecast = sys.modules.get(f"{__package__}.forecast")
+    if forecast is not None:
+        forecast.invalidate_forecast_cache(user_id)
+
+def _on_list_items_deleted(session, list_items: List[ShoppingListItem]):
+    """リストアイテム削除時（購入履歴も連鎖削除される）に派生データを更新する（コミットは呼び出し側）"""
+    budgets.remove_list_items(session, list_items)
+    recommendations.record_items_removed(session, list_items)
+    user_ids = {item.shopping_list.user_id for item in list_items if item.purchases}
+    for user_id in user_ids:
+        _invalidate_forecasts(user_id)
+        _mark_user_write(user_id)
+
 # 購入履歴関連の関数
 def record_purchase(
     shopping_list_item_id: int,
@@ -755,7 +1384,7 @@ def record_purchase(
         # 購入履歴を記録
         purchase = Purchase(
             shopping_list_item_id=shopping_list_item_id,
-            actual_price=actual_price,
+            actual_price=to_yen(actual_price),
             quantity=quantity
         )
         
@@ -763,6 +1392,9 @@ def record_purchase(
         list_item.checked = True
         
         session.add(purchase)
+        session.flush()
+        # 価格観測などの派生データを同じトランザクションで更新
+        _on_purchases_recorded(session, [_purchase_record(purchase, list_item)])
         session.commit()
         session.refresh(purchase)
         return purchase
@@ -771,9 +1403,62 @@ def record_purchase(
         session.rollback()
         return None
 
+def _purchase_record(purchase: Purchase, list_item: ShoppingListItem) -> Dict[str, Any]:
+    """派生データ更新用に購入記録の情報を辞書にまとめる"""
+    return {
+        "purchase_id": purchase.id,
+        "user_id": list_item.shopping_list.user_id,
+        "shopping_list_id": list_item.shopping_list_id,
+        "item_id": list_item.item_id,
+        "store_id": list_item.store_id,
+        "store_name": list_item.store.name if list_item.store else None,
+        "price": purchase.actual_price,
+        "quantity": purchase.quantity,
+        "purchased_at": purchase.purchased_at,
+    }
+
+def _on_purchases_recorded(session, records: List[Dict[str, Any]]):
+    """購入記録の追加時に派生データを更新する（コミットは呼び出し側）"""
+    price_history.record_price_observations(session, records)
+    budgets.record_spending(session, records)
+    recommendations.record_purchases(session, records)
+    # 直後の履歴・分析の表示に記録した購入が反映されるよう、しばらく主DBから読む
+    for user_id in {r["user_id"] for r in records}:
+        _mark_user_write(user_id)
+
+def checkout_shopping_list(shopping_list_id: int, store_id: Optional[int] = None,
+                           store_only: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    チェック済みで未購入のアイテムの購入を、予定単価とリストの数量で1トランザクションにまとめて記録する
+
+    Args:
+        shopping_list_id (int): 買い物リストのID
+        store_id (int, optional): store_only のときの対象店舗（None は店舗未指定のアイテム）
+        store_only (bool): store_id の店舗のアイテムだけを対象にするか（False ならリスト全体）
+
+    Returns:
+        dict: {"purchased": 記録した件数, "total": 記録した金額の合計, "unpriced": 金額が決まらず記録しなかった件数}（エラー時は None）
+    """
+    session = get_db_session()
+    try:
+        result = checkout.checkout(session, shopping_list_id, store_id, store_only)
+        records = result["records"]
+        if records:
+            _on_purchases_recorded(session, records)
+        session.commit()
+        return {
+            "purchased": len(records),
+            "total": yen_total((r["price"] for r in records), (r["quantity"] for r in records)),
+            "unpriced": result["unpriced"],
+        }
+    except Exception as e:
+        logger.error(f"まとめて購入記録エラー: {e}")
+        session.rollback()
+        return None
+
 def get_purchase_history(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
     """ユーザーの購入履歴を取得"""
-    session = get_db_session()
+    session = get_read_session(user_id)
     try:
         # 購入履歴を取得するSQLクエリ
         query = text("""
@@ -812,7 +1497,7 @@ def get_purchase_history(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
         for row in result:
             purchases.append({
                 "id": row.id,
-                "actual_price": float(row.actual_price),
+                "actual_price": row.actual_price,
                 "quantity": row.quantity,
                 "purchased_at": row.purchased_at,
                 "item_name": row.item_name,
@@ -829,7 +1514,7 @@ def get_purchase_history(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
 # 支出集計関連の関数
 def get_monthly_spending(user_id: int, year: int, month: int) -> List[Dict[str, Any]]:
     """月ごとの支出サマリーを取得"""
-    session = get_db_session()
+    session = get_read_session(user_id)
     try:
         # 指定した年月の範囲を計算
         start_date = datetime.date(year, month, 1)
@@ -868,7 +1553,7 @@ def get_monthly_spending(user_id: int, year: int, month: int) -> List[Dict[str,
         for row in result:
             spending_data.append({
                 "category": row.category or "未分類",
-                "total_spending": float(row.total_spending)
+                "total_spending": int(row.total_spending)
             })
             
         return spending_data
@@ -876,12 +1561,8 @@ def get_monthly_spending(user_id: int, year: int, month: int) -> List[Dict[str,
         logger.error(f"月次支出取得エラー: {e}")
         return []
 
-def get_user_purchases(user_id: int, start_date: Optional[datetime.datetime] = None, end_date: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
-    """ユーザーの購入履歴を取得"""
-    session = get_db_session()
-    try:
-        # 購入履歴を取得するSQLクエリ
-        query = text("""
+# 購入履歴の一覧のSQL（テーブル名を差し替えてアーカイブ側にも使う）
+_USER_PURCHASES_SQL = """
         SELECT 
             p.id,
             p.actual_price,
@@ -890,13 +1571,14 @@ def get_user_purchases(user_id: int, start_date: Optional[datetime.datetime] = N
             i.name as item_name,
             c.name as category_name,
             s.name as store_name,
-            sl.date as shopping_date
+            sl.date as shopping_date,
+            {archived} as archived
         FROM 
-            purchases p
+            {purchases} p
         JOIN 
-            shopping_list_items sli ON p.shopping_list_item_id = sli.id
+            {shopping_list_items} sli ON p.shopping_list_item_id = sli.id
         JOIN 
-            shopping_lists sl ON sli.shopping_list_id = sl.id
+            {shopping_lists} sl ON sli.shopping_list_id = sl.id
         JOIN 
             items i ON sli.item_id = i.id
         LEFT JOIN 
@@ -906,19 +1588,31 @@ def get_user_purchases(user_id: int, start_date: Optional[datetime.datetime] = N
         WHERE 
             sl.user_id = :user_id
         """
-        )
-        
-        # 日付範囲フィルタを追加
+_HOT_TABLES = {"purchases": "purchases", "shopping_list_items": "shopping_list_items", "shopping_lists": "shopping_lists", "archived": 0}
+_ARCHIVED_TABLES = {**{name: f"archived_{name}" for name in _HOT_TABLES if name != "archived"}, "archived": 1}
+
+def get_user_purchases(user_id: int, start_date: Optional[datetime.datetime] = None, end_date: Optional[datetime.datetime] = None,
+                       include_archive: bool = False, session=None) -> List[Dict[str, Any]]:
+    """ユーザーの購入履歴を取得（include_archive でアーカイブ済みも含める。session 省略時は読み取り用のセッションを使用）"""
+    session = session or get_read_session(user_id)
+    try:
+        # 日付範囲フィルタ
         params = {"user_id": user_id}
+        filters = ""
         if start_date:
-            query = text(query.text + " AND p.purchased_at >= :start_date")
+            filters += " AND p.purchased_at >= :start_date"
             params["start_date"] = start_date
         if end_date:
-            query = text(query.text + " AND p.purchased_at <= :end_date")
+            filters += " AND p.purchased_at <= :end_date"
             params["end_date"] = end_date
-            
+        
+        sql = _USER_PURCHASES_SQL.format(**_HOT_TABLES) + filters
+        if include_archive:
+            sql += " UNION ALL " + _USER_PURCHASES_SQL.format(**_ARCHIVED_TABLES) + filters
         # 日付順でソート
-        query = text(query.text + " ORDER BY p.purchased_at DESC")
+        query = text(sql + " ORDER BY purchased_at DESC")
+        # SQLiteでは生SQLの日時が文字列で返るため型を指定して datetime に変換させる
+        query = query.columns(purchased_at=DateTime)
         
         result = session.execute(query, params)
         
@@ -927,14 +1621,15 @@ def get_user_purchases(user_id: int, start_date: Optional[datetime.datetime] = N
         for row in result:
             purchases.append({
                 "id": row.id,
-                "actual_price": float(row.actual_price),
+                "actual_price": row.actual_price,
                 "quantity": row.quantity,
                 "purchased_at": row.purchased_at,
                 "item_name": row.item_name,
                 "category_name": row.category_name or "未分類",
                 "store_name": row.store_name or "未設定",
                 "shopping_date": row.shopping_date,
-                "total": float(row.actual_price) * row.quantity
+                "total": row.actual_price * row.quantity,
+                "archived": bool(row.archived)
             })
             
         return purchases
@@ -942,9 +1637,20 @@ def get_user_purchases(user_id: int, start_date: Optional[datetime.datetime] = N
         logger.error(f"購入履歴取得エラー: {e}")
         return []
 
-def get_category_spending(user_id: int, start_date: Optional[datetime.datetime] = None, end_date: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
-    """カテゴリ別支出を集計"""
-    session = get_db_session()
+def _merge_archived_spending(session, spending: List[Dict[str, Any]], key: str, user_id: int, dimension: str,
+                             start_date: Optional[datetime.datetime], end_date: Optional[datetime.datetime]) -> List[Dict[str, Any]]:
+    """ホットなテーブルの集計にアーカイブ済みの支出サマリーを合算し、支出の降順に並べ直す"""
+    totals = {row[key]: row["total_spending"] for row in spending}
+    for row in archive.get_archived_spending(session, user_id, dimension, start_date, end_date):
+        totals[row.key] = totals.get(row.key, 0) + int(row.total)
+    merged = [{key: name, "total_spending": total} for name, total in totals.items()]
+    merged.sort(key=lambda row: row["total_spending"], reverse=True)
+    return merged
+
+def get_category_spending(user_id: int, start_date: Optional[datetime.datetime] = None, end_date: Optional[datetime.datetime] = None,
+                          include_archive: bool = False, session=None) -> List[Dict[str, Any]]:
+    """カテゴリ別支出を集計（include_archive でアーカイブ済みも合算。session 省略時は読み取り用のセッションを使用）"""
+    session = session or get_read_session(user_id)
     try:
         # カテゴリ別に支出を集計するSQLクエリ
         query = text("""
@@ -985,17 +1691,20 @@ def get_category_spending(user_id: int, start_date: Optional[datetime.datetime]
         for row in result:
             category_spending.append({
                 "category": row.category,
-                "total_spending": float(row.total_amount)
+                "total_spending": int(row.total_amount)
             })
             
+        if include_archive:
+            category_spending = _merge_archived_spending(session, category_spending, "category", user_id, "category", start_date, end_date)
         return category_spending
     except Exception as e:
         logger.error(f"カテゴリ別支出集計エラー: {e}")
         return []
 
-def get_store_spending(user_id: int, start_date: Optional[datetime.datetime] = None, end_date: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
-    """店舗別支出を集計"""
-    session = get_db_session()
+def get_store_spending(user_id: int, start_date: Optional[datetime.datetime] = None, end_date: Optional[datetime.datetime] = None,
+                       include_archive: bool = False, session=None) -> List[Dict[str, Any]]:
+    """店舗別支出を集計（include_archive でアーカイブ済みも合算。session 省略時は読み取り用のセッションを使用）"""
+    session = session or get_read_session(user_id)
     try:
         # 店舗別に支出を集計するSQLクエリ
         query = text("""
@@ -1034,14 +1743,117 @@ def get_store_spending(user_id: int, start_date: Optional[datetime.datetime] = N
         for row in result:
             store_spending.append({
                 "store": row.store,
-                "total_spending": float(row.total_amount)
+                "total_spending": int(row.total_amount)
             })
             
+        if include_archive:
+            store_spending = _merge_archived_spending(session, store_spending, "store", user_id, "store", start_date, end_date)
         return store_spending
     except Exception as e:
         logger.error(f"店舗別支出集計エラー: {e}")
         return []
 
+# 支出分析のデータ（ビュー名 → 取得関数）
+ANALYTICS_VIEWS = {
+    'category': get_category_spending,
+    'store': get_store_spending,
+    'purchases': get_user_purchases,
+}
+# 支出分析の読み取りを並行して実行するスレッドプール（初回利用時に作成）
+_analytics_executor = None
+_analytics_executor_lock = threading.Lock()
+
+def _get_analytics_executor():
+    """支出分析用のスレッドプールを取得"""
+    global _analytics_executor
+    if _analytics_executor is None:
+        with _analytics_executor_lock:
+            if _analytics_executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _analytics_executor = ThreadPoolExecutor(max_workers=len(ANALYTICS_VIEWS), thread_name_prefix="analytics")
+    return _analytics_executor
+
+def _fetch_in_own_session(func, user_id, *args):
+    """専用のセッション（プールの別の接続）で読み取りを実行し、終わったら接続を返す"""
+    factory = get_session_factory() if _reads_from_primary(user_id) else ReadSessionLocal
+    session = factory.session_factory()
+    try:
+        return func(user_id, *args, session=session)
+    finally:
+        session.close()
+
+def get_spending_analytics(user_id: int, start_date: Optional[datetime.datetime] = None, end_date: Optional[datetime.datetime] = None,
+                           views: Optional[List[str]] = None, include_archive: Optional[bool] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    支出分析のデータを取得（表示するビューの分だけ読み取り、複数の場合は並行して実行）
+
+    期間は日の境界（開始日の0時〜終了日の終わり）にそろえ、結果は (ユーザー, ビュー, 期間) ごとに
+    キャッシュする。購入の記録・日付変更などでユーザーの購入バージョンが上がるまではDBを読まない。
+    返す結果はキャッシュと共有するため、呼び出し側で変更しないこと。
+
+    Args:
+        user_id (int): ユーザーID
+        start_date, end_date (datetime, optional): 期間
+        views (list, optional): ANALYTICS_VIEWS のキー（省略時はすべて）
+        include_archive (bool, optional): アーカイブ済みの履歴も含めるか
+            （省略時は期間がアーカイブ済みの購入日に掛かる場合だけ含める）
+
+    Returns:
+        dict: ビュー名 → 取得結果
+    """
+    views = list(views or ANALYTICS_VIEWS)
+    start_date, end_date = _align_period(start_date, end_date)
+    version = _purchase_version(user_id)
+    keys = {view: (user_id, view, start_date, end_date, include_archive, version) for view in views}
+    results = {}
+    with _analytics_cache_lock:
+        for view, key in keys.items():
+            cached = _analytics_cache.get(key)
+            if cached is not None:
+                results[view] = cached
+    missing = [view for view in views if view not in results]
+    if missing:
+        fetched = _fetch_spending_analytics(user_id, start_date, end_date, missing, include_archive)
+        with _analytics_cache_lock:
+            for view, value in fetched.items():
+                if value:  # 空の結果（エラー時を含む）はキャッシュしない
+                    _analytics_cache[keys[view]] = value
+        results.update(fetched)
+    return {view: results[view] for view in views}
+
+def _align_period(start_date, end_date):
+    """期間を日の境界（開始日の0時・終了日の終わり）にそろえる"""
+    if start_date is not None:
+        day = start_date.date() if isinstance(start_date, datetime.datetime) else start_date
+        start_date = datetime.datetime.combine(day, datetime.time.min)
+    if end_date is not None:
+        day = end_date.date() if isinstance(end_date, datetime.datetime) else end_date
+        end_date = datetime.datetime.combine(day, datetime.time.max)
+    return start_date, end_date
+
+def _fetch_spending_analytics(user_id: int, start_date, end_date, views: List[str],
+                              include_archive: Optional[bool]) -> Dict[str, List[Dict[str, Any]]]:
+    """支出分析のビューをDBから読み取る（1つならそのまま、複数なら並行して実行）"""
+    if include_archive is None:
+        include_archive = _period_reaches_archive(user_id, start_date)
+    if len(views) == 1:
+        # 1つだけなら別スレッドに渡さずそのまま実行
+        return {views[0]: ANALYTICS_VIEWS[views[0]](user_id, start_date, end_date, include_archive)}
+    executor = _get_analytics_executor()
+    futures = {
+        view: executor.submit(_fetch_in_own_session, ANALYTICS_VIEWS[view], user_id, start_date, end_date, include_archive)
+        for view in views
+    }
+    return {view: future.result() for view, future in futures.items()}
+
+def _period_reaches_archive(user_id: int, start_date: Optional[datetime.datetime]) -> bool:
+    """期間の開始がアーカイブ済みの最新の購入日以前か（アーカイブがなければ False）"""
+    try:
+        return archive.period_reaches_archive(get_read_session(user_id), user_id, start_date)
+    except Exception as e:
+        logger.error(f"アーカイブ範囲取得エラー: {e}")
+        return False
+
 def save_purchase(
     user_id: int,
     item_id: int,
@@ -1079,15 +1891,34 @@ def update_purchase_date(purchase_id: int, new_date: datetime.datetime) -> bool:
         purchase = session.query(Purchase).filter(Purchase.id == purchase_id).first()
         if not purchase:
             return False
+        # 支出を新しい購入日の月へ移す
+        budgets.move_spending(
+            session,
+            purchase.shopping_list_item.shopping_list.user_id,
+            purchase.actual_price * purchase.quantity,
+            purchase.purchased_at,
+            new_date
+        )
         purchase.purchased_at = new_date
+        
+        # 価格観測の日付も合わせ、該当商品の価格統計を作り直す
+        observation = session.query(PriceObservation).filter(PriceObservation.purchase_id == purchase_id).first()
+        if observation:
+            observation.recorded_date = new_date.date() if isinstance(new_date, datetime.datetime) else new_date
+            session.flush()
+            price_history.rebuild_price_stats(session, user_id=observation.user_id, item_id=observation.item_id)
+        
         session.commit()
+        # 月をまたぐ変更は差分集計で追えないため予測キャッシュを破棄
+        _invalidate_forecasts(purchase.shopping_list_item.shopping_list.user_id)
+        _mark_user_write(purchase.shopping_list_item.shopping_list.user_id)
         return True
     except Exception as e:
         logger.error(f"購入日付更新エラー: {e}")
         session.rollback()
         return False
 
-def get_latest_planned_price(user_id: int, item_id: int) -> Optional[float]:
+def get_latest_planned_price(user_id: int, item_id: int) -> Optional[int]:
     """指定ユーザー・商品IDの直近のplanned_priceを取得"""
     session = get_db_session()
     try:
@@ -1099,12 +1930,224 @@ def get_latest_planned_price(user_id: int, item_id: int) -> Optional[float]:
             .order_by(ShoppingListItem.created_at.desc())
             .first()
         )
-        if item and item.planned_price is not None:
-            return float(item.planned_price)
+        if item:
+            return item.planned_price
+        return None
+    except Exception as e:
+        logger.error(f"直近予定金額取得エラー: {e}")
         return None
+
+def get_latest_planned_prices(user_id: int, item_ids: List[int]) -> Dict[int, int]:
+    """
+    複数の商品について、そのユーザーのリストで直近に設定した予定金額（0円より大きいもの）を1回のクエリで取得
+
+    Returns:
+        dict: 商品ID → 予定金額（予定金額を設定したことがない商品は含まない）
+    """
+    if not item_ids:
+        return {}
+    session = get_db_session()
+    try:
+        return checkout.latest_planned_prices(session, user_id, item_ids)
     except Exception as e:
         logger.error(f"直近予定金額取得エラー: {e}")
+        return {}
+
+def get_spending_forecast(user_id: int, dimension: str = 'category') -> Dict[str, Any]:
+    """翌月のカテゴリ別（dimension='store' で店舗別）支出予測を取得（購入バージョンが変わるまではキャッシュを返す）"""
+    key = (user_id, 'forecast', dimension, datetime.date.today(), _purchase_version(user_id))
+    with _analytics_cache_lock:
+        cached = _analytics_cache.get(key)
+    if cached is not None:
+        return cached
+    session = get_read_session(user_id)
+    try:
+        from . import forecast
+        result = forecast.get_spending_forecast(session, user_id, dimension)
+        with _analytics_cache_lock:
+            _analytics_cache[key] = result
+        return result
+    except Exception as e:
+        logger.error(f"支出予測エラー: {e}")
+        return {"target_month": None, "total": 0.0, "history_months": 0, "forecasts": []}
+
+def suggest_items(user_id: int, draft_item_ids: List[int], k: int = 10) -> List[Dict[str, Any]]:
+    """作成中のリストの商品と一緒によく買う商品・よく買う商品のおすすめを取得"""
+    session = get_db_session()
+    try:
+        return recommendations.suggest_items(session, user_id, draft_item_ids, k)
+    except Exception as e:
+        logger.error(f"おすすめ商品取得エラー: {e}")
+        return []
+
+def import_purchases(user_id: int, file, fmt: Optional[str] = None, encoding: str = 'utf-8-sig') -> Optional[Dict[str, Any]]:
+    """
+    CSV/JSONファイルの購入（日付・店舗・商品名・価格・数量）を一括で取り込む
+
+    Args:
+        user_id (int): ユーザーID
+        file: ファイルパスまたはファイルオブジェクト
+        fmt (str, optional): 'csv' または 'json'（省略時は拡張子から判定）
+        encoding (str): 文字コード
+
+    Returns:
+        dict: {"imported", "duplicates", "error_count", "errors", "stores_created", "items_created", "lists_created"}
+    """
+    session = get_db_session()
+    try:
+        from . import purchase_import
+        result = purchase_import.import_purchases(
+            session, user_id, purchase_import.read_purchase_file(file, fmt, encoding=encoding), on_recorded=_on_purchases_recorded
+        )
+        session.commit()
+        return result
+    except Exception as e:
+        logger.error(f"購入取り込みエラー: {e}")
+        session.rollback()
+        return None
+
+# データのエクスポート・インポート
+def export_user_data(user_id: int, path: str, fmt: str = 'parquet') -> Optional[Dict[str, int]]:
+    """ユーザーのデータをバンドル（ディレクトリまたは.zip）に書き出す（fmt は 'parquet' または 'csv'）"""
+    try:
+        from . import data_transfer
+        with get_engine().connect() as conn:
+            return data_transfer.export_user_data(conn, user_id, path, fmt)
+    except Exception as e:
+        logger.error(f"データエクスポートエラー: {e}")
+        return None
+
+def import_user_data(user_id: int, path: str) -> Optional[Dict[str, int]]:
+    """バンドルのデータをユーザーのデータとして1トランザクションで取り込む"""
+    try:
+        from . import data_transfer
+        with get_engine().begin() as conn:
+            counts = data_transfer.import_user_data(conn, user_id, path)
+        _invalidate_forecasts(user_id)
+        _mark_user_write(user_id)
+        return counts
+    except Exception as e:
+        logger.error(f"データインポートエラー: {e}")
+        return None
+
+def archive_old_lists(user_id: Optional[int] = None, older_than_days: Optional[int] = None) -> Optional[Dict[str, int]]:
+    """
+    古い買い物リストをアイテム・購入履歴ごとアーカイブ用のテーブルへ移す
+
+    Args:
+        user_id (int, optional): 対象ユーザー（省略時は全ユーザー）
+        older_than_days (int, optional): この日数より前の日付のリストが対象（省略時は ARCHIVE_AFTER_DAYS）
+
+    Returns:
+        dict: テーブル名 → 移した行数（エラー時は None）
+    """
+    days = archive.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    try:
+        with get_engine().connect() as conn:
+            # 一定件数ごとにコミットし、書き込みロックを長く持たない
+            counts = archive.archive_old_lists(conn, archive.archive_cutoff(days=days), user_id, on_batch=conn.commit)
+        if counts["shopping_lists"]:
+            # 月次の支出はサマリーから読むようになるため作り直す
+            _invalidate_forecasts(user_id)
+            _mark_user_write(user_id)
+        return counts
+    except Exception as e:
+        logger.error(f"買い物リストのアーカイブエラー: {e}")
+        return None
+
+# 予算関連の関数
+def get_list_budget_status(shopping_list_id: int) -> Optional[Dict[str, Any]]:
+    """
+    買い物リストの予算状況を取得
+
+    Returns:
+        dict: {"budget", "planned_total", "spent_total", "remaining", "over_budget", "planned_over_budget"}
+    """
+    session = get_db_session()
+    try:
+        return budgets.get_list_budget_status(session, shopping_list_id)
+    except Exception as e:
+        logger.error(f"リスト予算取得エラー: {e}")
+        return None
+
+def get_monthly_budget_status(user_id: int, month: Optional[datetime.date] = None) -> Optional[Dict[str, Any]]:
+    """月（省略時は今月）の予算状況を取得"""
+    session = get_db_session()
+    try:
+        return budgets.get_monthly_budget_status(session, user_id, month or datetime.date.today())
+    except Exception as e:
+        logger.error(f"月予算取得エラー: {e}")
+        return None
+
+def set_list_budget(shopping_list_id: int, budget: Optional[float]) -> bool:
+    """買い物リストの予算を設定（None で解除）"""
+    session = get_db_session()
+    try:
+        budgets.set_list_budget(session, shopping_list_id, budget)
+        session.commit()
+        session.expire_all()
+        return True
+    except Exception as e:
+        logger.error(f"リスト予算設定エラー: {e}")
+        session.rollback()
+        return False
+
+def set_monthly_budget(user_id: int, month: datetime.date, budget: Optional[float]) -> bool:
+    """月の予算を設定（None で解除）"""
+    session = get_db_session()
+    try:
+        budgets.set_monthly_budget(session, user_id, month, budget)
+        session.commit()
+        return True
+    except Exception as e:
+        logger.error(f"月予算設定エラー: {e}")
+        session.rollback()
+        return False
+
+# 価格履歴関連の関数
+def get_price_history(user_id: int, item_id: int, store_id: Optional[int] = None, limit: int = 50) -> List[PriceObservation]:
+    """
+    商品の価格履歴を取得する（(user, item, store, date) インデックスによる1回の読み取り）
+
+    Returns:
+        list: 直近 limit 件の価格観測（日付の古い順。recorded_date, price, store_name を持つ）
+    """
+    session = get_db_session()
+    try:
+        query = session.query(PriceObservation)\
+            .filter(PriceObservation.user_id == user_id)\
+            .filter(PriceObservation.item_id == item_id)
+        if store_id:
+            query = query.filter(PriceObservation.store_id == store_id)
+        observations = query.order_by(PriceObservation.recorded_date.desc(), PriceObservation.id.desc())\
+            .limit(limit)\
+            .all()
+        return list(reversed(observations))
+    except Exception as e:
+        logger.error(f"価格履歴取得エラー: {e}")
+        return []
+
+def get_item_price_stats(user_id: int, item_id: int, store_id: Optional[int] = None) -> Optional[ItemPriceStat]:
+    """
+    商品の価格統計を取得する
+
+    店舗を指定しない場合は観測数が最も多い店舗の統計を返す。
+    """
+    session = get_db_session()
+    try:
+        query = session.query(ItemPriceStat)\
+            .filter(ItemPriceStat.user_id == user_id)\
+            .filter(ItemPriceStat.item_id == item_id)
+        if store_id:
+            return query.filter(ItemPriceStat.store_id == store_id).first()
+        return query.order_by(ItemPriceStat.observation_count.desc(), ItemPriceStat.last_date.desc()).first()
+    except Exception as e:
+        logger.error(f"価格統計取得エラー: {e}")
         return None
 
-# データベース初期化を実行
-init_db()
\ No newline at end of file
+def get_usual_price(user_id: int, item_id: int, store_id: Optional[int] = None) -> Optional[int]:
+    """「いつもの価格」（直近の購入価格の中央値）を取得"""
+    stat = get_item_price_stats(user_id, item_id, store_id)
+    if stat and stat.median_price is not None:
+        return stat.median_price
+    return None
@@ -0,0 +1,243 @@
+"""
+支出予測エンジン
+
+カテゴリ別・店舗別の月次支出（直近 HISTORY_MONTHS か月）から、翌月の支出を予測する。
+全系列（カテゴリ・店舗）の線形トレンドと季節成分を NumPy でまとめて当てはめ、
+当てはめ結果はユーザーごとにプロセス内でキャッシュする。新しい購入は購入IDの
+ウォーターマーク以降だけを集計して月次行列に加算するため、再計算は差分のみで済む。
+アーカイブ済みの購入は月次行列の作成時に支出サマリーから加える。
+"""
+import datetime
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select, func, literal
+
+from .models import Purchase, ShoppingListItem, ShoppingList, Item, Category, Store, ArchivedSpendingSummary
+from .sql_utils import dialect_name
+
+logger = logging.getLogger(__name__)
+
+# 当てはめに使う完了済みの月数
+HISTORY_MONTHS = 24
+# 季節成分を推定するのに必要な月数（2周期分）
+MIN_MONTHS_FOR_SEASONALITY = 24
+
+# (user_id, dimension) → 月次行列と当てはめ結果
+_cache: Dict[Tuple[int, str], Dict[str, Any]] = {}
+_cache_lock = threading.Lock()
+
+def _add_months(month: datetime.date, n: int) -> datetime.date:
+    """月初の日付に n か月を加算"""
+    index = month.year * 12 + (month.month - 1) + n
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+def _month_expression(session, column):
+    """日時カラムを 'YYYY-MM' 文字列にするSQL式（DBごとに関数が異なる）"""
+    if dialect_name(session) == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+def _fetch_monthly_totals(session, user_id: int, dimension: str, start: datetime.date, end: datetime.date,
+                          after_purchase_id: int = 0) -> List[Any]:
+    """期間内の月×カテゴリ（または店舗）ごとの支出合計と最大購入IDを1クエリで取得"""
+    month = _month_expression(session, Purchase.purchased_at).label('month')
+    if dimension == 'store':
+        key = func.coalesce(Store.name, '未設定').label('key')
+    else:
+        key = func.coalesce(Category.name, '未分類').label('key')
+
+    query = select(
+        month,
+        key,
+        func.sum(Purchase.actual_price * Purchase.quantity).label('total'),
+        func.max(Purchase.id).label('max_id')
+    ).select_from(Purchase).join(
+        ShoppingListItem, Purchase.shopping_list_item_id == ShoppingListItem.id
+    ).join(
+        ShoppingList, ShoppingListItem.shopping_list_id == ShoppingList.id
+    )
+    if dimension == 'store':
+        query = query.outerjoin(Store, ShoppingListItem.store_id == Store.id)
+    else:
+        query = query.outerjoin(Item, ShoppingListItem.item_id == Item.id)\
+            .outerjoin(Category, Item.category_id == Category.id)
+
+    query = query.where(
+        ShoppingList.user_id == user_id,
+        Purchase.purchased_at >= datetime.datetime.combine(start, datetime.time.min),
+        Purchase.purchased_at < datetime.datetime.combine(end, datetime.time.min),
+        Purchase.id > after_purchase_id
+    ).group_by(month, key)
+    return session.execute(query).all()
+
+def _fetch_archived_monthly_totals(session, user_id: int, dimension: str,
+                                  start: datetime.date, end: datetime.date) -> List[Any]:
+    """アーカイブ済みの支出サマリーから期間内の月×カテゴリ（または店舗）ごとの合計を取得"""
+    summaries = ArchivedSpendingSummary.__table__
+    month = _month_expression(session, summaries.c.day).label('month')
+    key = (summaries.c.store_name if dimension == 'store' else summaries.c.category_name).label('key')
+    query = select(
+        month,
+        key,
+        func.sum(summaries.c.total).label('total'),
+        literal(0).label('max_id')  # 購入IDのウォーターマークには影響させない
+    ).where(
+        summaries.c.user_id == user_id,
+        summaries.c.day >= start,
+        summaries.c.day < end
+    ).group_by(month, key)
+    return session.execute(query).all()
+
+def fit_models(matrix: np.ndarray, first_month: datetime.date) -> Dict[str, np.ndarray]:
+    """
+    全系列に線形トレンド＋季節成分をまとめて当てはめる
+
+    Args:
+        matrix: (系列数, 月数) の月次支出
+        first_month: 先頭列の月（月初の日付）
+
+    Returns:
+        dict: {"intercept", "slope", "seasonal"(系列数, 12), "n_months"}
+    """
+    n_series, n_months = matrix.shape
+    t = np.arange(n_months, dtype=float)
+    if n_months >= 2:
+        t_centered = t - t.mean()
+        y_mean = matrix.mean(axis=1)
+        slope = (matrix - y_mean[:, None]) @ t_centered / (t_centered @ t_centered)
+        intercept = y_mean - slope * t.mean()
+    else:
+        slope = np.zeros(n_series)
+        intercept = matrix.mean(axis=1) if n_months else np.zeros(n_series)
+
+    seasonal = np.zeros((n_series, 12))
+    if n_months >= MIN_MONTHS_FOR_SEASONALITY:
+        residuals = matrix - (intercept[:, None] + slope[:, None] * t)
+        calendar_months = (first_month.month - 1 + np.arange(n_months)) % 12
+        counts = np.bincount(calendar_months, minlength=12)
+        for axis_month in range(12):
+            if counts[axis_month]:
+                seasonal[:, axis_month] = residuals[:, calendar_months == axis_month].mean(axis=1)
+        # 季節成分は平均0に正規化
+        seasonal -= seasonal.mean(axis=1, keepdims=True)
+
+    return {"intercept": intercept, "slope": slope, "seasonal": seasonal, "n_months": n_months}
+
+def predict(params: Dict[str, np.ndarray], first_month: datetime.date, target_month: datetime.date) -> np.ndarray:
+    """当てはめ結果から target_month の支出を系列ごとに予測（負の値は0）"""
+    t = (target_month.year - first_month.year) * 12 + (target_month.month - first_month.month)
+    values = params["intercept"] + params["slope"] * t + params["seasonal"][:, target_month.month - 1]
+    return np.clip(values, 0, None)
+
+def _build_entry(session, user_id: int, dimension: str, first_month: datetime.date, end_month: datetime.date) -> Dict[str, Any]:
+    """月次行列を全件集計から作成"""
+    rows = _fetch_monthly_totals(session, user_id, dimension, first_month, end_month)
+    rows += _fetch_archived_monthly_totals(session, user_id, dimension, first_month, end_month)
+    entry = {
+        "first_month": first_month,
+        "end_month": end_month,
+        "keys": [],
+        "matrix": np.zeros((0, HISTORY_MONTHS)),
+        "watermark": 0,
+        "params": None,
+    }
+    _merge_rows(entry, rows)
+    return entry
+
+def _merge_rows(entry: Dict[str, Any], rows: List[Any]) -> None:
+    """集計行を月次行列に加算し、ウォーターマークを進める"""
+    if not rows:
+        return
+    key_index = {key: i for i, key in enumerate(entry["keys"])}
+    new_keys = [row.key for row in rows if row.key not in key_index]
+    for key in dict.fromkeys(new_keys):
+        key_index[key] = len(entry["keys"])
+        entry["keys"].append(key)
+    if len(entry["keys"]) > entry["matrix"].shape[0]:
+        padding = np.zeros((len(entry["keys"]) - entry["matrix"].shape[0], entry["matrix"].shape[1]))
+        entry["matrix"] = np.vstack([entry["matrix"], padding])
+
+    first = entry["first_month"]
+    rows_idx = np.array([key_index[row.key] for row in rows], dtype=np.intp)
+    cols_idx = np.array([
+        (int(row.month[:4]) - first.year) * 12 + (int(row.month[5:7]) - first.month) for row in rows
+    ], dtype=np.intp)
+    np.add.at(entry["matrix"], (rows_idx, cols_idx), np.array([int(row.total or 0) for row in rows], dtype=np.int64))
+    entry["watermark"] = max(entry["watermark"], max(row.max_id for row in rows))
+    entry["params"] = None
+
+def invalidate_forecast_cache(user_id: Optional[int] = None) -> None:
+    """購入日の変更や削除など、差分集計で追えない変更があった場合にキャッシュを破棄"""
+    with _cache_lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            for key in [key for key in _cache if key[0] == user_id]:
+                del _cache[key]
+
+def get_spending_forecast(session, user_id: int, dimension: str = 'category',
+                          today: Optional[datetime.date] = None) -> Dict[str, Any]:
+    """
+    翌月のカテゴリ別（または店舗別）支出を予測する
+
+    Args:
+        session: SQLAlchemyセッション
+        user_id (int): ユーザーID
+        dimension (str): 'category' または 'store'
+        today (date, optional): 基準日（テスト用）
+
+    Returns:
+        dict: {"target_month": 予測対象の月, "total": 予測合計, "history_months": 当てはめに使った月数,
+               "forecasts": [{"key", "forecast", "last_month", "average"}]（予測額の降順）}
+    """
+    today = today or datetime.date.today()
+    end_month = today.replace(day=1)  # 当月は途中なので当てはめに含めない
+    first_month = _add_months(end_month, -HISTORY_MONTHS)
+    target_month = _add_months(end_month, 1)
+    cache_key = (user_id, dimension)
+
+    with _cache_lock:
+        entry = _cache.get(cache_key)
+    if entry is None or entry["end_month"] != end_month:
+        entry = _build_entry(session, user_id, dimension, first_month, end_month)
+    else:
+        # 前回以降に追加された購入だけを集計して加算（他スレッドと共有中の行列は書き換えない）
+        rows = _fetch_monthly_totals(session, user_id, dimension, first_month, end_month, entry["watermark"])
+        if rows:
+            entry = {**entry, "keys": list(entry["keys"]), "matrix": entry["matrix"].copy()}
+            _merge_rows(entry, rows)
+
+    matrix = entry["matrix"]
+    # 最初に支出があった月より前は当てはめに使わない
+    active_months = np.flatnonzero(matrix.sum(axis=0) > 0)
+    start = int(active_months[0]) if active_months.size else matrix.shape[1]
+    fit_first_month = _add_months(first_month, start)
+    if entry["params"] is None:
+        entry["params"] = fit_models(matrix[:, start:], fit_first_month)
+    with _cache_lock:
+        _cache[cache_key] = entry
+
+    if not entry["keys"] or entry["params"]["n_months"] == 0:
+        return {"target_month": target_month, "total": 0.0, "history_months": 0, "forecasts": []}
+
+    values = predict(entry["params"], fit_first_month, target_month)
+    history = matrix[:, start:]
+    forecasts = [
+        {
+            "key": key,
+            "forecast": float(value),
+            "last_month": float(history[i, -1]),
+            "average": float(history[i].mean()),
+        }
+        for i, (key, value) in enumerate(zip(entry["keys"], values))
+    ]
+    forecasts.sort(key=lambda f: f["forecast"], reverse=True)
+    return {
+        "target_month": target_month,
+        "total": float(values.sum()),
+        "history_months": entry["params"]["n_months"],
+        "forecasts": forecasts,
+    }
@@ -0,0 +1,112 @@
+"""
+データエディタ（st.data_editor）の編集結果とDBの同期
+
+表示時のDataFrameをIDをインデックスにしたスナップショットとして持ち、編集後のDataFrameと
+列ごとにまとめて比較して、変更されたセルだけを {ID: {フィールド名: 値}} の変更セットにする。
+変更セットは1トランザクションで反映し、同じフィールドの組の更新は1回の executemany にまとめる。
+"""
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Mapping
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, update, bindparam
+
+from .models import ShoppingListItem
+from . import budgets
+
+logger = logging.getLogger(__name__)
+
+# データエディタから変更できるリストアイテムのフィールド
+EDITABLE_FIELDS = ('quantity', 'planned_date')
+
+def snapshot(df: pd.DataFrame, id_column: str) -> pd.DataFrame:
+    """表示するDataFrameをIDをインデックスにしたスナップショットにする"""
+    return df.set_index(id_column, drop=False)
+
+def _to_python(value) -> Any:
+    """NumPy・pandasのスカラーをPythonの値に変換"""
+    if isinstance(value, pd.Timestamp):
+        return value.date()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def diff_grid(before: pd.DataFrame, edited: pd.DataFrame, columns: Mapping[str, str],
+              id_column: str) -> Dict[int, Dict[str, Any]]:
+    """
+    スナップショットと編集後のDataFrameを比較し、変更されたセルの変更セットを返す
+
+    空にされたセル（NaN・NaT・None）は変更として扱わない。
+
+    Args:
+        before (DataFrame): snapshot() で作ったスナップショット
+        edited (DataFrame): st.data_editor が返したDataFrame
+        columns (dict): 比較する列名 → 変更セットでのフィールド名
+        id_column (str): 行のIDの列名
+
+    Returns:
+        dict: {ID: {フィールド名: 新しい値}}（変更のない行は含まない）
+    """
+    names = list(columns)
+    old = before[names]
+    new = edited.set_index(id_column)[names].reindex(old.index)
+    changed = (old.ne(new) & new.notna()).to_numpy()
+    rows, cols = np.nonzero(changed)
+
+    changes: Dict[int, Dict[str, Any]] = defaultdict(dict)
+    values = new.to_numpy()
+    for row, col in zip(rows, cols):
+        changes[_to_python(old.index[row])][columns[names[col]]] = _to_python(values[row, col])
+    return dict(changes)
+
+def apply_list_item_changes(session, changes: Dict[int, Dict[str, Any]]) -> int:
+    """
+    リストアイテムの変更セットを反映し、予定金額の累計も差分だけ更新する（コミットは呼び出し側）
+
+    Args:
+        session: SQLAlchemyセッション
+        changes (dict): {リストアイテムID: {フィールド名: 値}}（フィールドは EDITABLE_FIELDS のみ）
+
+    Returns:
+        int: 更新した行数
+    """
+    for fields in changes.values():
+        unknown = set(fields) - set(EDITABLE_FIELDS)
+        if unknown:
+            raise ValueError(f"変更できないフィールドです: {sorted(unknown)}")
+    if not changes:
+        return 0
+
+    list_items = ShoppingListItem.__table__
+    current = {
+        row.id: row for row in session.execute(
+            select(list_items.c.id, list_items.c.shopping_list_id, list_items.c.planned_price, list_items.c.quantity)
+            .where(list_items.c.id.in_(list(changes)))
+        )
+    }
+
+    # 同じフィールドの組ごとに1回の executemany で更新
+    by_fields = defaultdict(list)
+    planned = defaultdict(int)
+    for item_id, fields in changes.items():
+        row = current.get(item_id)
+        if row is None:
+            continue
+        if 'quantity' in fields:
+            fields = {**fields, 'quantity': int(fields['quantity'])}
+            price = row.planned_price or 0
+            planned[row.shopping_list_id] += price * (fields['quantity'] - (row.quantity or 0))
+        by_fields[tuple(sorted(fields))].append(
+            {"list_item_id": item_id, **{f"new_{field}": value for field, value in fields.items()}}
+        )
+
+    for fields, params in by_fields.items():
+        session.execute(
+            update(list_items).where(list_items.c.id == bindparam("list_item_id"))
+            .values({field: bindparam(f"new_{field}") for field in fields}),
+            params
+        )
+    budgets.add_planned_many(session, planned)
+    return sum(len(params) for params in by_fields.values())
@@ -1,11 +1,23 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Date, Text, Numeric, Table, MetaData
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Date, Text, Table, MetaData, Index, text
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
+from typing import Optional
 import datetime
+import unicodedata
 import uuid
 
+from .money import Yen
+
 Base = declarative_base()
 
+def normalize_store_name(name: Optional[str]) -> str:
+    """店舗名を比較用に正規化する（NFKC・全角/半角・大文字/小文字・空白の揺れを吸収）"""
+    if not name:
+        return ""
+    normalized = unicodedata.normalize("NFKC", name).casefold()
+    # 連続する空白（全角スペースはNFKCで半角になる）を1つにまとめる
+    return " ".join(normalized.split())
+
 class User(Base):
     """ユーザー情報モデル"""
     __tablename__ = 'users'
@@ -25,9 +37,17 @@ class User(Base):
 class Store(Base):
     """店舗モデル"""
     __tablename__ = 'stores'
+    __table_args__ = (
+        # 同一ユーザー内で正規化後の店舗名は一意
+        Index('uq_stores_user_normalized_name', 'user_id', 'normalized_name', unique=True),
+        # 一意インデックスではNULL同士は重複とみなされないため、共有店舗（user_idがNULL）は部分インデックスで一意にする
+        Index('uq_stores_shared_normalized_name', 'normalized_name', unique=True,
+              sqlite_where=text('user_id IS NULL'), postgresql_where=text('user_id IS NULL')),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
+    normalized_name = Column(String)
     category = Column(String)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -36,6 +56,12 @@ class Store(Base):
     user = relationship("User", back_populates="stores")
     shopping_list_items = relationship("ShoppingListItem", back_populates="store")
 
+    @validates('name')
+    def _sync_normalized_name(self, key, value):
+        """店舗名の設定時に正規化名も更新する"""
+        self.normalized_name = normalize_store_name(value)
+        return value
+
 class Category(Base):
     """カテゴリモデル"""
     __tablename__ = 'categories'
@@ -58,7 +84,7 @@ class Item(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
-    default_price = Column(Numeric)
+    default_price = Column(Yen)
     category_id = Column(Integer, ForeignKey('categories.id'))
     user_id = Column(Integer, ForeignKey('users.id'))
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -71,6 +97,9 @@ class Item(Base):
 class ShoppingList(Base):
     """買い物リストモデル"""
     __tablename__ = 'shopping_lists'
+    __table_args__ = (
+        Index('ix_shopping_lists_user_id_date', 'user_id', 'date'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -78,6 +107,9 @@ class ShoppingList(Base):
     name = Column(String, default="買い物リスト")  # 名前フィールドを追加
     memo = Column(Text)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    budget = Column(Yen)  # リストの予算（未設定はNULL）
+    planned_total = Column(Yen, nullable=False, default=0)  # 予定金額の合計（アイテム変更時に差分で更新）
+    spent_total = Column(Yen, nullable=False, default=0)  # 購入金額の合計（購入記録時に差分で更新）
 
     # リレーションシップ
     user = relationship("User", back_populates="shopping_lists")
@@ -86,12 +118,16 @@ class ShoppingList(Base):
 class ShoppingListItem(Base):
     """買い物リスト内アイテムモデル"""
     __tablename__ = 'shopping_list_items'
+    __table_args__ = (
+        # 商品ごとの直近の予定金額を、並べ替えずに新しい順で読む
+        Index('ix_shopping_list_items_item_id_created_at', 'item_id', text('created_at DESC'), text('id DESC')),
+    )
 
     id = Column(Integer, primary_key=True)
-    shopping_list_id = Column(Integer, ForeignKey('shopping_lists.id'), nullable=False)
+    shopping_list_id = Column(Integer, ForeignKey('shopping_lists.id'), nullable=False, index=True)
     item_id = Column(Integer, ForeignKey('items.id'))
     store_id = Column(Integer, ForeignKey('stores.id'))
-    planned_price = Column(Numeric)
+    planned_price = Column(Yen)
     checked = Column(Boolean, default=False)
     quantity = Column(Integer, default=1)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -106,12 +142,167 @@ class ShoppingListItem(Base):
 class Purchase(Base):
     """購入履歴モデル"""
     __tablename__ = 'purchases'
+    __table_args__ = (
+        # ファイルから取り込んだ購入の重複防止
+        Index('uq_purchases_import_hash', 'import_hash', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
-    shopping_list_item_id = Column(Integer, ForeignKey('shopping_list_items.id'), nullable=False)
-    actual_price = Column(Numeric, nullable=False)
+    shopping_list_item_id = Column(Integer, ForeignKey('shopping_list_items.id'), nullable=False, index=True)
+    actual_price = Column(Yen, nullable=False)
     quantity = Column(Integer, nullable=False)
     purchased_at = Column(DateTime, default=datetime.datetime.utcnow)
+    import_hash = Column(String)  # 取り込み元の行の内容のハッシュ（画面から記録した購入はNULL）
 
     # リレーションシップ
-    shopping_list_item = relationship("ShoppingListItem", back_populates="purchases")
\ No newline at end of file
+    shopping_list_item = relationship("ShoppingListItem", back_populates="purchases")
+
+class PriceObservation(Base):
+    """価格観測モデル（購入ごとの単価を商品・店舗・日付で記録）"""
+    __tablename__ = 'price_observations'
+    __table_args__ = (
+        Index('ix_price_observations_user_item_store_date', 'user_id', 'item_id', 'store_id', 'recorded_date'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    store_id = Column(Integer, ForeignKey('stores.id'))
+    store_name = Column(String)  # 表示用に記録時点の店舗名を保持
+    purchase_id = Column(Integer, unique=True)  # 元の購入履歴（購入削除後も価格履歴は残すため外部キーにしない）
+    price = Column(Yen, nullable=False)
+    quantity = Column(Integer, default=1)
+    recorded_date = Column(Date, nullable=False, default=datetime.date.today)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class ItemPriceStat(Base):
+    """商品・店舗ごとの価格統計モデル（価格観測の追加時に更新される集計値）"""
+    __tablename__ = 'item_price_stats'
+    __table_args__ = (
+        Index('uq_item_price_stats_user_item_store', 'user_id', 'item_id', 'store_id', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    store_id = Column(Integer, ForeignKey('stores.id'))
+    last_price = Column(Yen)
+    last_date = Column(Date)
+    min_price = Column(Yen)
+    max_price = Column(Yen)
+    observation_count = Column(Integer, default=0)
+    median_price = Column(Yen)  # 直近の観測値（recent_prices）の中央値
+    recent_prices = Column(Text)  # 直近の観測値 [[日付, 価格], ...] のJSON（日付昇順）
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class MonthlyBudget(Base):
+    """月ごとの予算と支出の集計モデル（予定はリストの日付、支出は購入日の月に計上）"""
+    __tablename__ = 'monthly_budgets'
+    __table_args__ = (
+        Index('uq_monthly_budgets_user_month', 'user_id', 'month', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    month = Column(Date, nullable=False)  # 月初の日付
+    budget = Column(Yen)  # 月の予算（未設定はNULL）
+    planned_total = Column(Yen, nullable=False, default=0)
+    spent_total = Column(Yen, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class ItemUsageStat(Base):
+    """ユーザーごとの商品の利用頻度・最終利用日時（リスト追加・購入時に更新される集計値）"""
+    __tablename__ = 'item_usage_stats'
+    __table_args__ = (
+        Index('uq_item_usage_stats_user_item', 'user_id', 'item_id', unique=True),
+        Index('ix_item_usage_stats_user_list_count', 'user_id', 'list_count'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    list_count = Column(Integer, nullable=False, default=0)  # この商品を含むリストの数
+    purchase_count = Column(Integer, nullable=False, default=0)
+    last_added_at = Column(DateTime)
+    last_purchased_at = Column(DateTime)
+
+class ItemCooccurrence(Base):
+    """同じリストに入った商品の組の回数（疎な共起行列。両方向の行を保持）"""
+    __tablename__ = 'item_cooccurrences'
+    __table_args__ = (
+        Index('uq_item_cooccurrences_user_item_other', 'user_id', 'item_id', 'other_item_id', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    other_item_id = Column(Integer, ForeignKey('items.id'), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+class SchemaVersion(Base):
+    """DBスキーマのバージョン（起動時はこの1行だけを読んでマイグレーションの要否を判定）"""
+    __tablename__ = 'schema_version'
+
+    id = Column(Integer, primary_key=True)  # 常に1
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+# アーカイブ用テーブル（古い買い物リストを元のIDのまま移す）
+# 商品・店舗の統合や削除で移した行の更新・削除が妨げられないよう外部キーは張らない
+class ArchivedShoppingList(Base):
+    """アーカイブ済みの買い物リスト（shopping_lists と同じカラム）"""
+    __tablename__ = 'archived_shopping_lists'
+    __table_args__ = (
+        Index('ix_archived_shopping_lists_user_id_date', 'user_id', 'date'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    date = Column(Date)
+    name = Column(String)
+    memo = Column(Text)
+    created_at = Column(DateTime)
+    budget = Column(Yen)
+    planned_total = Column(Yen, nullable=False, default=0)
+    spent_total = Column(Yen, nullable=False, default=0)
+    archived_at = Column(DateTime)
+
+class ArchivedShoppingListItem(Base):
+    """アーカイブ済みのリストアイテム（shopping_list_items と同じカラム）"""
+    __tablename__ = 'archived_shopping_list_items'
+
+    id = Column(Integer, primary_key=True)
+    shopping_list_id = Column(Integer, nullable=False, index=True)
+    item_id = Column(Integer)
+    store_id = Column(Integer)
+    planned_price = Column(Yen)
+    checked = Column(Boolean, default=False)
+    quantity = Column(Integer, default=1)
+    created_at = Column(DateTime)
+    planned_date = Column(Date)
+
+class ArchivedPurchase(Base):
+    """アーカイブ済みの購入履歴（purchases と同じカラム）"""
+    __tablename__ = 'archived_purchases'
+
+    id = Column(Integer, primary_key=True)
+    shopping_list_item_id = Column(Integer, nullable=False, index=True)
+    actual_price = Column(Yen, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    purchased_at = Column(DateTime)
+    import_hash = Column(String, index=True)  # 取り込み済みの行の重複判定にも使う
+
+class ArchivedSpendingSummary(Base):
+    """アーカイブ済みの購入の日×カテゴリ×店舗ごとの支出合計（名前はアーカイブ時点のもの）"""
+    __tablename__ = 'archived_spending_summaries'
+    __table_args__ = (
+        Index('uq_archived_spending_summaries_user_day_category_store', 'user_id', 'day', 'category_name', 'store_name', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    day = Column(Date, nullable=False)  # 購入日
+    category_name = Column(String, nullable=False)  # 未分類は '未分類'
+    store_name = Column(String, nullable=False)  # 店舗なしは '未設定'
+    total = Column(Yen, nullable=False, default=0)
+    purchase_count = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,35 @@
+"""
+金額の表現（円単位の整数）
+
+金額は円単位の整数で保存・集計する（円に補助単位はないため1円が最小単位）。
+DBの金額カラムは Yen 型（BIGINT）で、書き込み時に float・Decimal・文字列を1円単位に丸める。
+読み出した値・SUM の結果は int のまま使えるため、行ごとの Decimal → float 変換は不要。
+Python側で行を合計する場合は yen_total を使う（円単位の整数なので丸め誤差は出ない）。
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from numbers import Integral
+from typing import Iterable, Optional
+
+from sqlalchemy import BigInteger
+from sqlalchemy.types import TypeDecorator
+
+def to_yen(value) -> Optional[int]:
+    """金額を円単位の整数に丸める（0.5円は切り上げ。None はそのまま）"""
+    if value is None:
+        return None
+    # NumPy の整数型も numbers.Integral として扱える（ログイン画面などで NumPy を読み込まない）
+    if isinstance(value, Integral):
+        return int(value)
+    return int(Decimal(str(value)).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def yen_total(prices: Iterable, quantities: Iterable) -> int:
+    """単価×数量の合計（価格未設定は0円）"""
+    return sum(int(price or 0) * int(quantity or 0) for price, quantity in zip(prices, quantities))
+
+class Yen(TypeDecorator):
+    """円単位の整数で保存する金額カラムの型"""
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return to_yen(value)
@@ -0,0 +1,277 @@
+"""
+DB接続プールの監視と、トランザクションを開いたまま放置されたセッションの回収
+
+st.session_state に保持したセッションは、読み取り後もトランザクションを開いたまま接続を持ち続ける。
+利用者が増えるとプールが枯渇し、接続の取得待ちで画面が固まるため、次の3つを行う。
+
+- 監視: 使用中の接続数・オーバーフローの使用数・接続の取得待ち時間・最も長く保持されている接続を記録する
+- 取得のタイムアウト: POOL_TIMEOUT_SECONDS 待っても取得できなければ、プールの状態を含む PoolExhaustedError を送出する
+- 回収: 一定時間SQLを実行していないトランザクションをロールバックし、接続をプールに返す
+
+Session はスレッドセーフではないため、回収スレッドは別のスレッドが使っているかもしれないセッションには触れない。
+セッションを使うスレッドは取得のたびに claim_session で自分を所有者として登録し、回収スレッドは所有者のスレッドが
+終了している（再実行の合間で誰も使っていない）ときだけ、同じロックを持ったままロールバックする。
+所有者のスレッドが動いている場合は回収を要求する印だけを付け、所有者が次の claim_session で自分でロールバックする。
+"""
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+# 回収処理を実行する間隔（秒）
+REAP_INTERVAL_SECONDS = 30
+
+class PoolExhaustedError(exc.TimeoutError):
+    """接続プールから時間内に接続を取得できなかった"""
+
+class PoolMonitor:
+    """1つの接続プールの利用状況（プールを作り直しても引き継ぐ）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        # 接続の記録のID → (取得した時刻, 取得したスレッド名)
+        self._held: Dict[int, tuple] = {}
+        # 接続を持っているセッション（回収の対象）
+        self.sessions: "weakref.WeakSet[Session]" = weakref.WeakSet()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.reaped = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_last = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += seconds
+            self.wait_last = seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        with self._lock:
+            self._held[id(connection_record)] = (time.monotonic(), threading.current_thread().name)
+
+    def on_checkin(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            self._held.pop(id(connection_record), None)
+
+    def longest_held(self) -> tuple:
+        """最も長く保持されている接続の (保持秒数, 取得したスレッド名)（なければ (0.0, None)）"""
+        with self._lock:
+            if not self._held:
+                return 0.0, None
+            since, thread_name = min(self._held.values())
+        return time.monotonic() - since, thread_name
+
+class MonitoredQueuePool(QueuePool):
+    """取得待ち時間を記録し、タイムアウト時にプールの状態を含むエラーを送出する QueuePool"""
+    monitor: Optional[PoolMonitor] = None
+
+    def connect(self):
+        started = time.monotonic()
+        try:
+            connection = super().connect()
+        except PoolExhaustedError:
+            raise
+        except exc.TimeoutError as e:
+            if self.monitor:
+                self.monitor.record_timeout()
+            status = pool_status(self)
+            raise PoolExhaustedError(
+                f"DB接続プールが枯渇しています（使用中 {status['checked_out']}/{status['capacity']}、"
+                f"最長保持 {status['longest_held_seconds']:.0f}秒）。{self.timeout():.0f}秒待っても接続を取得できませんでした"
+            ) from e
+        if self.monitor:
+            self.monitor.record_wait(time.monotonic() - started)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.monitor = self.monitor
+        return pool
+
+def attach(engine, name: str) -> Optional[PoolMonitor]:
+    """エンジンのプールに監視を付ける（MonitoredQueuePool 以外のプールでは何もしない）"""
+    if not isinstance(engine.pool, MonitoredQueuePool):
+        return None
+    monitor = PoolMonitor(name)
+    engine.pool.monitor = monitor
+    # プールのイベントは engine.dispose() で作り直したプールにも引き継がれる
+    event.listen(engine, "checkout", monitor.on_checkout)
+    event.listen(engine, "checkin", monitor.on_checkin)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    _install_session_tracking()
+    return monitor
+
+def pool_status(pool) -> Dict[str, Any]:
+    """プールの利用状況"""
+    monitor = getattr(pool, 'monitor', None)
+    longest_seconds, longest_thread = monitor.longest_held() if monitor else (0.0, None)
+    checkouts = monitor.checkouts if monitor else 0
+    return {
+        "pool_size": pool.size(),
+        "capacity": pool.size() + max(pool._max_overflow, 0),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        # overflow() は未使用分を負の値で表す
+        "overflow_in_use": max(pool.overflow(), 0),
+        "max_overflow": pool._max_overflow,
+        "timeout_seconds": pool.timeout(),
+        "checkouts": checkouts,
+        "wait_last_ms": round(monitor.wait_last * 1000, 2) if monitor else 0.0,
+        "wait_avg_ms": round(monitor.wait_total / checkouts * 1000, 2) if checkouts else 0.0,
+        "wait_max_ms": round(monitor.wait_max * 1000, 2) if monitor else 0.0,
+        "timeouts": monitor.timeouts if monitor else 0,
+        "longest_held_seconds": round(longest_seconds, 1),
+        "longest_held_thread": longest_thread,
+        "open_sessions": sum(1 for session in list(monitor.sessions) if session.in_transaction()) if monitor else 0,
+        "reaped": monitor.reaped if monitor else 0,
+    }
+
+# 接続ごとの最終実行時刻（Connection.info は接続の記録ごとに保持される）
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['executing'] = True
+    conn.info['last_used'] = time.monotonic()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['executing'] = False
+    conn.info['last_used'] = time.monotonic()
+
+def _handle_error(context):
+    if context.connection is not None:
+        context.connection.info['executing'] = False
+
+_session_tracking_installed = False
+
+def _install_session_tracking() -> None:
+    """トランザクションを開始したセッションを、その接続のプールの監視に登録する（一度だけ）"""
+    global _session_tracking_installed
+    if _session_tracking_installed:
+        return
+    event.listen(Session, "after_begin", _after_begin)
+    _session_tracking_installed = True
+
+def _after_begin(session, transaction, connection):
+    monitor = getattr(connection.engine.pool, 'monitor', None)
+    if monitor is None:
+        return
+    connection.info.setdefault('last_used', time.monotonic())
+    session.info.setdefault('pool_connections', weakref.WeakKeyDictionary())[connection] = True
+    monitor.sessions.add(session)
+
+def _owner_lock(session: Session) -> threading.Lock:
+    # dict.setdefault はアトミックなため、同時に呼ばれても同じロックを返す
+    return session.info.setdefault('owner_lock', threading.Lock())
+
+def claim_session(session: Session) -> Session:
+    """
+    セッションを使うスレッドが取得のたびに呼び、自分を所有者として登録する
+
+    回収スレッドから回収を要求されていれば、ここで自分でロールバックして接続をプールに返す。
+    """
+    with _owner_lock(session):
+        session.info['owner'] = threading.current_thread()
+        if session.info.pop('reap_requested', False):
+            try:
+                session.rollback()
+            except Exception as e:
+                logger.error(f"アイドルセッションのロールバックエラー: {e}")
+            session.info.pop('pool_connections', None)
+    return session
+
+def reap_idle_sessions(monitor: PoolMonitor, max_idle_seconds: float) -> int:
+    """
+    max_idle_seconds 以上SQLを実行していないトランザクションを持つセッションを回収し、接続をプールに返す
+
+    所有者のスレッドが終了しているセッションはその場でロールバックし、動いているスレッドのセッションは
+    回収を要求する印を付けて、所有者の次の claim_session でロールバックさせる（Session を別スレッドから操作しない）。
+    ロールバックするだけでセッションは閉じないため、保持しているオブジェクトは次の利用時に読み直される。
+
+    Returns:
+        int: 回収した（または回収を要求した）セッション数
+    """
+    now = time.monotonic()
+    reaped = 0
+    for session in list(monitor.sessions):
+        lock = _owner_lock(session)
+        if not lock.acquire(blocking=False):
+            # 所有者が取得中（これから使う）
+            continue
+        try:
+            connections = list(session.info.get('pool_connections', {}))
+            if not session.in_transaction() or not connections:
+                monitor.sessions.discard(session)
+                continue
+            try:
+                infos = [connection.info for connection in connections if not connection.closed]
+            except exc.ResourceClosedError:
+                # 確認した直後に所有者が接続を閉じた（次の回で判定し直す）
+                continue
+            if not infos or any(info.get('executing') for info in infos):
+                continue
+            idle = now - max(info.get('last_used', now) for info in infos)
+            if idle < max_idle_seconds:
+                continue
+            owner = session.info.get('owner')
+            # 要求済みのセッションは、所有者のスレッドが終了していればここで回収する（件数は要求時に数えた）
+            requested = session.info.get('reap_requested', False)
+            if owner is None or owner.is_alive():
+                if not requested:
+                    session.info['reap_requested'] = True
+                    reaped += 1
+                    logger.warning(f"{idle:.0f}秒間トランザクションを開いたままのセッションに回収を要求しました（{monitor.name}）")
+            else:
+                session.rollback()
+                session.info.pop('reap_requested', None)
+                session.info.pop('pool_connections', None)
+                monitor.sessions.discard(session)
+                if not requested:
+                    reaped += 1
+                logger.warning(f"{idle:.0f}秒間トランザクションを開いたままのセッションをロールバックし、接続を返却しました（{monitor.name}）")
+        except Exception as e:
+            # 1つのセッションの失敗で残りのセッションの回収を止めない
+            logger.error(f"アイドルセッションの回収エラー: {e}")
+        finally:
+            lock.release()
+    if reaped:
+        with monitor._lock:
+            monitor.reaped += reaped
+    return reaped
+
+_reaper_thread: Optional[threading.Thread] = None
+_reaper_lock = threading.Lock()
+
+def start_reaper(get_monitors, max_idle_seconds: float, interval: float = REAP_INTERVAL_SECONDS) -> None:
+    """監視中のプールのアイドルセッションを定期的に回収するスレッドを開始する（一度だけ。max_idle_seconds が0以下なら何もしない）"""
+    global _reaper_thread
+    if max_idle_seconds <= 0:
+        return
+    with _reaper_lock:
+        if _reaper_thread is not None and _reaper_thread.is_alive():
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                for monitor in get_monitors():
+                    try:
+                        reap_idle_sessions(monitor, max_idle_seconds)
+                    except Exception as e:
+                        logger.error(f"アイドルセッションの回収エラー: {e}")
+
+        _reaper_thread = threading.Thread(target=run, name="db-session-reaper", daemon=True)
+        _reaper_thread.start()
@@ -0,0 +1,227 @@
+"""
+価格観測（購入ごとの単価）の記録と、商品・店舗ごとの価格統計の維持
+
+価格統計（最終価格・最安値・最高値・件数・直近の中央値）は観測の追加時に
+該当行だけを更新するため、価格履歴や「いつもの価格」の参照はインデックス経由の1回の読み取りで済む。
+"""
+import datetime
+import json
+import logging
+from itertools import groupby
+from statistics import median
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select, insert, delete, exists, func
+
+from .models import PriceObservation, ItemPriceStat, Purchase, ShoppingListItem, ShoppingList, Store
+from .money import to_yen
+
+logger = logging.getLogger(__name__)
+
+# 中央値の計算に使う直近の観測数
+RECENT_WINDOW = 10
+# 観測から計算する価格統計のカラム
+_STAT_COLUMNS = ('user_id', 'item_id', 'store_id', 'last_price', 'last_date', 'min_price', 'max_price',
+                 'observation_count', 'median_price', 'recent_prices')
+
+def _to_date(value) -> datetime.date:
+    """日時・日付・ISO形式文字列を date に変換"""
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+def _apply_observation(stat, recorded_date: datetime.date, price) -> None:
+    """1件の観測値を統計に反映する（直近ウィンドウ分の計算のみ）"""
+    price = to_yen(price)
+    recent = json.loads(stat.recent_prices) if stat.recent_prices else []
+    recent.append([recorded_date.isoformat(), price])
+    # 日付順を維持（同日の観測は記録順）し、直近分だけを保持
+    recent.sort(key=lambda entry: entry[0])
+    recent = recent[-RECENT_WINDOW:]
+
+    stat.recent_prices = json.dumps(recent)
+    stat.median_price = to_yen(median(p for _, p in recent))
+    stat.observation_count = (stat.observation_count or 0) + 1
+    stat.min_price = price if stat.min_price is None else min(stat.min_price, price)
+    stat.max_price = price if stat.max_price is None else max(stat.max_price, price)
+    if stat.last_date is None or recorded_date >= stat.last_date:
+        stat.last_date = recorded_date
+        stat.last_price = price
+
+def record_price_observations(session, records: Iterable[Dict[str, Any]]) -> int:
+    """
+    購入記録から価格観測を追加し、該当する価格統計を更新する（コミットは呼び出し側）
+
+    Args:
+        session: SQLAlchemyセッション
+        records: {"purchase_id", "user_id", "item_id", "store_id", "store_name", "price", "quantity", "purchased_at"} のリスト
+
+    Returns:
+        int: 追加した観測数
+    """
+    records = [r for r in records if r.get("item_id") is not None]
+    if not records:
+        return 0
+
+    # ORMのエンティティへのINSERTはNoneの値のキーを省き、キーの組が変わるたびに文を分けるため、テーブルに対して1回で実行する
+    session.execute(insert(PriceObservation.__table__), [
+        {
+            "user_id": r["user_id"],
+            "item_id": r["item_id"],
+            "store_id": r.get("store_id"),
+            "store_name": r.get("store_name"),
+            "purchase_id": r.get("purchase_id"),
+            "price": r["price"],
+            "quantity": r.get("quantity") or 1,
+            "recorded_date": _to_date(r["purchased_at"]),
+        }
+        for r in records
+    ])
+
+    # 対象ユーザー・商品の統計行をまとめて取得
+    # （autoflush無効のセッションでも、同じトランザクションで先に追加した統計行が読めるようにする）
+    session.flush()
+    user_ids = {r["user_id"] for r in records}
+    item_ids = {r["item_id"] for r in records}
+    stats = {
+        (stat.user_id, stat.item_id, stat.store_id): stat
+        for stat in session.query(ItemPriceStat).filter(
+            ItemPriceStat.user_id.in_(user_ids),
+            ItemPriceStat.item_id.in_(item_ids)
+        )
+    }
+
+    new_stats = []
+    for r in records:
+        key = (r["user_id"], r["item_id"], r.get("store_id"))
+        stat = stats.get(key)
+        if stat is None:
+            stat = ItemPriceStat(user_id=key[0], item_id=key[1], store_id=key[2], observation_count=0)
+            new_stats.append(stat)
+            stats[key] = stat
+        _apply_observation(stat, _to_date(r["purchased_at"]), r["price"])
+
+    # 新しい統計行は1行ずつのフラッシュではなく、まとめて1回で追加する（既存の行はセッションの変更として更新）
+    if new_stats:
+        session.execute(insert(ItemPriceStat.__table__), [
+            {column: getattr(stat, column) for column in _STAT_COLUMNS}
+            for stat in new_stats
+        ])
+
+    return len(records)
+
+def rebuild_price_stats(executor, user_id: Optional[int] = None, item_id: Optional[int] = None,
+                        store_ids: Optional[List[int]] = None) -> int:
+    """
+    価格観測から価格統計を作り直す（バックフィル・日付修正・店舗統合時に使用）
+
+    Args:
+        executor: SQLAlchemyのConnectionまたはSession
+        user_id (int, optional): 対象ユーザー
+        item_id (int, optional): 対象商品
+        store_ids (list, optional): 対象店舗ID
+
+    Returns:
+        int: 作成した統計行の数
+    """
+    stats_table = ItemPriceStat.__table__
+    observations = PriceObservation.__table__
+
+    def conditions(table):
+        clauses = []
+        if user_id is not None:
+            clauses.append(table.c.user_id == user_id)
+        if item_id is not None:
+            clauses.append(table.c.item_id == item_id)
+        if store_ids is not None:
+            clauses.append(table.c.store_id.in_(store_ids))
+        return clauses
+
+    executor.execute(delete(stats_table).where(*conditions(stats_table)))
+
+    rows = executor.execute(
+        select(
+            observations.c.user_id,
+            observations.c.item_id,
+            observations.c.store_id,
+            observations.c.recorded_date,
+            observations.c.price
+        ).where(
+            *conditions(observations)
+        ).order_by(
+            observations.c.user_id,
+            observations.c.item_id,
+            observations.c.store_id,
+            observations.c.recorded_date,
+            observations.c.id
+        )
+    )
+
+    new_stats = []
+    for key, group in groupby(rows, key=lambda row: (row.user_id, row.item_id, row.store_id)):
+        stat = SimpleNamespace(
+            user_id=key[0], item_id=key[1], store_id=key[2],
+            last_price=None, last_date=None, min_price=None, max_price=None,
+            observation_count=0, median_price=None, recent_prices=None
+        )
+        for row in group:
+            _apply_observation(stat, _to_date(row.recorded_date), row.price)
+        new_stats.append(vars(stat))
+
+    if new_stats:
+        executor.execute(insert(stats_table), new_stats)
+    return len(new_stats)
+
+def backfill_price_observations(executor, user_id: Optional[int] = None) -> int:
+    """
+    既存の購入履歴のうち価格観測が未作成のものを一括で取り込み、価格統計を作り直す
+
+    Args:
+        executor: SQLAlchemyのConnectionまたはSession
+        user_id (int, optional): 対象ユーザー（省略時は全ユーザー）
+
+    Returns:
+        int: 取り込んだ観測数
+    """
+    purchases = Purchase.__table__
+    list_items = ShoppingListItem.__table__
+    lists = ShoppingList.__table__
+    stores = Store.__table__
+    observations = PriceObservation.__table__
+
+    already_recorded = exists().where(observations.c.purchase_id == purchases.c.id)
+    source = select(
+        lists.c.user_id,
+        list_items.c.item_id,
+        list_items.c.store_id,
+        stores.c.name,
+        purchases.c.id,
+        purchases.c.actual_price,
+        purchases.c.quantity,
+        func.date(purchases.c.purchased_at),
+        func.current_timestamp()
+    ).select_from(
+        purchases
+        .join(list_items, purchases.c.shopping_list_item_id == list_items.c.id)
+        .join(lists, list_items.c.shopping_list_id == lists.c.id)
+        .outerjoin(stores, list_items.c.store_id == stores.c.id)
+    ).where(
+        list_items.c.item_id.isnot(None),
+        ~already_recorded,
+        *([lists.c.user_id == user_id] if user_id is not None else [])
+    )
+
+    result = executor.execute(
+        insert(observations).from_select(
+            ["user_id", "item_id", "store_id", "store_name", "purchase_id", "price", "quantity", "recorded_date", "created_at"],
+            source
+        )
+    )
+    count = result.rowcount or 0
+    if count:
+        rebuild_price_stats(executor, user_id=user_id)
+        logger.info(f"既存の購入履歴から価格観測を{count}件取り込みました")
+    return count
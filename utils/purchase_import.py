@@ -0,0 +1,338 @@
+"""
+レシート・CSV/JSONファイルからの購入の一括取り込み
+
+ファイル（日付・店舗・商品名・価格・数量）を CHUNK_SIZE 行ずつ読み、チャンクごとに
+1. 行を検証して内容のハッシュを計算し、取り込み済みのハッシュを除く
+2. 店舗名・商品名をメモリ上の対応表でIDに変換し、未登録のものはまとめて作成
+3. 購入日ごとの取り込み用リスト・リストアイテム・購入を複数行INSERTで作成
+する。同じファイルを再度取り込んでもハッシュが一致する行は追加されない。
+"""
+import csv
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import logging
+import math
+import os
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, insert, or_, union
+
+from .models import Store, Item, ShoppingList, ShoppingListItem, Purchase, ArchivedPurchase, normalize_store_name
+from .money import to_yen
+from . import budgets
+from . import recommendations
+
+logger = logging.getLogger(__name__)
+
+# 1回に処理する行数
+CHUNK_SIZE = 2000
+# 結果に含めるエラー行の最大件数
+MAX_ERRORS = 100
+# 取り込んだ購入をまとめる買い物リストの名前（購入日ごとに1つ）
+IMPORT_LIST_NAME = "購入の取り込み"
+
+# 列名の別名（ヘッダーは大文字・小文字と前後の空白を無視して照合）
+COLUMN_ALIASES = {
+    "date": ("date", "purchased_at", "日付", "購入日"),
+    "store": ("store", "store_name", "店舗", "店舗名", "店名"),
+    "item": ("item", "item_name", "name", "商品", "商品名", "品名"),
+    "price": ("price", "actual_price", "unit_price", "価格", "単価", "金額"),
+    "quantity": ("quantity", "qty", "数量", "個数"),
+}
+_ALIAS_TO_FIELD = {alias.casefold(): field for field, aliases in COLUMN_ALIASES.items() for alias in aliases}
+
+_DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d")
+
+def _parse_datetime(value) -> datetime.datetime:
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time.min)
+    text = str(value or "").strip().replace("/", "-")
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"日付を解釈できません: {value!r}")
+
+def _parse_price(value) -> int:
+    text = str(value if value is not None else "").strip()
+    for symbol in ("¥", "￥", "円", ",", " "):
+        text = text.replace(symbol, "")
+    if not text:
+        raise ValueError("価格がありません")
+    price = float(text)
+    if not math.isfinite(price):
+        raise ValueError(f"価格が不正です: {value!r}")
+    price = to_yen(price)
+    if price < 0:
+        raise ValueError(f"価格が負の値です: {value!r}")
+    return price
+
+def _parse_quantity(value) -> int:
+    if value is None or str(value).strip() == "":
+        return 1
+    quantity = int(float(str(value).strip()))
+    if quantity <= 0:
+        raise ValueError(f"数量が不正です: {value!r}")
+    return quantity
+
+def parse_row(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    列名を正規化した1行を検証して取り込み用の値に変換する
+
+    Raises:
+        ValueError: 必須項目がない・値を解釈できない場合
+    """
+    item = str(raw.get("item") or "").strip()
+    if not item:
+        raise ValueError("商品名がありません")
+    return {
+        "purchased_at": _parse_datetime(raw.get("date")),
+        "store": str(raw.get("store") or "").strip(),
+        "item": item,
+        "price": _parse_price(raw.get("price")),
+        "quantity": _parse_quantity(raw.get("quantity")),
+    }
+
+def _normalize_keys(record: Dict[str, Any]) -> Dict[str, Any]:
+    """別名の列名を date / store / item / price / quantity にそろえる"""
+    return {_ALIAS_TO_FIELD[key.strip().casefold()]: value for key, value in record.items()
+            if key and key.strip().casefold() in _ALIAS_TO_FIELD}
+
+def _records(f, fmt: str) -> Iterator[Dict[str, Any]]:
+    """ファイルから1行ずつ列名を正規化したレコードを読み出す"""
+    if fmt == "csv":
+        yield from (_normalize_keys(row) for row in csv.DictReader(f))
+        return
+    # JSON配列は標準ライブラリでは逐次読みできないため全体を読む。JSON Lines は1行ずつ読む
+    first = f.readline()
+    if first.lstrip().startswith("["):
+        for record in json.loads(first + f.read()):
+            yield _normalize_keys(record)
+        return
+    for line in itertools.chain([first], f):
+        if line.strip():
+            yield _normalize_keys(json.loads(line))
+
+def read_purchase_file(file, fmt: Optional[str] = None, chunk_size: int = CHUNK_SIZE,
+                       encoding: str = "utf-8-sig") -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+    """
+    購入ファイルを chunk_size 行ずつ (行番号, レコード) のリストとして読み出す
+
+    Args:
+        file: ファイルパス、またはバイナリ・テキストのファイルオブジェクト
+        fmt (str, optional): 'csv' または 'json'（JSON配列・JSON Lines）。省略時は拡張子から判定
+        chunk_size (int): 1チャンクの行数
+        encoding (str): 文字コード（ExcelのCSVは 'cp932' の場合がある）
+    """
+    name = file if isinstance(file, str) else getattr(file, "name", "")
+    if fmt is None:
+        fmt = "json" if os.path.splitext(str(name))[1].lower() in (".json", ".jsonl") else "csv"
+    if isinstance(file, str):
+        f = open(file, encoding=encoding, newline="")
+    elif isinstance(file, io.TextIOBase):
+        f = file
+    else:
+        f = io.TextIOWrapper(file, encoding=encoding, newline="")
+    try:
+        # CSVはヘッダーが1行目なのでデータは2行目から
+        numbered = enumerate(_records(f, fmt), start=2 if fmt == "csv" else 1)
+        while True:
+            chunk = list(itertools.islice(numbered, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if isinstance(file, str):
+            f.close()
+        elif f is not file:
+            f.detach()  # 呼び出し元のファイルは閉じない
+
+def content_hash(user_id: int, row: Dict[str, Any], occurrence: int) -> str:
+    """行の内容のハッシュ（同じファイル内で同じ内容の行は occurrence で区別する）"""
+    key = "\x1f".join([
+        str(user_id),
+        row["purchased_at"].isoformat(),
+        normalize_store_name(row["store"]),
+        row["item"],
+        f"{row['price']:.2f}",
+        str(row["quantity"]),
+        str(occurrence),
+    ])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def _insert_returning_ids(session, table, rows: List[Dict[str, Any]]) -> List[int]:
+    """複数行INSERTで作成し、行の順に新しいIDを返す"""
+    if not rows:
+        return []
+    result = session.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows)
+    return list(result.scalars())
+
+class _Lookups:
+    """店舗名・商品名・購入日 → ID の対応表（ユーザーの既存データで初期化し、作成した分を追加）"""
+
+    def __init__(self, session, user_id: int):
+        self.session = session
+        self.user_id = user_id
+        self.stores: Dict[str, Tuple[int, str]] = {}
+        # 共有データを先に読み、同名のユーザーのデータで上書きする
+        for row in session.execute(
+            select(Store.id, Store.name, Store.normalized_name).where(or_(Store.user_id == user_id, Store.user_id.is_(None)))
+            .order_by(Store.user_id.is_not(None), Store.id)
+        ):
+            self.stores[row.normalized_name] = (row.id, row.name)
+        self.items: Dict[str, int] = {}
+        for row in session.execute(
+            select(Item.id, Item.name).where(or_(Item.user_id == user_id, Item.user_id.is_(None)))
+            .order_by(Item.user_id.is_not(None), Item.id)
+        ):
+            self.items[row.name] = row.id
+        self.lists: Dict[datetime.date, int] = {}
+        self.created = {"stores": 0, "items": 0, "lists": 0}
+
+    def resolve_stores(self, names: Iterable[str]) -> None:
+        new = {}
+        for name in names:
+            normalized = normalize_store_name(name)
+            if normalized and normalized not in self.stores:
+                new.setdefault(normalized, name)
+        now = datetime.datetime.utcnow()
+        rows = [{"name": name, "normalized_name": normalized, "user_id": self.user_id, "created_at": now}
+                for normalized, name in new.items()]
+        for row, new_id in zip(rows, _insert_returning_ids(self.session, Store.__table__, rows)):
+            self.stores[row["normalized_name"]] = (new_id, row["name"])
+        self.created["stores"] += len(rows)
+
+    def resolve_items(self, names: Iterable[str]) -> None:
+        now = datetime.datetime.utcnow()
+        rows = [{"name": name, "user_id": self.user_id, "created_at": now}
+                for name in dict.fromkeys(names) if name not in self.items]
+        for row, new_id in zip(rows, _insert_returning_ids(self.session, Item.__table__, rows)):
+            self.items[row["name"]] = new_id
+        self.created["items"] += len(rows)
+
+    def resolve_lists(self, dates: Iterable[datetime.date]) -> None:
+        missing = set(dates) - set(self.lists)
+        if not missing:
+            return
+        for row in self.session.execute(
+            select(ShoppingList.id, ShoppingList.date).where(
+                ShoppingList.user_id == self.user_id,
+                ShoppingList.name == IMPORT_LIST_NAME,
+                ShoppingList.date.in_(missing)
+            ).order_by(ShoppingList.id)
+        ):
+            self.lists.setdefault(row.date, row.id)
+        now = datetime.datetime.utcnow()
+        rows = [{"user_id": self.user_id, "date": date, "name": IMPORT_LIST_NAME, "created_at": now,
+                 "planned_total": 0, "spent_total": 0} for date in sorted(missing - set(self.lists))]
+        for row, new_id in zip(rows, _insert_returning_ids(self.session, ShoppingList.__table__, rows)):
+            self.lists[row["date"]] = new_id
+        self.created["lists"] += len(rows)
+
+    def store(self, name: str) -> Tuple[Optional[int], Optional[str]]:
+        return self.stores.get(normalize_store_name(name), (None, None))
+
+def import_purchases(session, user_id: int, chunks: Iterable[List[Tuple[int, Dict[str, Any]]]],
+                     on_recorded: Optional[Callable[[Any, List[Dict[str, Any]]], None]] = None) -> Dict[str, Any]:
+    """
+    読み出した購入行をチャンクごとにまとめて取り込む（コミットは呼び出し側）
+
+    Args:
+        session: SQLAlchemyセッション
+        user_id (int): ユーザーID
+        chunks: read_purchase_file の戻り値
+        on_recorded: 作成した購入の記録（purchase_id, user_id, shopping_list_id, item_id, store_id,
+            store_name, price, quantity, purchased_at）を受け取って派生データを更新する関数
+
+    Returns:
+        dict: {"imported", "duplicates", "error_count", "errors"[{"line", "message"}],
+               "stores_created", "items_created", "lists_created"}
+    """
+    lookups = _Lookups(session, user_id)
+    occurrences: Dict[str, int] = defaultdict(int)
+    summary = {"imported": 0, "duplicates": 0, "error_count": 0, "errors": []}
+
+    for chunk in chunks:
+        rows = []
+        for line, raw in chunk:
+            try:
+                row = parse_row(raw)
+            except (ValueError, TypeError) as e:
+                summary["error_count"] += 1
+                if len(summary["errors"]) < MAX_ERRORS:
+                    summary["errors"].append({"line": line, "message": str(e)})
+                continue
+            base = content_hash(user_id, row, 0)
+            row["import_hash"] = content_hash(user_id, row, occurrences[base])
+            occurrences[base] += 1
+            rows.append(row)
+
+        # 取り込み済みの行（アーカイブ済みを含む）を除く
+        hashes = [row["import_hash"] for row in rows]
+        existing = set(session.execute(union(
+            select(Purchase.import_hash).where(Purchase.import_hash.in_(hashes)),
+            select(ArchivedPurchase.import_hash).where(ArchivedPurchase.import_hash.in_(hashes))
+        )).scalars()) if hashes else set()
+        summary["duplicates"] += len(existing)
+        rows = [row for row in rows if row["import_hash"] not in existing]
+        if not rows:
+            continue
+
+        lookups.resolve_stores(row["store"] for row in rows)
+        lookups.resolve_items(row["item"] for row in rows)
+        lookups.resolve_lists(row["purchased_at"].date() for row in rows)
+
+        line_rows = []
+        for row in rows:
+            row["store_id"], row["store_name"] = lookups.store(row["store"])
+            row["item_id"] = lookups.items[row["item"]]
+            row["shopping_list_id"] = lookups.lists[row["purchased_at"].date()]
+            line_rows.append({
+                "shopping_list_id": row["shopping_list_id"],
+                "item_id": row["item_id"],
+                "store_id": row["store_id"],
+                "planned_price": row["price"],
+                "quantity": row["quantity"],
+                "checked": True,
+                "created_at": row["purchased_at"],
+            })
+        line_ids = _insert_returning_ids(session, ShoppingListItem.__table__, line_rows)
+        purchase_ids = _insert_returning_ids(session, Purchase.__table__, [{
+            "shopping_list_item_id": line_id,
+            "actual_price": row["price"],
+            "quantity": row["quantity"],
+            "purchased_at": row["purchased_at"],
+            "import_hash": row["import_hash"],
+        } for row, line_id in zip(rows, line_ids)])
+
+        planned_by_list = defaultdict(int)
+        for row in rows:
+            planned_by_list[row["shopping_list_id"]] += row["price"] * row["quantity"]
+        budgets.add_planned_many(session, planned_by_list)
+        if on_recorded is not None:
+            on_recorded(session, [{
+                "purchase_id": purchase_id,
+                "user_id": user_id,
+                "shopping_list_id": row["shopping_list_id"],
+                "item_id": row["item_id"],
+                "store_id": row["store_id"],
+                "store_name": row["store_name"],
+                "price": row["price"],
+                "quantity": row["quantity"],
+                "purchased_at": row["purchased_at"],
+            } for row, purchase_id in zip(rows, purchase_ids)])
+        summary["imported"] += len(rows)
+
+    if summary["imported"]:
+        # リストへの追加回数・共起はリスト単位の集計なので、行ごとに更新せず最後にまとめて作り直す
+        recommendations.rebuild_recommendation_stats(session, user_id)
+    summary.update({f"{key}_created": count for key, count in lookups.created.items()})
+    logger.info(f"ユーザー{user_id}の購入を取り込みました: {summary['imported']}件（重複{summary['duplicates']}件・エラー{summary['error_count']}件）")
+    return summary
@@ -0,0 +1,339 @@
+"""
+「いつもの商品」のおすすめ
+
+ユーザーごとに商品の利用頻度・最終利用日時（item_usage_stats）と、同じリストに入った
+商品の組の回数（item_cooccurrences、疎な共起行列）を持ち、リストへの追加・削除や購入の
+たびに差分だけ更新する。おすすめは作成中のリストの商品の共起行と頻度上位の行を
+インデックス経由で読むだけで計算でき、購入履歴全体は走査しない。
+"""
+import datetime
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import select, update, delete, func, and_, bindparam, case
+
+from .models import ItemUsageStat, ItemCooccurrence, ShoppingList, ShoppingListItem, Purchase, Item
+from .sql_utils import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+# 頻度上位から候補に加える商品数
+POPULAR_CANDIDATES = 50
+# 頻度スコアの重み（共起スコアは1）
+POPULARITY_WEIGHT = 0.3
+# 最終利用からこの日数で頻度スコアが半減する
+RECENCY_HALF_LIFE_DAYS = 30
+
+def _upsert_usage(executor, rows: List[Dict[str, Any]]) -> None:
+    """利用統計に回数を加算し、最終利用日時を更新（行がなければ作成）"""
+    if not rows:
+        return
+    table = ItemUsageStat.__table__
+    stmt = dialect_insert(executor, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'item_id'],
+        set_={
+            "list_count": table.c.list_count + stmt.excluded.list_count,
+            "purchase_count": table.c.purchase_count + stmt.excluded.purchase_count,
+            "last_added_at": func.coalesce(stmt.excluded.last_added_at, table.c.last_added_at),
+            "last_purchased_at": func.coalesce(stmt.excluded.last_purchased_at, table.c.last_purchased_at),
+        }
+    )
+    executor.execute(stmt, [
+        {
+            "user_id": row["user_id"],
+            "item_id": row["item_id"],
+            "list_count": row.get("list_count", 0),
+            "purchase_count": row.get("purchase_count", 0),
+            "last_added_at": row.get("last_added_at"),
+            "last_purchased_at": row.get("last_purchased_at"),
+        }
+        for row in rows
+    ])
+
+def _add_cooccurrences(executor, user_id: int, counts: Dict[tuple, int]) -> None:
+    """共起行列の (item_id, other_item_id) に回数を加算（負の値で減算、0以下の行は削除）"""
+    table = ItemCooccurrence.__table__
+    increments = [
+        {"user_id": user_id, "item_id": a, "other_item_id": b, "count": n}
+        for (a, b), n in counts.items() if n > 0
+    ]
+    if increments:
+        stmt = dialect_insert(executor, table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'item_id', 'other_item_id'],
+            set_={"count": table.c.count + stmt.excluded.count}
+        )
+        executor.execute(stmt, increments)
+
+    decrements = [
+        {"b_user_id": user_id, "b_item_id": a, "b_other_item_id": b, "b_count": -n}
+        for (a, b), n in counts.items() if n < 0
+    ]
+    if decrements:
+        # 組ごとの減算は1回の executemany でまとめて行う
+        executor.execute(
+            update(table)
+            .where(
+                table.c.user_id == bindparam('b_user_id'),
+                table.c.item_id == bindparam('b_item_id'),
+                table.c.other_item_id == bindparam('b_other_item_id')
+            )
+            .values(count=table.c.count - bindparam('b_count')),
+            decrements
+        )
+        executor.execute(delete(table).where(table.c.user_id == user_id, table.c.count <= 0))
+
+def _pair_counts(new_items: Iterable[int], others: Iterable[int], sign: int) -> Dict[tuple, int]:
+    """new_items の各商品と others の各商品の組（両方向）の回数"""
+    counts = defaultdict(int)
+    others = set(others)
+    new_items = set(new_items)
+    for a in new_items:
+        for b in others - {a}:
+            counts[(a, b)] += sign
+            if b not in new_items:
+                # b も new_items に含まれる場合は b 側のループで (b, a) が数えられる
+                counts[(b, a)] += sign
+    return counts
+
+def record_item_added(session, shopping_list_id: int, item_id: int, added_at: Optional[datetime.datetime] = None) -> None:
+    """
+    リストに商品の行を追加する直前に呼び、利用頻度と共起を更新する（コミットは呼び出し側）
+
+    同じ商品がすでにリストにある場合（店舗違いの行など）は最終追加日時のみ更新する。
+    """
+    if item_id is None:
+        return
+    user_id = session.execute(
+        select(ShoppingList.user_id).where(ShoppingList.id == shopping_list_id)
+    ).scalar()
+    if user_id is None:
+        return
+    existing = set(session.execute(
+        select(ShoppingListItem.item_id).where(
+            ShoppingListItem.shopping_list_id == shopping_list_id,
+            ShoppingListItem.item_id.isnot(None)
+        ).distinct()
+    ).scalars())
+
+    added_at = added_at or datetime.datetime.utcnow()
+    is_new = item_id not in existing
+    _upsert_usage(session, [{"user_id": user_id, "item_id": item_id, "list_count": int(is_new), "last_added_at": added_at}])
+    if is_new:
+        _add_cooccurrences(session, user_id, _pair_counts([item_id], existing, 1))
+
+def record_items_removed(session, list_items: List[ShoppingListItem]) -> None:
+    """
+    リストの行を削除する直前に呼び、リストから消える商品の頻度と共起、
+    行とともに削除される購入の回数を差し引く（コミットは呼び出し側）
+    """
+    by_list = defaultdict(set)
+    users = {}
+    for list_item in list_items:
+        by_list[list_item.shopping_list_id].add(list_item.id)
+        users[list_item.shopping_list_id] = list_item.shopping_list.user_id
+
+    usage = ItemUsageStat.__table__
+    deleted_purchases = session.execute(
+        select(ShoppingList.user_id, ShoppingListItem.item_id, func.count(Purchase.id).label('purchase_count'))
+        .join(ShoppingListItem, ShoppingListItem.shopping_list_id == ShoppingList.id)
+        .join(Purchase, Purchase.shopping_list_item_id == ShoppingListItem.id)
+        .where(ShoppingListItem.id.in_([list_item.id for list_item in list_items]), ShoppingListItem.item_id.isnot(None))
+        .group_by(ShoppingList.user_id, ShoppingListItem.item_id)
+    ).all()
+    if deleted_purchases:
+        session.execute(
+            update(usage)
+            .where(usage.c.user_id == bindparam('b_user_id'), usage.c.item_id == bindparam('b_item_id'))
+            .values(purchase_count=case(
+                (usage.c.purchase_count > bindparam('b_count'), usage.c.purchase_count - bindparam('b_count')), else_=0
+            )),
+            [{"b_user_id": row.user_id, "b_item_id": row.item_id, "b_count": row.purchase_count} for row in deleted_purchases]
+        )
+
+    for shopping_list_id, deleted_ids in by_list.items():
+        rows = session.execute(
+            select(ShoppingListItem.id, ShoppingListItem.item_id).where(
+                ShoppingListItem.shopping_list_id == shopping_list_id,
+                ShoppingListItem.item_id.isnot(None)
+            )
+        ).all()
+        before = {row.item_id for row in rows}
+        after = {row.item_id for row in rows if row.id not in deleted_ids}
+        removed = before - after
+        if not removed:
+            continue
+
+        user_id = users[shopping_list_id]
+        session.execute(
+            update(usage)
+            .where(usage.c.user_id == user_id, usage.c.item_id.in_(removed), usage.c.list_count > 0)
+            .values(list_count=usage.c.list_count - 1)
+        )
+        _add_cooccurrences(session, user_id, _pair_counts(removed, before, -1))
+
+def record_purchases(session, records: Iterable[Dict[str, Any]]) -> None:
+    """購入記録から購入回数と最終購入日時を更新する（コミットは呼び出し側）"""
+    totals = {}
+    for r in records:
+        if r.get("item_id") is None:
+            continue
+        key = (r["user_id"], r["item_id"])
+        count, last = totals.get(key, (0, None))
+        purchased_at = r.get("purchased_at")
+        totals[key] = (count + 1, max(filter(None, [last, purchased_at]), default=None))
+    _upsert_usage(session, [
+        {"user_id": user_id, "item_id": item_id, "purchase_count": count, "last_purchased_at": last}
+        for (user_id, item_id), (count, last) in totals.items()
+    ])
+
+def rebuild_recommendation_stats(executor, user_id: Optional[int] = None) -> None:
+    """
+    リストと購入履歴から利用統計と共起行列を作り直す（機能追加前のDBの補完・修復用）
+
+    Args:
+        executor: SQLAlchemyのConnectionまたはSession
+        user_id (int, optional): 対象ユーザー（省略時は全ユーザー）
+    """
+    usage = ItemUsageStat.__table__
+    cooccurrences = ItemCooccurrence.__table__
+    lists = ShoppingList.__table__
+    list_items = ShoppingListItem.__table__
+    purchases = Purchase.__table__
+
+    user_filter = [lists.c.user_id == user_id] if user_id is not None else []
+    executor.execute(delete(usage).where(*([usage.c.user_id == user_id] if user_id is not None else [])))
+    executor.execute(delete(cooccurrences).where(*([cooccurrences.c.user_id == user_id] if user_id is not None else [])))
+
+    lines = list_items.join(lists, list_items.c.shopping_list_id == lists.c.id)
+    added = select(
+        lists.c.user_id,
+        list_items.c.item_id,
+        func.count(func.distinct(list_items.c.shopping_list_id)).label('list_count'),
+        func.max(list_items.c.created_at).label('last_added_at')
+    ).select_from(lines).where(
+        list_items.c.item_id.isnot(None), *user_filter
+    ).group_by(lists.c.user_id, list_items.c.item_id).subquery()
+    bought = select(
+        lists.c.user_id,
+        list_items.c.item_id,
+        func.count(purchases.c.id).label('purchase_count'),
+        func.max(purchases.c.purchased_at).label('last_purchased_at')
+    ).select_from(
+        purchases.join(list_items, purchases.c.shopping_list_item_id == list_items.c.id)
+        .join(lists, list_items.c.shopping_list_id == lists.c.id)
+    ).where(
+        list_items.c.item_id.isnot(None), *user_filter
+    ).group_by(lists.c.user_id, list_items.c.item_id).subquery()
+
+    executor.execute(usage.insert().from_select(
+        ["user_id", "item_id", "list_count", "purchase_count", "last_added_at", "last_purchased_at"],
+        select(
+            added.c.user_id,
+            added.c.item_id,
+            added.c.list_count,
+            func.coalesce(bought.c.purchase_count, 0),
+            added.c.last_added_at,
+            bought.c.last_purchased_at
+        ).select_from(added).outerjoin(
+            bought, and_(bought.c.user_id == added.c.user_id, bought.c.item_id == added.c.item_id)
+        )
+    ))
+
+    # リストごとの商品（重複なし）を自己結合して組を数える
+    pairs = select(
+        lists.c.user_id, list_items.c.shopping_list_id, list_items.c.item_id
+    ).select_from(lines).where(
+        list_items.c.item_id.isnot(None), *user_filter
+    ).distinct().subquery()
+    a, b = pairs.alias('a'), pairs.alias('b')
+    executor.execute(cooccurrences.insert().from_select(
+        ["user_id", "item_id", "other_item_id", "count"],
+        select(a.c.user_id, a.c.item_id, b.c.item_id, func.count()).select_from(a).join(
+            b, and_(a.c.shopping_list_id == b.c.shopping_list_id, a.c.item_id != b.c.item_id)
+        ).group_by(a.c.user_id, a.c.item_id, b.c.item_id)
+    ))
+
+def suggest_items(session, user_id: int, draft_item_ids: Iterable[int], k: int = 10,
+                  now: Optional[datetime.datetime] = None) -> List[Dict[str, Any]]:
+    """
+    作成中のリストに追加する商品のおすすめ上位k件
+
+    Args:
+        session: SQLAlchemyセッション
+        user_id (int): ユーザーID
+        draft_item_ids: 作成中のリストにすでにある商品ID
+        k (int): 件数
+        now (datetime, optional): 基準日時（テスト用）
+
+    Returns:
+        list: [{"item_id", "name", "score", "together_count"}]（スコアの降順）
+    """
+    now = now or datetime.datetime.utcnow()
+    draft = {item_id for item_id in draft_item_ids if item_id is not None}
+
+    # 作成中のリストの商品と一緒に入った商品（共起行列の該当行のみ）
+    together = defaultdict(dict)
+    if draft:
+        for row in session.execute(
+            select(ItemCooccurrence.item_id, ItemCooccurrence.other_item_id, ItemCooccurrence.count)
+            .where(ItemCooccurrence.user_id == user_id, ItemCooccurrence.item_id.in_(draft))
+        ):
+            if row.other_item_id not in draft:
+                together[row.other_item_id][row.item_id] = row.count
+
+    popular = set(session.execute(
+        select(ItemUsageStat.item_id)
+        .where(ItemUsageStat.user_id == user_id, ItemUsageStat.list_count > 0)
+        .order_by(ItemUsageStat.list_count.desc())
+        .limit(POPULAR_CANDIDATES)
+    ).scalars())
+    candidates = (set(together) | popular) - draft
+    if not candidates:
+        return []
+
+    stats = {
+        row.item_id: row
+        for row in session.execute(
+            select(ItemUsageStat).where(
+                ItemUsageStat.user_id == user_id,
+                ItemUsageStat.item_id.in_(candidates | draft)
+            )
+        ).scalars()
+    }
+    max_list_count = max((stats[c].list_count for c in candidates if c in stats), default=0) or 1
+
+    scored = []
+    for candidate in candidates:
+        stat = stats.get(candidate)
+        # 共起スコア: 作成中の各商品が入ったリストのうち、候補も入っていた割合の平均
+        co_score = sum(
+            count / max(stats[d].list_count if d in stats else 0, 1)
+            for d, count in together.get(candidate, {}).items()
+        ) / max(len(draft), 1)
+        popularity = 0.0
+        if stat is not None:
+            last_used = max(filter(None, [stat.last_added_at, stat.last_purchased_at]), default=None)
+            days = (now - last_used).total_seconds() / 86400 if last_used else None
+            recency = 0.5 ** (max(days, 0) / RECENCY_HALF_LIFE_DAYS) if days is not None else 0.0
+            popularity = stat.list_count / max_list_count * recency
+        score = co_score + POPULARITY_WEIGHT * popularity
+        if score > 0:
+            scored.append((score, candidate))
+
+    scored.sort(key=lambda pair: (-pair[0], pair[1]))
+    top = scored[:k]
+    names = dict(session.execute(
+        select(Item.id, Item.name).where(Item.id.in_([item_id for _, item_id in top]))
+    ).all()) if top else {}
+    return [
+        {
+            "item_id": item_id,
+            "name": names.get(item_id, "不明なアイテム"),
+            "score": score,
+            "together_count": sum(together.get(item_id, {}).values()),
+        }
+        for score, item_id in top
+    ]
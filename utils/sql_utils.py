@@ -0,0 +1,15 @@
+"""
+DBの方言に依存するSQL組み立ての共通処理
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+
+def dialect_name(executor) -> str:
+    """SessionまたはConnectionから接続先DBの方言名を取得"""
+    bind = executor.get_bind() if hasattr(executor, 'get_bind') else executor
+    return bind.dialect.name
+
+def dialect_insert(executor, table):
+    """DBに応じた INSERT 文（ON CONFLICT によるアップサートを使うため）"""
+    if dialect_name(executor) == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
@@ -0,0 +1,246 @@
+"""
+買い物リストの最安店舗割り当て
+
+商品×店舗の期待価格行列（価格統計の中央値）に対し、期待合計金額が最小になる店舗割り当てを求める。
+訪問店舗数の上限がある場合は、店舗の組み合わせをまとめて行列演算で評価する
+（組み合わせが多すぎる場合は貪欲法で店舗を追加し、入れ替えで改善する）。
+"""
+import logging
+from collections import Counter
+from itertools import combinations
+from math import comb
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import select
+
+from .models import ShoppingList, ShoppingListItem, ItemPriceStat
+
+logger = logging.getLogger(__name__)
+
+# 全探索する店舗の組み合わせ数の上限（超える場合は貪欲法）
+MAX_EXHAUSTIVE_COMBINATIONS = 20_000
+# 貪欲法の後に行う店舗入れ替えの最大回数
+MAX_SWAP_ROUNDS = 20
+# 一度に評価する組み合わせ数（メモリ使用量の上限）
+COMBINATION_BATCH_SIZE = 4096
+
+def _subset_costs(costs: np.ndarray, penalties: np.ndarray, subsets: np.ndarray) -> np.ndarray:
+    """
+    店舗の組み合わせごとの期待合計金額を計算する
+
+    Args:
+        costs: (商品数, 店舗数) の金額行列（価格不明は inf）
+        penalties: 商品ごとの、選んだ店舗で買えない場合の金額
+        subsets: (組み合わせ数, k) の店舗インデックス
+
+    Returns:
+        np.ndarray: 組み合わせごとの合計金額
+    """
+    best = costs[:, subsets].min(axis=2)  # (商品数, 組み合わせ数)
+    best = np.where(np.isinf(best), penalties[:, None], best)
+    return best.sum(axis=0)
+
+def _take(iterator, n):
+    """イテレータから最大n件を取り出す"""
+    for _, value in zip(range(n), iterator):
+        yield value
+
+def _choose_stores(costs: np.ndarray, penalties: np.ndarray, max_stores: int) -> np.ndarray:
+    """期待合計金額が最小になる max_stores 店舗の組み合わせを選ぶ"""
+    n_stores = costs.shape[1]
+    if comb(n_stores, max_stores) <= MAX_EXHAUSTIVE_COMBINATIONS:
+        best_cost, best_subset = np.inf, None
+        subset_iter = combinations(range(n_stores), max_stores)
+        while True:
+            batch = np.array(list(_take(subset_iter, COMBINATION_BATCH_SIZE)), dtype=np.intp)
+            if batch.size == 0:
+                break
+            totals = _subset_costs(costs, penalties, batch)
+            i = int(np.argmin(totals))
+            if totals[i] < best_cost:
+                best_cost, best_subset = totals[i], batch[i]
+        return best_subset
+
+    # 貪欲法: 合計金額を最も下げる店舗を1つずつ追加
+    chosen: List[int] = []
+    current = penalties.copy()
+    for _ in range(max_stores):
+        candidates = np.minimum(current[:, None], costs).sum(axis=0)
+        candidates[chosen] = np.inf
+        store = int(np.argmin(candidates))
+        chosen.append(store)
+        current = np.minimum(current, costs[:, store])
+
+    # 入れ替え: 選んだ店舗1つを未選択の店舗に替えて下がる限り繰り返す
+    best_total = _subset_costs(costs, penalties, np.array([chosen], dtype=np.intp))[0]
+    for _ in range(MAX_SWAP_ROUNDS):
+        improved = False
+        for position in range(max_stores):
+            others = chosen[:position] + chosen[position + 1:]
+            rest = np.minimum(penalties, costs[:, others].min(axis=1)) if others else penalties
+            totals = np.minimum(rest[:, None], costs).sum(axis=0)
+            totals[chosen] = np.inf
+            store = int(np.argmin(totals))
+            if totals[store] < best_total - 1e-9:
+                chosen[position] = store
+                best_total = totals[store]
+                improved = True
+        if not improved:
+            break
+    return np.array(sorted(chosen), dtype=np.intp)
+
+def optimize_assignment(prices: np.ndarray, quantities: np.ndarray, max_stores: Optional[int] = None) -> Dict[str, Any]:
+    """
+    商品×店舗の価格行列から、期待合計金額が最小の店舗割り当てを求める
+
+    Args:
+        prices: (商品数, 店舗数) の期待単価（不明は NaN）
+        quantities: 商品ごとの数量
+        max_stores: 訪問する店舗数の上限（None は無制限）
+
+    Returns:
+        dict: {"store_indices": 商品ごとの店舗インデックス（価格不明は -1）,
+               "chosen_stores": 使用する店舗インデックス, "expected_total": 期待合計金額}
+    """
+    prices = np.asarray(prices, dtype=float)
+    quantities = np.asarray(quantities, dtype=float)
+    n_items, n_stores = prices.shape
+    store_indices = np.full(n_items, -1, dtype=np.intp)
+    if n_items == 0 or n_stores == 0:
+        return {"store_indices": store_indices, "chosen_stores": np.array([], dtype=np.intp), "expected_total": 0.0}
+
+    costs = np.where(np.isnan(prices), np.inf, prices * quantities[:, None])
+    priced = np.isfinite(costs).any(axis=1)
+    costs = costs[priced]
+    # 選んだ店舗で価格が分からない商品は、既知の最高値で買うものとして評価する
+    penalties = np.where(np.isinf(costs), -np.inf, costs).max(axis=1)
+
+    if max_stores and max_stores < n_stores:
+        chosen = _choose_stores(costs, penalties, max_stores)
+    else:
+        chosen = np.arange(n_stores, dtype=np.intp)
+
+    sub_costs = costs[:, chosen]
+    best = sub_costs.argmin(axis=1)
+    best_costs = sub_costs[np.arange(len(sub_costs)), best]
+    covered = np.isfinite(best_costs)
+
+    priced_indices = np.flatnonzero(priced)
+    store_indices[priced_indices[covered]] = chosen[best[covered]]
+    expected_total = float(np.where(covered, best_costs, penalties).sum())
+
+    used = np.unique(store_indices[store_indices >= 0])
+    return {"store_indices": store_indices, "chosen_stores": used, "expected_total": expected_total}
+
+def suggest_store_assignment(session, shopping_list_id: int, max_stores: Optional[int] = None) -> Dict[str, Any]:
+    """
+    買い物リストの店舗割り当てを価格統計から提案する
+
+    Args:
+        session: SQLAlchemyセッション
+        shopping_list_id (int): 買い物リストID
+        max_stores (int, optional): 訪問する店舗数の上限
+
+    訪問店舗数の上限は、提案どおりに割り当てたあとのリスト全体で訪問する店舗数に対するもの。
+    選んだ店舗で価格が分からない行・価格履歴がない行は、現在の店舗が上限内に収まる場合だけそのままにし、
+    収まらない場合は店舗を未指定（None）に変更して unassigned_item_ids に含める（上限がなければ現在の店舗のまま）。
+
+    期待合計金額は、提案・現在の割り当てのどちらも価格履歴がある行だけを同じく合計する
+    （割り当て先の店舗で価格が分からない行は、その商品の既知の最高値で買うものとして計上する）。
+
+    Returns:
+        dict: {"assignments": {リストアイテムID: 店舗ID（未指定は None）}（変更があるもののみ）,
+               "expected_total": 提案の期待合計金額, "current_total": 現在の割り当ての期待合計金額,
+               "store_ids": 訪問する店舗ID, "unpriced_item_ids": 価格履歴がないリストアイテムID,
+               "unassigned_item_ids": 上限を守るため店舗を未指定にするリストアイテムID}
+    """
+    list_items = session.execute(
+        select(
+            ShoppingListItem.id,
+            ShoppingListItem.item_id,
+            ShoppingListItem.store_id,
+            ShoppingListItem.quantity,
+            ShoppingList.user_id
+        ).join(
+            ShoppingList, ShoppingListItem.shopping_list_id == ShoppingList.id
+        ).where(
+            ShoppingListItem.shopping_list_id == shopping_list_id,
+            ShoppingListItem.item_id.isnot(None)
+        ).order_by(ShoppingListItem.id)
+    ).all()
+    if not list_items:
+        return {"assignments": {}, "expected_total": 0.0, "current_total": 0.0, "store_ids": [],
+                "unpriced_item_ids": [], "unassigned_item_ids": []}
+
+    user_id = list_items[0].user_id
+    item_ids = sorted({row.item_id for row in list_items})
+    stats = session.execute(
+        select(ItemPriceStat.item_id, ItemPriceStat.store_id, ItemPriceStat.median_price)
+        .where(
+            ItemPriceStat.user_id == user_id,
+            ItemPriceStat.item_id.in_(item_ids),
+            ItemPriceStat.store_id.isnot(None),
+            ItemPriceStat.median_price.isnot(None)
+        )
+    ).all()
+
+    store_ids = sorted({row.store_id for row in stats})
+    item_pos = {item_id: i for i, item_id in enumerate(item_ids)}
+    store_pos = {store_id: j for j, store_id in enumerate(store_ids)}
+
+    # 商品×店舗の期待単価行列
+    item_prices = np.full((len(item_ids), len(store_ids)), np.nan)
+    if stats:
+        rows = np.array([item_pos[r.item_id] for r in stats], dtype=np.intp)
+        cols = np.array([store_pos[r.store_id] for r in stats], dtype=np.intp)
+        item_prices[rows, cols] = [r.median_price for r in stats]
+
+    # リストアイテムごとの行列（同じ商品が複数行ある場合も行ごとに割り当てる）
+    line_rows = np.array([item_pos[row.item_id] for row in list_items], dtype=np.intp)
+    prices = item_prices[line_rows]
+    quantities = np.array([row.quantity or 1 for row in list_items], dtype=float)
+    result = optimize_assignment(prices, quantities, max_stores)
+
+    # 現在の割り当ての期待金額（提案と同じく価格履歴がある行を、現在の店舗で価格が分からなければ既知の最高値で計上）
+    priced = ~np.isnan(prices).all(axis=1)
+    current_cols = np.array([store_pos.get(row.store_id, -1) for row in list_items], dtype=np.intp)
+    has_current = current_cols >= 0
+    current_prices = np.full(len(list_items), np.nan)
+    current_prices[has_current] = prices[has_current, current_cols[has_current]]
+    current_prices[priced] = np.where(
+        np.isnan(current_prices[priced]), np.nanmax(prices[priced], axis=1), current_prices[priced]
+    )
+    current_total = float((current_prices[priced] * quantities[priced]).sum())
+
+    assignments = {}
+    leftover = []
+    for row, store_index, is_priced in zip(list_items, result["store_indices"], priced):
+        if store_index < 0:
+            leftover.append((row, is_priced))
+        elif store_ids[store_index] != row.store_id:
+            assignments[row.id] = store_ids[store_index]
+
+    # 割り当てられなかった行の現在の店舗は、上限までは（行数の多い順に）訪問先に残す
+    visited = {store_ids[j] for j in result["chosen_stores"]}
+    extra = Counter(row.store_id for row, _ in leftover if row.store_id is not None and row.store_id not in visited)
+    keep = len(extra) if not max_stores else max(max_stores - len(visited), 0)
+    visited.update(store_id for store_id, _ in extra.most_common(keep))
+
+    unpriced = []
+    unassigned = []
+    for row, is_priced in leftover:
+        if not is_priced:
+            unpriced.append(row.id)
+        if row.store_id is not None and row.store_id not in visited:
+            assignments[row.id] = None
+            unassigned.append(row.id)
+
+    return {
+        "assignments": assignments,
+        "expected_total": result["expected_total"],
+        "current_total": current_total,
+        "store_ids": sorted(visited),
+        "unpriced_item_ids": unpriced,
+        "unassigned_item_ids": unassigned,
+    }
@@ -1,10 +1,10 @@
 import streamlit as st
 from datetime import datetime
 import json
-import jwt
+import time
 # モデルクラスをインポート
 from .models import ShoppingList, Store, ShoppingListItem
-from .db_utils import get_shopping_list_items, get_db_health_check
+from .db_utils import get_db_health_check
 # 循環参照を避けるため、関数を直接インポートせず、必要な時に動的にインポートする
 
 # アプリケーション情報
@@ -12,6 +12,9 @@ APP_VERSION = "1.2.0"
 APP_LAST_UPDATED = "2025年4月20日"
 APP_NAME = "買い物リスト管理アプリ BuyCheck"
 
+# ログイン情報の有効期限がこの秒数以内になったら、ユーザー情報を読み直してトークンを再発行する
+PRINCIPAL_REFRESH_SECONDS = 24 * 60 * 60
+
 # セッション管理
 def init_session_state():
     """セッション状態の初期化"""
@@ -24,16 +27,36 @@ def init_session_state():
     if 'current_store_id' not in st.session_state:
         st.session_state['current_store_id'] = None
     
-    # ページ読み込み時にトークンから認証を確認
-    token = st.session_state.get('user_token')
-    if token:
-        from .db_utils import verify_jwt_token
-        user_id = verify_jwt_token(token)
-        if not user_id:
-            # トークンが無効な場合はログアウト
+    # ログイン時に保持したログイン情報を使い、再実行ごとのトークン検証・DB参照を省く
+    principal = st.session_state.get('principal')
+    if principal is None:
+        token = st.session_state.get('user_token')
+        if token:
+            from .db_utils import load_principal
+            principal = load_principal(token)
+            if principal is None:
+                # トークンが無効な場合はログアウト
+                logout()
+                return
+            set_principal(principal)
+        return
+    
+    # 期限が近い場合だけ読み直す（ユーザー情報を変更する機能はないため、名前などはこのときに反映される）
+    from .db_utils import refresh_principal
+    if principal['expires_at'] - time.time() < PRINCIPAL_REFRESH_SECONDS:
+        principal = refresh_principal(principal['user_id'])
+        if principal is None:
             logout()
-        else:
-            st.session_state['user_id'] = user_id
+            return
+        set_principal(principal)
+
+def set_principal(principal):
+    """ログイン情報をセッションに保持する"""
+    st.session_state['principal'] = principal
+    st.session_state['user_id'] = principal['user_id']
+    st.session_state['user_name'] = principal['name']
+    st.session_state['user_email'] = principal['email']
+    st.session_state['user_token'] = principal['token']
 
 def check_authentication():
     """認証のチェック。未認証ならログイン画面を表示"""
@@ -48,7 +71,7 @@ def logout():
     """ログアウト処理"""
     from .db_utils import logout_user, close_db_session
     logout_user()
-    for key in ['user_id', 'user_name', 'user_email', 'token', 'current_list_id']:
+    for key in ['user_id', 'user_name', 'user_email', 'user_token', 'principal', 'current_list_id']:
         if key in st.session_state:
             del st.session_state[key]
     close_db_session()
@@ -101,10 +124,7 @@ def show_login_screen():
                     from .db_utils import login_user
                     user = login_user(email, password)
                     if user:
-                        st.session_state['user_id'] = user['user_id']
-                        st.session_state['user_name'] = user['name']
-                        st.session_state['user_email'] = user['email']
-                        st.session_state['token'] = user['token']
+                        set_principal(user)
                         st.rerun()
                     else:
                         st.error("メールアドレスまたはパスワードが間違っています")
@@ -277,20 +297,32 @@ def show_price_history(history_items):
         fig = px.line(df, x="日付", y="価格", markers=True, title="価格推移")
         st.plotly_chart(fig, use_container_width=True)
 
-def show_shopping_list_summary(shopping_list):
-    """買い物リストのサマリーを表示（緑色カスタム進捗バー）"""
-    items = get_shopping_list_items(shopping_list.id)
-    total_items = len(items)
-    checked_items = sum(1 for item in items if item.checked)
-    total_price = sum((item.planned_price or 0) * item.quantity for item in items)
+def show_shopping_list_summary(summary):
+    """買い物リストのサマリーを表示（緑色カスタム進捗バー）
+
+    Args:
+        summary (dict): db_utils.get_shopping_list_summaries が返す集計済みのリスト情報
+    """
+    total_items = summary["total_items"]
+    checked_items = summary["checked_items"]
+    total_price = summary["total_price"]
     progress_pct = 0
     if total_items > 0:
         progress_pct = checked_items / total_items
-    st.caption(f"📊 予算: ¥{total_price:,.0f}")
+    budget = summary.get("budget")
+    if budget is not None:
+        spent_total = summary.get("spent_total", 0)
+        st.caption(f"📊 予定: ¥{total_price:,.0f} / 予算: ¥{budget:,.0f}")
+        if spent_total > budget:
+            st.caption(f"⚠️ 支出 ¥{spent_total:,.0f}（予算超過 ¥{spent_total - budget:,.0f}）")
+        else:
+            st.caption(f"💰 残り ¥{budget - spent_total:,.0f}")
+    else:
+        st.caption(f"📊 予定: ¥{total_price:,.0f}")
     # チェック済みアイテム数
     st.caption(f"✓ {checked_items}/{total_items} チェック済み")
     # 購入済みアイテム数
-    purchased_items = sum(1 for item in items if item.purchases and len(item.purchases) > 0)
+    purchased_items = summary["purchased_items"]
     st.caption(f"🛒 {purchased_items}/{total_items} 購入済み")
     # --- カラフルプログレスバー ---
     bar_width = int(progress_pct * 100)
@@ -0,0 +1,392 @@
+"""
+複数のStreamlitワーカーと、セッション固定のローカルリバースプロキシ
+
+Streamlitはセッションの状態をWebSocket接続を受けたプロセスのメモリに持つため、
+同じブラウザからのHTTP（アップロード・メディア）とWebSocketは常に同じワーカーへ送る必要がある。
+プロキシは初回応答でワーカー番号のCookieを発行し、以降はそのワーカーへ振り分ける。
+ワーカーは定期的にヘルスチェックし、終了・応答なしのものは同じポートで再起動する。
+ヘルスチェックに1回失敗しただけのワーカー（CPU負荷で応答が遅いなど）は新しいセッションの振り分け先から外すだけで、
+固定済みのブラウザはプロセスが終了するか MAX_HEALTH_FAILURES 回続けて失敗するまで同じワーカーへ送る。
+TornadoはStreamlitの依存パッケージのため追加のインストールは不要。
+"""
+import asyncio
+import json
+import logging
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from tornado import httpclient, httputil, web, websocket
+from tornado.ioloop import PeriodicCallback
+
+from .port_utils import find_free_port
+
+logger = logging.getLogger(__name__)
+
+# ワーカーを固定するCookie名
+STICKY_COOKIE = "st_worker"
+# ヘルスチェックの間隔（ミリ秒）とタイムアウト（秒）
+HEALTH_CHECK_INTERVAL_MS = 5000
+HEALTH_CHECK_TIMEOUT = 3
+# 連続でこの回数ヘルスチェックに失敗したワーカーは再起動
+MAX_HEALTH_FAILURES = 3
+# 起動直後はヘルスチェックの失敗を数えない猶予（秒）
+STARTUP_GRACE_SECONDS = 60
+# 中継しないヘッダー（hop-by-hop と、Tornado が付け直すもの）
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+    "trailers", "transfer-encoding", "upgrade", "content-length", "host",
+}
+
+class Worker:
+    """1つのStreamlitワーカープロセス"""
+
+    def __init__(self, index: int, port: int, command: List[str], env: Dict[str, str]):
+        self.index = index
+        self.port = port
+        self.command = command
+        self.env = env
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at = 0.0
+        self.healthy = False  # 新しいセッションを振り分けてよいか（直近のヘルスチェックに成功）
+        self.ready = False  # 起動後にヘルスチェックに成功したか（固定済みのブラウザを送ってよいか）
+        self.failures = 0
+        self.connections = 0  # 中継中のWebSocket数
+
+    @property
+    def alive(self) -> bool:
+        """プロセスが動いているか"""
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> None:
+        self.process = subprocess.Popen(self.command + [
+            "--server.port", str(self.port),
+            "--server.address", "127.0.0.1",
+            "--server.headless", "true",
+        ], env=self.env)
+        self.started_at = time.monotonic()
+        self.healthy = False
+        self.ready = False
+        self.failures = 0
+        logger.info(f"ワーカー{self.index}を起動しました (port={self.port}, pid={self.process.pid})")
+
+    def stop(self, timeout: float = 10) -> None:
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def restart(self) -> None:
+        logger.warning(f"ワーカー{self.index}を再起動します (port={self.port})")
+        self.stop()
+        self.start()
+
+class WorkerPool:
+    """ワーカーの起動・ヘルスチェック・再起動と振り分け先の選択"""
+
+    def __init__(self, workers: List[Worker]):
+        self.workers = workers
+        self._next = 0
+
+    @classmethod
+    def create(cls, count: int, first_port: int, app_path: str = "app.py") -> "WorkerPool":
+        """空いているポートを count 個確保してワーカーを作成（起動はしない）"""
+        env = os.environ.copy()
+        # Cookie署名の鍵をワーカー間で共有し、ワーカーが替わってもCookieを検証できるようにする
+        env.setdefault("STREAMLIT_SERVER_COOKIE_SECRET", secrets.token_hex(32))
+        command = [sys.executable, "-m", "streamlit", "run", app_path]
+        workers = []
+        port = first_port
+        for index in range(count):
+            port = find_free_port(port)
+            workers.append(Worker(index, port, command, env))
+            port += 1
+        return cls(workers)
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self) -> None:
+        for worker in self.workers:
+            worker.stop()
+
+    def get(self, index: Optional[int]) -> Optional[Worker]:
+        """
+        固定先のワーカー（プロセスが動いていて、起動後にヘルスチェックに成功している場合のみ）
+
+        直近のヘルスチェックに失敗していても返す（固定を外すとそのワーカーのセッションが失われるため）。
+        """
+        if index is not None and 0 <= index < len(self.workers):
+            worker = self.workers[index]
+            if worker.alive and worker.ready:
+                return worker
+        return None
+
+    def choose(self) -> Optional[Worker]:
+        """新しいセッションの振り分け先（接続数が最少の稼働中ワーカー、同数なら順番）"""
+        healthy = [w for w in self.workers if w.healthy]
+        if not healthy:
+            return None
+        self._next = (self._next + 1) % len(self.workers)
+        return min(healthy, key=lambda w: (w.connections, (w.index - self._next) % len(self.workers)))
+
+    async def check_health(self) -> None:
+        """全ワーカーのヘルスチェック（終了・連続失敗のワーカーは再起動）"""
+        client = httpclient.AsyncHTTPClient()
+        loop = asyncio.get_running_loop()
+
+        async def check(worker: Worker) -> None:
+            if not worker.alive:
+                worker.healthy = False
+                worker.ready = False
+                await loop.run_in_executor(None, worker.restart)
+                return
+            try:
+                response = await client.fetch(
+                    f"{worker.base_url}/_stcore/health", request_timeout=HEALTH_CHECK_TIMEOUT, raise_error=False
+                )
+                ok = response.code == 200
+            except Exception:
+                ok = False
+            if ok:
+                if not worker.healthy:
+                    logger.info(f"ワーカー{worker.index}が稼働中になりました")
+                worker.healthy = True
+                worker.ready = True
+                worker.failures = 0
+                return
+            # 新しいセッションは他のワーカーへ振り分けるが、固定済みのブラウザはそのまま送る
+            worker.healthy = False
+            if time.monotonic() - worker.started_at < STARTUP_GRACE_SECONDS:
+                return
+            worker.failures += 1
+            if worker.failures >= MAX_HEALTH_FAILURES:
+                # 固定を外し、停止待ちでプロキシを止めないよう別スレッドで再起動
+                worker.ready = False
+                await loop.run_in_executor(None, worker.restart)
+
+        await asyncio.gather(*(check(worker) for worker in self.workers))
+
+    def status(self) -> List[Dict[str, object]]:
+        return [
+            {
+                "index": w.index,
+                "port": w.port,
+                "pid": w.process.pid if w.process else None,
+                "healthy": w.healthy,
+                "ready": w.ready,
+                "connections": w.connections,
+            }
+            for w in self.workers
+        ]
+
+def _sticky_worker(handler: web.RequestHandler, pool: WorkerPool) -> Optional[Worker]:
+    """Cookieの固定先、なければ新しい振り分け先を返し、Cookieを更新する"""
+    value = handler.get_cookie(STICKY_COOKIE)
+    worker = pool.get(int(value)) if value and value.isdigit() else None
+    if worker is None:
+        worker = pool.choose()
+        if worker is not None:
+            handler.set_cookie(STICKY_COOKIE, str(worker.index), path="/", httponly=True, samesite="Lax")
+    return worker
+
+def _forward_headers(request: httputil.HTTPServerRequest) -> httputil.HTTPHeaders:
+    headers = httputil.HTTPHeaders()
+    for name, value in request.headers.get_all():
+        if name.lower() not in HOP_BY_HOP_HEADERS:
+            headers.add(name, value)
+    headers["X-Forwarded-For"] = request.remote_ip
+    headers["X-Forwarded-Proto"] = request.protocol
+    headers["X-Forwarded-Host"] = request.host
+    return headers
+
+class ProxyHealthHandler(web.RequestHandler):
+    """プロキシ自身の状態（稼働中ワーカーが1つ以上あれば200）"""
+
+    def initialize(self, pool: WorkerPool):
+        self.pool = pool
+
+    def get(self):
+        status = self.pool.status()
+        self.set_status(200 if any(w["healthy"] for w in status) else 503)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps({"workers": status}))
+
+class StreamProxyHandler(websocket.WebSocketHandler):
+    """StreamlitのWebSocket（/_stcore/stream）を固定先ワーカーへ中継"""
+
+    def initialize(self, pool: WorkerPool):
+        self.pool = pool
+        self.worker: Optional[Worker] = None
+        self.upstream: Optional[websocket.WebSocketClientConnection] = None
+
+    def check_origin(self, origin):
+        # オリジンの検証は転送先のStreamlitに任せる
+        return True
+
+    def select_subprotocol(self, subprotocols):
+        # Streamlitは先頭のサブプロトコルを採用する（2番目以降はセッション情報）
+        return subprotocols[0] if subprotocols else None
+
+    def prepare(self):
+        # ハンドシェイクの応答でCookieを返せるよう、接続前に振り分け先を決める
+        self.worker = _sticky_worker(self, self.pool)
+        if self.worker is None:
+            raise web.HTTPError(503)
+
+    async def open(self, *args, **kwargs):
+        request = httpclient.HTTPRequest(
+            f"ws://127.0.0.1:{self.worker.port}{self.request.uri}",
+            headers={
+                name: value for name, value in self.request.headers.get_all()
+                if name.lower() in ("cookie", "user-agent", "accept-language")
+            },
+        )
+        subprotocols = [p.strip() for p in self.request.headers.get("Sec-WebSocket-Protocol", "").split(",") if p.strip()]
+        try:
+            upstream = await websocket.websocket_connect(
+                request, subprotocols=subprotocols or None, on_message_callback=self._on_upstream_message
+            )
+        except Exception as e:
+            logger.error(f"ワーカー{self.worker.index}へのWebSocket接続エラー: {e}")
+            self.close(code=1011, reason="worker unavailable")
+            return
+        if self.ws_connection is None or self.ws_connection.is_closing():
+            # 接続待ちの間にブラウザが切断した（on_close は実行済みのため、ここで閉じて数えない）
+            upstream.close()
+            return
+        self.upstream = upstream
+        self.worker.connections += 1
+
+    def _on_upstream_message(self, message):
+        if message is None:
+            # ワーカー側が切断（再起動など）した場合はブラウザ側も閉じて再接続させる
+            self.close()
+            return
+        try:
+            self.write_message(message, binary=isinstance(message, bytes))
+        except websocket.WebSocketClosedError:
+            pass
+
+    async def on_message(self, message):
+        if self.upstream is not None:
+            await self.upstream.write_message(message, binary=isinstance(message, bytes))
+
+    def on_close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+            self.upstream = None
+            self.worker.connections -= 1
+
+class HttpProxyHandler(web.RequestHandler):
+    """通常のHTTPリクエストを固定先ワーカーへ中継"""
+
+    SUPPORTED_METHODS = ("GET", "HEAD", "POST", "PUT", "DELETE", "PATCH", "OPTIONS")
+
+    def initialize(self, pool: WorkerPool):
+        self.pool = pool
+
+    def check_xsrf_cookie(self):
+        # XSRFの検証は転送先のStreamlitに任せる
+        pass
+
+    async def _proxy(self, *args):
+        worker = _sticky_worker(self, self.pool)
+        if worker is None:
+            self.set_status(503)
+            self.set_header("Retry-After", "5")
+            self.finish("No healthy worker")
+            return
+
+        method = self.request.method
+        request = httpclient.HTTPRequest(
+            f"{worker.base_url}{self.request.uri}",
+            method=method,
+            headers=_forward_headers(self.request),
+            body=self.request.body if method in ("POST", "PUT", "PATCH", "DELETE") else None,
+            allow_nonstandard_methods=True,
+            follow_redirects=False,
+            decompress_response=False,
+            request_timeout=600,
+        )
+        try:
+            response = await httpclient.AsyncHTTPClient().fetch(request, raise_error=False)
+        except Exception as e:
+            logger.error(f"ワーカー{worker.index}への中継エラー: {e}")
+            self.set_status(502)
+            self.finish("Bad gateway")
+            return
+
+        if response.code == 599:
+            self.set_status(502)
+            self.finish("Bad gateway")
+            return
+        self.set_status(response.code, response.reason)
+        # 既定のヘッダー（Content-Type など）は転送先の応答で置き換える（振り分けのCookieは残る）
+        upstream_headers = [
+            (name, value) for name, value in response.headers.get_all() if name.lower() not in HOP_BY_HOP_HEADERS
+        ]
+        for name in {name for name, _ in upstream_headers}:
+            self.clear_header(name)
+        for name, value in upstream_headers:
+            self.add_header(name, value)
+        if response.body and method != "HEAD":
+            self.write(response.body)
+        self.finish()
+
+    get = head = post = put = delete = patch = options = _proxy
+
+def make_app(pool: WorkerPool) -> web.Application:
+    return web.Application([
+        (r"/_proxy/health", ProxyHealthHandler, {"pool": pool}),
+        (r"/_stcore/stream", StreamProxyHandler, {"pool": pool}),
+        (r"/.*", HttpProxyHandler, {"pool": pool}),
+    ], websocket_max_message_size=200 * 1024 * 1024)
+
+async def _run(pool: WorkerPool, port: int, address: str) -> None:
+    app = make_app(pool)
+    server = app.listen(port, address)
+    logger.info(f"プロキシを起動しました: http://{address}:{port} (ワーカー{len(pool.workers)}個)")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    health_check = PeriodicCallback(pool.check_health, HEALTH_CHECK_INTERVAL_MS)
+    health_check.start()
+    await pool.check_health()
+    await stop.wait()
+    logger.info("終了シグナルを受信しました。ワーカーを停止します")
+    health_check.stop()
+    server.stop()
+
+def serve(workers: int, port: int, address: str = "0.0.0.0", app_path: str = "app.py") -> None:
+    """
+    ワーカーを起動し、プロキシで待ち受ける（終了シグナルでワーカーも停止）
+
+    Args:
+        workers (int): ワーカー数
+        port (int): プロキシの待ち受けポート
+        address (str): プロキシの待ち受けアドレス
+        app_path (str): Streamlitアプリのスクリプト
+    """
+    pool = WorkerPool.create(workers, port + 1, app_path)
+    pool.start()
+    try:
+        asyncio.run(_run(pool, port, address))
+    finally:
+        pool.stop()